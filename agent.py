@@ -3,23 +3,42 @@ Agente AI per Mental Wellness Journal
 Gestisce le conversazioni con l'utente usando OpenAI API
 """
 
-from openai import OpenAI
-from typing import List, Dict, Optional
+import asyncio
+from typing import Dict, Iterator, List, Optional, Tuple
 import config
+import prompts
+from llm_client import acomplete, complete, get_client
+from context_window import ContextWindow
+from keyword_matcher import CRISIS, keyword_matcher
+from llm_transport import CircuitOpenError
 from datetime import date
 
 
+# Comandi con cui l'utente chiude la conversazione
+END_COMMANDS = ("fine", "basta", "stop", "termina")
+
+
 class MentalWellnessAgent:
     """Agente AI conversazionale per il diario del benessere mentale"""
 
     def __init__(self):
-        """Inizializza l'agente con API OpenAI"""
-        if not config.OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY non trovata! Controlla il file .env")
-
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
+        """Inizializza l'agente con il client OpenAI condiviso dal processo"""
+        self.client = get_client()
         self.conversation_history: List[Dict] = []
         self.session_started = False
+        self.last_result: Optional[Dict] = None
+        self._turn_start = 0
+
+        # Riassunto dei messaggi conversation_history[1:summarized_until]
+        self.context = ContextWindow(config.CONTEXT_MAX_TOKENS, config.CONTEXT_KEEP_TURNS)
+        self.context_summary: Optional[str] = None
+        self.summarized_until = 0
+
+        # Bozza del log aggiornata durante la chat: copre conversation_history[:drafted_until]
+        # ed è stata scritta a partire da draft_existing (log già presente per la giornata)
+        self.journal_draft: Optional[str] = None
+        self.drafted_until = 0
+        self.draft_existing: Optional[str] = None
 
     def start_session(self, user_name: Optional[str] = None,
                       context: Optional[str] = None) -> str:
@@ -35,18 +54,12 @@ class MentalWellnessAgent:
         """
         self.session_started = True
         self.conversation_history = []
+        self.context_summary = None
+        self.summarized_until = 0
 
-        # Costruisci system prompt personalizzato
-        system_prompt = config.SYSTEM_PROMPT
-
-        if context:
-            system_prompt += f"\n\nContesto dalle sessioni precedenti:\n{context}"
-
-        # Aggiungi system message
-        self.conversation_history.append({
-            "role": "system",
-            "content": system_prompt
-        })
+        # System prompt fisso, poi il contesto personale in un messaggio a parte
+        # (il prefisso comune a tutti gli utenti resta identico)
+        self.conversation_history.extend(prompts.chat_system_messages(context))
 
         # Genera messaggio di apertura
         greeting = self._generate_greeting(user_name)
@@ -74,22 +87,17 @@ class MentalWellnessAgent:
 
         return opening
 
-    def chat(self, user_message: str) -> Dict:
+    def _begin_turn(self, user_message: str) -> Dict:
         """
-        Invia un messaggio e ricevi la risposta dell'agente
-
-        Args:
-            user_message: Il messaggio dell'utente
-
-        Returns:
-            Dict con:
-                - response: risposta dell'agente
-                - should_end: True se la conversazione dovrebbe terminare
-                - crisis_detected: True se sono state rilevate parole di crisi
+        Registra il messaggio utente e gestisce crisi e comandi di terminazione
+        Returns: risultato del turno se non serve chiamare l'AI, altrimenti {"should_end": bool}
         """
         if not self.session_started:
             raise RuntimeError("Sessione non iniziata! Chiama start_session() prima")
 
+        # Punto a cui riportare la history se la chiamata al modello fallisce
+        self._turn_start = len(self.conversation_history)
+
         # Aggiungi messaggio utente alla history
         self.conversation_history.append({
             "role": "user",
@@ -112,7 +120,7 @@ class MentalWellnessAgent:
             }
 
         # Verifica comandi di terminazione
-        should_end = user_message.lower().strip() in ["fine", "basta", "stop", "termina"]
+        should_end = user_message.lower().strip() in END_COMMANDS
 
         if should_end:
             summary_prompt = self._create_summary_prompt()
@@ -121,41 +129,190 @@ class MentalWellnessAgent:
                 "content": summary_prompt
             })
 
+        return {"should_end": should_end}
+
+    def chat(self, user_message: str) -> Dict:
+        """
+        Invia un messaggio e ricevi la risposta dell'agente
+
+        Args:
+            user_message: Il messaggio dell'utente
+
+        Returns:
+            Dict con:
+                - response: risposta dell'agente
+                - should_end: True se la conversazione dovrebbe terminare
+                - crisis_detected: True se sono state rilevate parole di crisi
+        """
+        turn = self._begin_turn(user_message)
+        if "response" in turn:
+            return turn
+        should_end = turn["should_end"]
+
         # Chiama OpenAI API
         try:
-            response = self.client.chat.completions.create(
-                model=config.MODEL_NAME,
-                messages=self.conversation_history,
-                max_tokens=config.MAX_TOKENS,
-                temperature=config.TEMPERATURE
-            )
+            response = complete("chat", self.client, **self._chat_request())
+            return self._add_reply(response.choices[0].message.content, should_end)
 
-            assistant_message = response.choices[0].message.content
+        except Exception as e:
+            return self._error_result(e)
 
-            # Aggiungi risposta alla history
-            self.conversation_history.append({
-                "role": "assistant",
-                "content": assistant_message
-            })
+    async def achat(self, user_message: str) -> Dict:
+        """Versione asincrona di chat() (stesso risultato)"""
+        turn = self._begin_turn(user_message)
+        if "response" in turn:
+            return turn
 
-            return {
-                "response": assistant_message,
-                "should_end": should_end,
-                "crisis_detected": False
-            }
+        try:
+            response = await acomplete("chat", **self._chat_request())
+            return self._add_reply(response.choices[0].message.content, turn["should_end"])
 
         except Exception as e:
-            error_message = f"❌ Errore nella comunicazione con AI: {str(e)}"
-            return {
-                "response": error_message,
-                "should_end": True,
-                "crisis_detected": False
-            }
+            return self._error_result(e)
+
+    def chat_stream(self, user_message: str) -> Iterator[str]:
+        """
+        Come chat(), ma restituisce la risposta un pezzo alla volta man mano che arriva
+
+        Args:
+            user_message: Il messaggio dell'utente
+
+        Yields:
+            Frammenti di testo della risposta. A stream concluso la risposta è nella
+            history e self.last_result ha lo stesso formato del risultato di chat()
+        """
+        self.last_result = None
+        turn = self._begin_turn(user_message)
+        if "response" in turn:
+            self.last_result = turn
+            yield turn["response"]
+            return
+        should_end = turn["should_end"]
+
+        parts = []
+        stream = None
+        try:
+            stream = complete("chat_stream", self.client, stream=True, **self._chat_request())
+
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    parts.append(delta)
+                    yield delta
+
+        except Exception as e:
+            self.last_result = self._error_result(e)
+            yield self.last_result["response"]
+            return
+
+        finally:
+            # Rilascia subito la connessione al pool anche se il client si disconnette
+            if stream is not None:
+                stream.close()
+
+        self.last_result = self._add_reply("".join(parts), should_end)
+
+    def _chat_request(self) -> Dict:
+        """Parametri della richiesta per il prossimo turno di chat"""
+        return {
+            "model": config.MODEL_NAME,
+            "messages": self._context_messages(),
+            "max_tokens": config.MAX_TOKENS,
+            "temperature": config.TEMPERATURE
+        }
+
+    def _add_reply(self, assistant_message: str, should_end: bool) -> Dict:
+        """Aggiunge la risposta alla history e ritorna il risultato del turno"""
+        self.conversation_history.append({
+            "role": "assistant",
+            "content": assistant_message
+        })
+        return {
+            "response": assistant_message,
+            "should_end": should_end,
+            "crisis_detected": False
+        }
+
+    def _error_result(self, error: Exception) -> Dict:
+        """
+        Turno fallito dopo deadline e retry: la history torna com'era prima del messaggio
+        e la sessione resta aperta, così l'utente può semplicemente riprovare
+        """
+        del self.conversation_history[self._turn_start:]
+
+        if isinstance(error, CircuitOpenError):
+            message = "⏳ Il servizio AI è momentaneamente non disponibile. Riprova tra qualche istante."
+        else:
+            message = f"❌ Errore nella comunicazione con AI: {str(error)}. Riprova."
+        return {
+            "response": message,
+            "should_end": False,
+            "crisis_detected": False,
+            "error": True
+        }
+
+    def _context_messages(self) -> List[Dict]:
+        """Messaggi da mandare al modello: system prompt, riassunto e turni recenti"""
+        return self.context.build(self.conversation_history, self.context_summary,
+                                  self.summarized_until)
+
+    def _fold_request(self) -> Optional[Tuple[int, Dict]]:
+        """(fine dell'intervallo da riassumere, richiesta) o None se non serve riassumere"""
+        fold = self.context.fold_range(self.conversation_history, self.context_summary,
+                                       self.summarized_until)
+        if fold is None:
+            return None
+
+        start, end = fold
+        return end, {
+            "model": config.MODEL_NAME,
+            "messages": prompts.context_fold_messages(
+                self.context_summary, self._format_messages(self.conversation_history[start:end])
+            ),
+            "max_tokens": config.CONTEXT_SUMMARY_MAX_TOKENS,
+            "temperature": 0.3
+        }
+
+    def _update_context_summary(self):
+        """
+        Aggiunge al riassunto i turni usciti dalla finestra di contesto (se ce ne sono)
+        Non fa parte del turno di chat: il chiamante lo esegue dopo aver mostrato la risposta
+        (la web app in background, vedi _schedule_summary in app.py)
+        """
+        fold = self._fold_request()
+        if fold is None:
+            return
+
+        end, request = fold
+        try:
+            response = complete("_update_context_summary", self.client, **request)
+            self.context_summary = response.choices[0].message.content.strip()
+            self.summarized_until = end
+
+        except Exception as e:
+            # Senza riassunto si continua a mandare anche i turni vecchi
+            print(f"Errore aggiornamento riassunto conversazione: {e}")
+
+    async def _aupdate_context_summary(self):
+        """Versione asincrona di _update_context_summary()"""
+        fold = self._fold_request()
+        if fold is None:
+            return
+
+        end, request = fold
+        try:
+            response = await acomplete("_update_context_summary", **request)
+            self.context_summary = response.choices[0].message.content.strip()
+            self.summarized_until = end
+
+        except Exception as e:
+            print(f"Errore aggiornamento riassunto conversazione: {e}")
 
     def _check_crisis_keywords(self, message: str) -> bool:
         """Verifica se il messaggio contiene parole che indicano crisi"""
-        message_lower = message.lower()
-        return any(keyword in message_lower for keyword in config.CRISIS_KEYWORDS)
+        return keyword_matcher.contains(message, CRISIS)
 
     def _create_summary_prompt(self) -> str:
         """Crea un prompt per far riassumere la conversazione all'AI"""
@@ -175,90 +332,157 @@ class MentalWellnessAgent:
         Returns:
             Testo narrativo del diario
         """
-        # Conta quanti messaggi reali ha scritto l'utente (escluso "fine")
-        user_messages = [msg for msg in self.conversation_history 
-                        if msg["role"] == "user" and msg["content"].lower().strip() not in ["fine", "basta", "stop", "termina"]]
-        
-        num_user_messages = len(user_messages)
-        
-        # Calcola lunghezza target basata sulla conversazione
-        if num_user_messages <= 2:
-            target_words = "20-30"
-            max_tokens = 80
-        elif num_user_messages <= 4:
-            target_words = "40-60"
-            max_tokens = 120
-        elif num_user_messages <= 7:
-            target_words = "80-100"
-            max_tokens = 180
-        else:
-            target_words = "120-150"
-            max_tokens = 250
-        
-        # Prepara prompt per generazione log
-        if existing_entry:
-            # C'è già un log oggi - aggiorna combinando vecchio e nuovo
-            prompt = f"""Hai già scritto questo log oggi:
+        # Bozza già aggiornata all'ultimo messaggio dell'utente: nessuna chiamata
+        if self._draft_is_current(existing_entry):
+            return self.journal_draft
 
-"{existing_entry}"
+        try:
+            response = complete("generate_journal_entry", self.client, cache=True,
+                                **self._journal_request(existing_entry))
+            return response.choices[0].message.content.strip()
 
-Ora, basandoti sulla NUOVA conversazione che abbiamo appena avuto, aggiorna il log combinando le informazioni.
+        except Exception as e:
+            return f"[Errore nella generazione del log: {str(e)}]"
 
-REGOLE CRITICHE:
-- Mantieni tutto ciò che era nel log precedente
-- Aggiungi SOLO le nuove informazioni dalla conversazione appena conclusa
-- Scrivi in prima persona (uso "io", "mi sono sentito", ecc.)
-- Lunghezza totale TARGET: {target_words} parole (MASSIMO)
-- USA SOLO informazioni ESPLICITAMENTE menzionate
-- NON inventare dettagli o emozioni non dette
-- Stile: semplice, diretto, cronologico
+    async def agenerate_journal_entry(self, existing_entry: Optional[str] = None) -> str:
+        """Versione asincrona di generate_journal_entry()"""
+        try:
+            return await self.agenerate_journal_text(existing_entry)
 
-Genera il log aggiornato che include sia il contenuto precedente che le nuove informazioni:
-"""
-        else:
-            # Primo log della giornata
-            prompt = f"""Basandoti SOLO sulla conversazione che abbiamo avuto, genera un log di diario in prima persona.
-
-REGOLE CRITICHE:
-- Scrivi dal punto di vista dell'utente (usa "io", "mi sono sentito", ecc.)
-- Lunghezza TARGET: {target_words} parole (MASSIMO)
-- USA SOLO informazioni ESPLICITAMENTE menzionate dall'utente
-- NON inventare dettagli, emozioni o riflessioni non dette
-- NON aggiungere interpretazioni psicologiche
-- NON espandere o elaborare oltre ciò che è stato detto
-- Se l'utente ha scritto poco, il log DEVE essere molto breve
-- Stile: semplice, diretto, fedele alle parole dell'utente
-
-Esempio per conversazione BREVE (2-3 messaggi):
-"Oggi è andata tutto bene. Ho fatto una challenge di programmazione che mi è piaciuta."
-
-Ora genera il log basandoti SOLO su ciò che l'utente ha effettivamente scritto:
-"""
+        except Exception as e:
+            return f"[Errore nella generazione del log: {str(e)}]"
+
+    async def agenerate_journal_text(self, existing_entry: Optional[str] = None) -> str:
+        """
+        Come agenerate_journal_entry() ma gli errori del modello vengono sollevati invece di
+        finire nel testo del log (per i job in background, che possono ritentare)
+        """
+        if self._draft_is_current(existing_entry):
+            return self.journal_draft
+
+        response = await acomplete("generate_journal_entry", cache=True,
+                                   **self._journal_request(existing_entry))
+        return response.choices[0].message.content.strip()
 
-        # Crea una nuova conversazione solo per questo task
-        messages = [
-            {"role": "system", "content": "Sei un assistente che trascrive fedelmente ciò che l'utente ha detto, senza aggiungere nulla. Sii MOLTO conciso e letterale."},
-            {"role": "user",
-             "content": f"Ecco la conversazione:\n\n{self._format_conversation_for_summary()}\n\n{prompt}"}
-        ]
+    # ========== BOZZA INCREMENTALE DEL LOG ==========
 
+    def update_journal_draft(self, existing_entry: Optional[str] = None) -> bool:
+        """
+        Aggiorna la bozza del log con i messaggi arrivati dopo l'ultima bozza
+        (pensato per girare in background dopo ogni turno: alla chiusura il log è quasi pronto)
+
+        Returns:
+            True se la bozza è stata aggiornata
+        """
+        if self._draft_is_current(existing_entry):
+            return False
+
+        end = len(self.conversation_history)
         try:
-            response = self.client.chat.completions.create(
-                model=config.MODEL_NAME,
-                messages=messages,
-                max_tokens=max_tokens,
-                temperature=0.3  # Ridotta per essere più fedele
-            )
+            response = complete("update_journal_draft", self.client, **self._journal_request(existing_entry))
+            self._set_draft(response.choices[0].message.content.strip(), end, existing_entry)
+            return True
 
-            return response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"Errore aggiornamento bozza del log: {e}")
+            return False
+
+    async def aupdate_journal_draft(self, existing_entry: Optional[str] = None) -> bool:
+        """Versione asincrona di update_journal_draft()"""
+        if self._draft_is_current(existing_entry):
+            return False
+
+        end = len(self.conversation_history)
+        try:
+            response = await acomplete("update_journal_draft", **self._journal_request(existing_entry))
+            self._set_draft(response.choices[0].message.content.strip(), end, existing_entry)
+            return True
 
         except Exception as e:
-            return f"[Errore nella generazione del log: {str(e)}]"
+            print(f"Errore aggiornamento bozza del log: {e}")
+            return False
+
+    def _set_draft(self, draft: str, drafted_until: int, existing_entry: Optional[str]):
+        self.journal_draft = draft
+        self.drafted_until = drafted_until
+        self.draft_existing = existing_entry
+
+    def _draft_usable(self, existing_entry: Optional[str]) -> bool:
+        """La bozza è stata scritta a partire dallo stesso log esistente"""
+        return self.journal_draft is not None and self.draft_existing == existing_entry
+
+    def _draft_is_current(self, existing_entry: Optional[str]) -> bool:
+        """La bozza copre tutti i messaggi dell'utente (dopo restano solo risposte e "fine")"""
+        return (self._draft_usable(existing_entry)
+                and not self._user_messages(self.conversation_history[self.drafted_until:]))
+
+    def _user_messages(self, messages: List[Dict]) -> List[Dict]:
+        """Messaggi scritti davvero dall'utente (esclusi "fine" e la richiesta di riepilogo)"""
+        summary_prompt = self._create_summary_prompt()
+        return [msg for msg in messages
+                if msg["role"] == "user"
+                and msg["content"].lower().strip() not in END_COMMANDS
+                and msg["content"] != summary_prompt]
+
+    @staticmethod
+    def _target_length(num_user_messages: int) -> Tuple[str, int]:
+        """Lunghezza target del log (parole) e max_tokens in base ai messaggi dell'utente"""
+        if num_user_messages <= 2:
+            return "20-30", 80
+        elif num_user_messages <= 4:
+            return "40-60", 120
+        elif num_user_messages <= 7:
+            return "80-100", 180
+        return "120-150", 250
+
+    def _draft_request(self) -> Dict:
+        """Richiesta che aggiorna la bozza con i soli messaggi non ancora inclusi"""
+        target_words, max_tokens = self._target_length(len(self._user_messages(self.conversation_history)))
+        summary_prompt = self._create_summary_prompt()
+        new_messages = self._format_messages(
+            msg for msg in self.conversation_history[self.drafted_until:]
+            if msg["content"] != summary_prompt
+        )
+
+        return {
+            "model": config.MODEL_NAME,
+            "messages": prompts.journal_draft_messages(self.journal_draft, new_messages, target_words),
+            "max_tokens": max_tokens,
+            "temperature": 0.3
+        }
+
+    def _journal_request(self, existing_entry: Optional[str]) -> Dict:
+        """Parametri della richiesta per generare il log giornaliero"""
+        # Con una bozza compatibile basta aggiornarla con gli ultimi messaggi
+        if self._draft_usable(existing_entry):
+            return self._draft_request()
+
+        # Conta quanti messaggi reali ha scritto l'utente (escluso "fine")
+        num_user_messages = len(self._user_messages(self.conversation_history))
+
+        # Calcola lunghezza target basata sulla conversazione
+        target_words, max_tokens = self._target_length(num_user_messages)
+
+        # Istruzioni fisse nel system prompt, conversazione e lunghezza in fondo
+        messages = prompts.journal_messages(self._format_conversation_for_summary(),
+                                            target_words, existing_entry)
+
+        return {
+            "model": config.MODEL_NAME,
+            "messages": messages,
+            "max_tokens": max_tokens,
+            "temperature": 0.3  # Ridotta per essere più fedele
+        }
 
     def _format_conversation_for_summary(self) -> str:
         """Formatta la conversazione per il riassunto"""
+        return self._format_messages(self.conversation_history)
+
+    @staticmethod
+    def _format_messages(messages) -> str:
+        """Trascrizione "User: ..." / "AI: ..." dei messaggi (senza quelli di sistema)"""
         formatted = []
-        for msg in self.conversation_history:
+        for msg in messages:
             if msg["role"] == "system":
                 continue
             role = "AI" if msg["role"] == "assistant" else "User"
@@ -276,18 +500,17 @@ Ora genera il log basandoti SOLO su ciò che l'utente ha effettivamente scritto:
         Returns:
             Dict con conteggi delle emozioni rilevate
         """
-        emotions = {emotion: 0 for emotion in config.EMOTION_KEYWORDS.keys()}
-
-        # Concatena tutti i messaggi dell'utente
-        user_text = " ".join([
-            msg["content"].lower()
+        # Concatena tutti i messaggi dell'utente (una riga per messaggio)
+        user_text = "\n".join(
+            msg["content"]
             for msg in self.conversation_history
             if msg["role"] == "user"
-        ])
+        )
 
-        # Conta occorrenze keywords
-        for emotion, keywords in config.EMOTION_KEYWORDS.items():
-            for keyword in keywords:
-                emotions[emotion] += user_text.count(keyword)
+        # Conta occorrenze keywords in un solo passaggio
+        counts = keyword_matcher.scan(user_text)
+        return {emotion: counts[emotion] for emotion in config.EMOTION_KEYWORDS}
 
-        return emotions
\ No newline at end of file
+    async def aextract_emotions(self) -> Dict[str, int]:
+        """Versione asincrona di extract_emotions() (in un thread, senza bloccare il loop)"""
+        return await asyncio.to_thread(self.extract_emotions)
\ No newline at end of file
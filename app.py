@@ -3,21 +3,95 @@ Flask Application - Mental Wellness Journal
 Backend API per interfaccia web
 """
 
-from flask import Flask, render_template, request, jsonify, session
+from flask import Flask, render_template, request, jsonify, session, g, Response, stream_with_context
 from datetime import date, datetime
+import asyncio
+import hmac
+import json
+import os
 import secrets
+import threading
+import uuid
 
 # Import moduli esistenti
-from storage import Storage
+from storage import StoragePool, has_editor_text
+from chat_sessions import create_session_store
+from job_queue import job_queue
+from llm_cache import response_cache
+from llm_client import run_async, spawn
+from llm_transport import transport, CircuitOpenError, TRANSIENT_ERRORS
+from llm_metrics import metrics as llm_metrics
 from agent import MentalWellnessAgent
-from wellness_agent import WellnessAgent
+from entry_index import bitmap_days
+from wellness_agent import WellnessAgent, get_quick_tip
 import config
 
+
+def _load_secret_key() -> str:
+    """
+    Chiave per firmare il cookie di sessione: da FLASK_SECRET_KEY o dal file in DATA_DIR,
+    creato una sola volta (O_EXCL) e poi letto da tutti i worker
+    """
+    if config.SECRET_KEY:
+        return config.SECRET_KEY
+    os.makedirs(os.path.dirname(config.SECRET_KEY_PATH) or ".", exist_ok=True)
+    try:
+        fd = os.open(config.SECRET_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+    except FileExistsError:
+        pass
+    with open(config.SECRET_KEY_PATH, 'r') as f:
+        return f.read().strip()
+
+
 app = Flask(__name__)
-app.secret_key = secrets.token_hex(16)
+app.secret_key = _load_secret_key()
+
+# Storage per utente (LRU limitato)
+storage_pool = StoragePool(config.STORAGE_POOL_SIZE)
+
+# Stato delle chat lato server (nel cookie di sessione c'è solo chat_id)
+chat_store = create_session_store()
+
+# Chat con un aggiornamento della bozza del log già in corso (uno alla volta per chat)
+# Aggiornamenti in background (bozza del log, riassunto) in corso, per chiave nello store
+_in_flight = set()
+_in_flight_lock = threading.Lock()
 
-# Inizializza storage
-storage = Storage()
+
+def _request_user_id():
+    """
+    Id utente della richiesta: l'header del proxy vale solo se la richiesta porta il
+    segreto condiviso (quando configurato). In modalità multi-utente header e segreto
+    sono obbligatori. Solleva PermissionError se la richiesta non è autenticata
+    """
+    if config.PROXY_SECRET is not None:
+        supplied = request.headers.get(config.PROXY_SECRET_HEADER, '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), config.PROXY_SECRET.encode('utf-8')):
+            raise PermissionError('Richiesta non autenticata dal proxy')
+
+    user_id = request.headers.get(config.USER_ID_HEADER)
+    if config.REQUIRE_USER_HEADER:
+        if config.PROXY_SECRET is None:
+            raise PermissionError('Modalità multi-utente senza JOURNAL_PROXY_SECRET')
+        if not user_id:
+            raise PermissionError(f'Header {config.USER_ID_HEADER} mancante')
+        return user_id
+    return user_id or config.DEFAULT_USER_ID
+
+
+@app.before_request
+def bind_user_storage():
+    """Associa alla richiesta lo storage dell'utente indicato dal proxy di autenticazione"""
+    try:
+        user_id = _request_user_id()
+        g.storage = storage_pool.get(user_id)
+        g.user_id = user_id
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 401
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
 
 # ===== ROUTES - PAGES =====
@@ -26,7 +100,7 @@ storage = Storage()
 def index():
     """Pagina principale"""
     # Carica profilo utente
-    profile = storage.load_user_profile()
+    profile = g.storage.load_user_profile()
 
     # Prepara dati per template
     context = {
@@ -42,13 +116,12 @@ def index():
 @app.route('/stats')
 def stats_page():
     """Pagina statistiche completa"""
-    profile = storage.load_user_profile()
-    stats = storage.get_stats()
+    stats = g.storage.get_stats()
 
     context = {
-        'streak': profile['current_streak'],
+        'streak': stats['current_streak'],
         'stats': stats,
-        'milestones': profile['milestones_achieved']
+        'milestones': stats['milestones']
     }
 
     return render_template('stats.html', **context)
@@ -69,21 +142,12 @@ def save_entry():
         if not content:
             return jsonify({'error': 'Contenuto vuoto'}), 400
 
-        # Controlla se esiste già un log oggi
+        # Aggiunge al log di oggi (o lo crea) in un unico read-modify-write sotto lock
         today = date.today().isoformat()
-        existing_log = storage.get_today_entry_text()
-
-        # Se esiste già un log, aggiungi il nuovo contenuto
-        if existing_log:
-            # Aggiungi una separazione e il nuovo contenuto
-            combined_content = existing_log + "\n\n" + content
-            storage.save_entry(combined_content, metadata={'source': 'editor'}, entry_date=today)
-        else:
-            # Primo log della giornata
-            storage.save_entry(content, metadata={'source': 'editor'}, entry_date=today)
+        g.storage.append_to_entry(content, metadata={'source': 'editor'}, entry_date=today)
 
         # Aggiorna streak
-        streak_info = storage.update_streak()
+        streak_info = g.storage.update_streak()
 
         return jsonify({
             'success': True,
@@ -107,19 +171,26 @@ def start_chat():
         agent = MentalWellnessAgent()
 
         # Carica contesto recente
-        recent_entries = storage.get_recent_entries(num_days=3)
+        recent_entries = g.storage.get_recent_entries(num_days=3)
         context = _build_context_from_entries(recent_entries)
 
         # Profilo utente
-        profile = storage.load_user_profile()
+        profile = g.storage.load_user_profile()
         user_name = profile['preferences'].get('name')
 
         # Avvia sessione
         greeting = agent.start_session(user_name, context)
 
-        # Salva agente in sessione Flask
-        session['chat_active'] = True
-        session['chat_history'] = agent.get_conversation_history()
+        # Salva lo stato della chat lato server, nel cookie solo l'id
+        chat_id = uuid.uuid4().hex
+        chat_store.put(chat_id, {
+            'id': chat_id,
+            'user_id': g.user_id,
+            'history': agent.get_conversation_history(),
+            'persisted': 0,
+            'active': True
+        })
+        session['chat_id'] = chat_id
 
         return jsonify({
             'success': True,
@@ -144,49 +215,32 @@ def send_chat_message():
         if not user_message:
             return jsonify({'error': 'Messaggio vuoto'}), 400
 
-        # Ricrea agente con history dalla sessione
-        agent = MentalWellnessAgent()
-
-        if 'chat_history' in session:
-            agent.conversation_history = session['chat_history']
-            agent.session_started = True
-        else:
+        # Ricrea agente con la history della chat
+        state = _load_chat_state()
+        if state is None:
             return jsonify({'error': 'Sessione chat non trovata'}), 400
+        agent = _chat_agent(state)
 
         # Invia messaggio
         result = agent.chat(user_message)
 
-        # Aggiorna sessione
-        session['chat_history'] = agent.get_conversation_history()
-
-        # Se la conversazione ÃƒÂ¨ terminata, genera entry
+        # Se la conversazione è terminata, il log viene generato in background
         if result['should_end'] and not result['crisis_detected']:
-            # Controlla se esiste giÃƒÂ  un log oggi
-            today = date.today().isoformat()
-            existing_log = storage.get_today_entry_text()
-
-            # Genera entry (combinando con quello esistente se presente)
-            journal_entry = agent.generate_journal_entry(existing_entry=existing_log)
-
-            # Salva
-            emotions = agent.extract_emotions()
-            storage.save_entry(journal_entry, metadata={'source': 'chat', 'emotions_detected': emotions},
-                               entry_date=today)
-            storage.save_conversation(agent.get_conversation_history(), today)
-
-            # Aggiorna streak
-            streak_info = storage.update_streak()
-
-            session['chat_active'] = False
+            job_id = _finalize_chat(agent, state)
 
             return jsonify({
                 'success': True,
                 'response': result['response'],
                 'should_end': True,
-                'journal_entry': journal_entry,
-                'streak': streak_info['current_streak']
+                'job_id': job_id
             })
 
+        # Aggiorna stato e log della conversazione (append del solo turno nuovo)
+        _save_chat_state(agent, state)
+        if not result['should_end']:
+            _schedule_draft(state)
+            _schedule_summary(state)
+
         return jsonify({
             'success': True,
             'response': result['response'],
@@ -198,59 +252,120 @@ def send_chat_message():
         return jsonify({'error': str(e)}), 500
 
 
-@app.route('/api/chat/close', methods=['POST'])
-def close_chat():
+@app.route('/api/chat/stream', methods=['POST'])
+def stream_chat_message():
     """
-    Chiude la chat e salva automaticamente il journal entry
-    Returns: { "journal_entry": "...", "streak": ... }
+    Come /api/chat/message, ma la risposta arriva token per token (Server-Sent Events)
+    Body: { "message": "..." }
+    Eventi: "token" { "delta": "..." } ripetuto, poi "done" { "should_end": bool, ... }
+    (con "job_id" del log in generazione se la chat è conclusa) oppure "error" { "error": "..." }
     """
     try:
-        # Ricrea agente con history dalla sessione
-        agent = MentalWellnessAgent()
+        data = request.get_json()
+        user_message = data.get('message', '').strip()
 
-        if 'chat_history' not in session:
-            return jsonify({'error': 'Nessuna sessione chat attiva'}), 400
+        if not user_message:
+            return jsonify({'error': 'Messaggio vuoto'}), 400
 
-        agent.conversation_history = session['chat_history']
-        agent.session_started = True
+        state = _load_chat_state()
+        if state is None:
+            return jsonify({'error': 'Sessione chat non trovata'}), 400
+        agent = _chat_agent(state)
 
-        # Controlla se esiste già un log oggi
-        today = date.today().isoformat()
-        existing_log = storage.get_today_entry_text()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        # Genera entry (combinando con quello esistente se presente)
-        journal_entry = agent.generate_journal_entry(existing_entry=existing_log)
+    # Lo stato della chat è lato server, quindi si può aggiornare anche a stream concluso
+    @stream_with_context
+    def generate():
+        try:
+            for delta in agent.chat_stream(user_message):
+                yield _sse('token', {'delta': delta})
+
+            result = agent.last_result
+            done = {
+                'should_end': result['should_end'],
+                'crisis_detected': result.get('crisis_detected', False)
+            }
+            if result['should_end'] and not result['crisis_detected']:
+                done['job_id'] = _finalize_chat(agent, state)
+            else:
+                _save_chat_state(agent, state)
+                if not result['should_end']:
+                    _schedule_draft(state)
+                    _schedule_summary(state)
+
+            yield _sse('done', done)
+
+        except Exception as e:
+            yield _sse('error', {'error': str(e)})
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'  # niente buffering nei reverse proxy (nginx)
+    })
 
-        # Salva
-        emotions = agent.extract_emotions()
-        storage.save_entry(journal_entry, metadata={'source': 'chat', 'emotions_detected': emotions},
-                           entry_date=today)
-        storage.save_conversation(agent.get_conversation_history(), today)
 
-        # Aggiorna streak
-        streak_info = storage.update_streak()
+@app.route('/api/chat/close', methods=['POST'])
+def close_chat():
+    """
+    Chiude la chat e mette in coda la generazione del journal entry
+    Returns: { "job_id": "...", "status": "queued" } (202), stato in /api/jobs/<job_id>
+    """
+    try:
+        state = _load_chat_state()
+        if state is None:
+            return jsonify({'error': 'Nessuna sessione chat attiva'}), 400
+
+        # Chat già conclusa (close ripetuto o dopo "fine"): stesso job, senza rigenerare il log
+        if not state['active'] and 'job_id' in state:
+            job = job_queue.get(state['job_id'])
+            if job is not None:
+                return jsonify({'success': True, **_job_view(job)}), 200 if job['status'] == 'done' else 202
 
-        session['chat_active'] = False
+        # Ricrea agente con la history della chat
+        agent = _chat_agent(state)
+        job_id = _finalize_chat(agent, state)
 
         return jsonify({
             'success': True,
-            'journal_entry': journal_entry,
-            'streak': streak_info['current_streak']
-        })
+            'job_id': job_id,
+            'status': 'queued'
+        }), 202
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Stato di un job in background dell'utente
+    Returns: { "status": "queued|running|done|failed", "step": "...", ... }
+    con "journal_entry" e "streak" quando il log è pronto
+    """
+    job = job_queue.get(job_id)
+    if job is None or job['user_id'] != g.user_id:
+        return jsonify({'error': 'Job non trovato'}), 404
+    return jsonify({'success': True, **_job_view(job)})
+
+
+@app.route('/api/jobs', methods=['GET'])
+def get_job_stats():
+    """Statistiche della coda dei job in background"""
+    return jsonify({'success': True, **job_queue.stats()})
+
+
 @app.route('/api/wellness/suggestions', methods=['GET'])
 def get_wellness_suggestions():
     """
     Ottiene suggerimenti personalizzati basati sui log recenti
-    Returns: { "summary": "...", "suggestions": [...] }
+    Salvati con i dati dell'utente: rigenerati (in background) solo quando cambiano gli entries
+    Returns: { "summary": "...", "suggestions": [...], "cache": "fresh|stale|miss" }
     """
     try:
-        wellness_agent = WellnessAgent()
-        suggestions = wellness_agent.get_personalized_suggestions(num_days=7)
+        wellness_agent = WellnessAgent(storage=g.storage)
+        suggestions = run_async(wellness_agent.aget_cached_suggestions(num_days=config.SUGGESTIONS_CACHE_DAYS))
 
         return jsonify({
             'success': True,
@@ -262,11 +377,10 @@ def get_wellness_suggestions():
 
 
 @app.route('/api/wellness/quick-tip', methods=['GET'])
-def get_quick_tip():
+def quick_tip():
     """Ottiene un quick tip random"""
     try:
-        wellness_agent = WellnessAgent()
-        tip = wellness_agent.get_quick_tip()
+        tip = get_quick_tip()
 
         return jsonify({
             'success': True,
@@ -285,7 +399,7 @@ def get_recent_entries():
     """
     try:
         days = request.args.get('days', 7, type=int)
-        entries = storage.get_recent_entries(num_days=days)
+        entries = g.storage.get_recent_entries(num_days=days)
 
         return jsonify({
             'success': True,
@@ -300,37 +414,75 @@ def get_recent_entries():
 def get_stats():
     """Ottiene statistiche utente"""
     try:
-        stats = storage.get_stats()
-        profile = storage.load_user_profile()
+        stats = g.storage.get_stats()
 
         return jsonify({
             'success': True,
             'stats': stats,
-            'milestones': profile['milestones_achieved']
+            'milestones': stats['milestones']
         })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/storage/cache', methods=['GET'])
+def get_storage_cache_stats():
+    """Contatori hit/miss della cache dello storage"""
+    return jsonify({
+        'success': True,
+        'cache': g.storage.cache_stats()
+    })
+
+
+@app.route('/api/llm/metrics', methods=['GET'])
+def get_llm_metrics():
+    """Token, costo e latenze delle chiamate LLM per chiamante (per worker)"""
+    return jsonify({
+        'success': True,
+        'metrics': llm_metrics.snapshot(),
+        'transport': transport.stats()
+    })
+
+
+@app.route('/api/llm/cache', methods=['GET', 'DELETE'])
+def llm_cache_endpoint():
+    """Statistiche della cache delle risposte LLM (DELETE la svuota)"""
+    if request.method == 'DELETE':
+        removed = response_cache.clear()
+        return jsonify({'success': True, 'removed': removed})
+
+    return jsonify({
+        'success': True,
+        'cache': response_cache.stats()
+    })
+
+
+@app.route('/api/storage/locks', methods=['GET'])
+def get_storage_lock_stats():
+    """Metriche di contesa del lock dello storage (per worker)"""
+    return jsonify({
+        'success': True,
+        'locks': g.storage.lock_stats()
+    })
+
+
 @app.route('/api/calendar', methods=['GET'])
 def get_calendar():
     """
-    Ottiene calendario con giorni completati
+    Ottiene calendario con giorni completati del mese richiesto
     Query param: ?month=2025-11
     """
     try:
-        # TODO: Implementare logica calendario
-        # Per ora ritorna placeholder
         import calendar as cal
-        from datetime import datetime
 
         month_str = request.args.get('month', datetime.now().strftime('%Y-%m'))
         year, month = map(int, month_str.split('-'))
 
-        # Ottieni tutti gli entries
-        all_entries = storage.get_recent_entries(num_days=365)  # Ultimo anno
-        completed_dates = [entry['date'] for entry in all_entries]
+        # Giorni completati dalla bitmap del mese (nessun file entry aperto)
+        month_bits = g.storage.get_completion_bitmap(year, month)
+        completed_days = bitmap_days(month_bits)
+        completed_dates = [date(year, month, day).isoformat() for day in completed_days]
 
         # Genera calendario
         cal_data = cal.monthcalendar(year, month)
@@ -339,6 +491,7 @@ def get_calendar():
             'success': True,
             'calendar': cal_data,
             'completed_dates': completed_dates,
+            'completed_days': completed_days,
             'month': month,
             'year': year
         })
@@ -347,6 +500,38 @@ def get_calendar():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/calendar/heatmap', methods=['GET'])
+def get_calendar_heatmap():
+    """
+    Heatmap pluriennale: una bitmap per anno (bit i = giorno i+1 dell'anno, in esadecimale)
+    Query param: ?from=2024&to=2025 (default: ultimi 3 anni)
+    """
+    try:
+        current_year = date.today().year
+        year_to = request.args.get('to', current_year, type=int)
+        year_from = request.args.get('from', year_to - 2, type=int)
+
+        if year_to < year_from or year_to - year_from > 100:
+            return jsonify({'error': 'Intervallo di anni non valido'}), 400
+
+        years = []
+        for year in range(year_from, year_to + 1):
+            bits = g.storage.get_completion_bitmap(year)
+            years.append({
+                'year': year,
+                'bitmap': format(bits, 'x'),
+                'completed': bin(bits).count('1')
+            })
+
+        return jsonify({
+            'success': True,
+            'years': years
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/api/sentiment/data', methods=['GET'])
 def get_sentiment_data():
     """
@@ -355,7 +540,7 @@ def get_sentiment_data():
     """
     try:
         days = request.args.get('days', 30, type=int)
-        entries = storage.get_recent_entries(num_days=days)
+        emotion_rows = g.storage.get_recent_emotions(num_days=days)
 
         # Prepara dati per grafici
         dates = []
@@ -363,11 +548,9 @@ def get_sentiment_data():
         happiness_data = []
         energy_data = []
 
-        # Analizza emotions da metadata
-        for entry in reversed(entries):  # Ordine cronologico
-            dates.append(entry['date'])
-
-            emotions = entry.get('metadata', {}).get('emotions_detected', {})
+        # Analizza emotions dalla serie temporale
+        for entry_date, emotions in reversed(emotion_rows):  # Ordine cronologico
+            dates.append(entry_date)
 
             # Calcola score da keyword count (semplificato)
             stress = min(emotions.get('stress', 0) * 2, 10)
@@ -399,7 +582,7 @@ def get_sentiment_data():
                 formatted_dates.append(d[-5:])  # Fallback: ultimi 5 caratteri
 
         # Activity data (per calendario)
-        activity_dates = [entry['date'] for entry in entries]
+        activity_dates = [entry_date for entry_date, _ in emotion_rows]
 
         return jsonify({
             'success': True,
@@ -419,6 +602,284 @@ def get_sentiment_data():
 
 # ===== HELPER FUNCTIONS =====
 
+def _sse(event: str, data: dict) -> str:
+    """Formatta un evento Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _load_chat_state():
+    """Stato della chat corrente dallo store lato server (None se non c'è o è scaduta)"""
+    chat_id = session.get('chat_id')
+    if not chat_id:
+        return None
+
+    state = chat_store.get(chat_id)
+    # L'id nel cookie vale solo per l'utente che ha aperto la chat
+    if state is None or state.get('user_id') != g.user_id:
+        return None
+    # Il riassunto è scritto in background sotto una chiave separata
+    summary = chat_store.get(_summary_key(chat_id))
+    if summary is not None:
+        state['summary'] = summary['summary']
+        state['summarized_until'] = summary['summarized_until']
+    return state
+
+
+def _chat_agent(state: dict) -> MentalWellnessAgent:
+    """Ricrea l'agente con la history della chat"""
+    agent = MentalWellnessAgent()
+    # Copia: lo stato nello store cambia solo con put()
+    agent.conversation_history = list(state['history'])
+    agent.context_summary = state.get('summary')
+    agent.summarized_until = state.get('summarized_until', 0)
+    agent.session_started = True
+    return agent
+
+
+def _finalize_chat(agent: MentalWellnessAgent, state: dict) -> str:
+    """
+    Salva la chat e mette in coda la generazione del log di oggi
+    Il job contiene tutto ciò che serve (history e data), così sopravvive a un riavvio
+    Returns: id del job
+    """
+    _save_chat_state(agent, state)
+    job_id = job_queue.submit('journal', g.user_id, {
+        'chat_id': state['id'],
+        'history': state['history'],
+        'summary': state.get('summary'),
+        'summarized_until': state.get('summarized_until', 0),
+        'draft': chat_store.get(_draft_key(state['id'])),
+        'date': date.today().isoformat()
+    })
+    _end_chat(state, job_id)
+    return job_id
+
+
+def _run_journal_job(job: dict, checkpoint) -> dict:
+    """
+    Job "journal": genera e salva il log dalla conversazione e aggiorna lo streak
+    Ogni passo è un checkpoint: se il job riparte non rigenera il log e non lo risalva.
+    Se durante la chat è stata preparata una bozza, basta aggiornarla con gli ultimi messaggi
+    """
+    payload = job['payload']
+    storage = storage_pool.get(job['user_id'])
+    partial = job['result']
+
+    if 'journal_entry' not in partial:
+        checkpoint('generating')
+        agent = _chat_agent(payload)
+        _apply_draft(agent, payload.get('draft'))
+        journal_entry, emotions = run_async(_agenerate_journal(agent, storage, payload['date']))
+        partial = {**partial, 'journal_entry': journal_entry, 'emotions': emotions}
+        checkpoint('saving', partial)
+
+    # Salva
+    if not partial.get('saved'):
+        metadata = {'source': 'chat', 'emotions_detected': partial['emotions']}
+        # Il log è stato combinato con l'entry esistente: ricorda se conteneva testo dell'editor
+        if has_editor_text(storage.load_entry(payload['date'])):
+            metadata['editor_text'] = True
+        storage.save_entry(partial['journal_entry'], metadata, payload['date'])
+        partial = {**partial, 'saved': True}
+        checkpoint('streak', partial)
+
+    # Aggiorna streak: il log è già salvato, un errore sul profilo non fa fallire il job
+    try:
+        streak = storage.update_streak()['current_streak']
+    except Exception as e:
+        print(f"Errore aggiornamento streak: {e}")
+        streak = None
+
+    # Ricorda il risultato anche nello stato della chat (se non è scaduta)
+    state = chat_store.get(payload['chat_id'])
+    if state is not None:
+        state['journal_entry'] = partial['journal_entry']
+        state['streak'] = streak
+        chat_store.put(state['id'], state)
+
+    return {'journal_entry': partial['journal_entry'], 'streak': streak}
+
+
+async def _agenerate_journal(agent: MentalWellnessAgent, storage, entry_date: str):
+    """
+    Generazione del log sull'event loop: log ed estrazione delle emozioni in parallelo
+    Returns: (journal_entry, emotions)
+    """
+    async def generate_entry():
+        # Controlla se esiste già un log per il giorno e genera entry (combinando se presente)
+        existing = await asyncio.to_thread(storage.load_entry, entry_date)
+        existing_log = existing.get('entry') if existing else None
+        # Errori del modello sollevati: il job li ritenta invece di salvarli nel log
+        return await agent.agenerate_journal_text(existing_entry=existing_log)
+
+    journal_entry, emotions = await asyncio.gather(
+        generate_entry(),
+        agent.aextract_emotions()
+    )
+    return journal_entry, emotions
+
+
+def _draft_key(chat_id: str) -> str:
+    """Chiave della bozza del log nello store (separata dallo stato, che la richiesta riscrive)"""
+    return f"{chat_id}:draft"
+
+
+def _apply_draft(agent: MentalWellnessAgent, draft):
+    """Ripristina nell'agente la bozza del log salvata nello store"""
+    if draft:
+        agent.journal_draft = draft['journal_draft']
+        agent.drafted_until = draft['drafted_until']
+        agent.draft_existing = draft['draft_existing']
+
+
+def _schedule_draft(state: dict):
+    """Aggiorna in background la bozza del log con l'ultimo turno (senza attenderla)"""
+    if not config.JOURNAL_DRAFT_ENABLED:
+        return
+    if _claim(_draft_key(state['id'])):
+        spawn(_aupdate_draft(state['id'], g.storage))
+
+
+async def _aupdate_draft(chat_id: str, storage):
+    try:
+        state = await asyncio.to_thread(chat_store.get, chat_id)
+        if state is None or not state['active']:
+            return
+
+        # Copia della history: la richiesta successiva può aggiungere messaggi nel frattempo
+        agent = _chat_agent({**state, 'history': list(state['history'])})
+        _apply_draft(agent, await asyncio.to_thread(chat_store.get, _draft_key(chat_id)))
+
+        existing = await asyncio.to_thread(storage.load_entry, date.today().isoformat())
+        if await agent.aupdate_journal_draft(existing.get('entry') if existing else None):
+            await asyncio.to_thread(chat_store.put, _draft_key(chat_id), {
+                'journal_draft': agent.journal_draft,
+                'drafted_until': agent.drafted_until,
+                'draft_existing': agent.draft_existing
+            })
+
+    except Exception as e:
+        print(f"Errore aggiornamento bozza del log: {e}")
+
+    finally:
+        _release(_draft_key(chat_id))
+
+
+def _summary_key(chat_id: str) -> str:
+    """Chiave del riassunto dei turni vecchi nello store (come la bozza, separata dallo stato)"""
+    return f"{chat_id}:summary"
+
+
+def _schedule_summary(state: dict):
+    """
+    Riassume in background i turni usciti dalla finestra di contesto, dopo la risposta
+    Finché il riassunto non è pronto il turno successivo manda anche i turni vecchi
+    """
+    if _claim(_summary_key(state['id'])):
+        spawn(_aupdate_summary(state['id']))
+
+
+async def _aupdate_summary(chat_id: str):
+    try:
+        state = await asyncio.to_thread(chat_store.get, chat_id)
+        if state is None:
+            return
+        previous = await asyncio.to_thread(chat_store.get, _summary_key(chat_id))
+        if previous is not None:
+            state = {**state, **previous}
+
+        agent = _chat_agent(state)
+        await agent._aupdate_context_summary()
+        if agent.summarized_until <= state.get('summarized_until', 0):
+            return  # niente da riassumere (o errore del modello, già loggato)
+
+        # Scritto solo se nessun altro ha salvato nel frattempo un riassunto più avanti
+        current = await asyncio.to_thread(chat_store.get, _summary_key(chat_id))
+        if current is None or current['summarized_until'] < agent.summarized_until:
+            await asyncio.to_thread(chat_store.put, _summary_key(chat_id), {
+                'summary': agent.context_summary,
+                'summarized_until': agent.summarized_until
+            })
+
+    except Exception as e:
+        print(f"Errore aggiornamento riassunto conversazione: {e}")
+
+    finally:
+        _release(_summary_key(chat_id))
+
+
+def _claim(key: str) -> bool:
+    """Prenota un aggiornamento in background (False se ce n'è già uno in corso per la chiave)"""
+    with _in_flight_lock:
+        if key in _in_flight:
+            return False  # il prossimo aggiornamento includerà anche questo turno
+        _in_flight.add(key)
+        return True
+
+
+def _release(key: str):
+    with _in_flight_lock:
+        _in_flight.discard(key)
+
+
+def _save_chat_state(agent: MentalWellnessAgent, state: dict, storage=None):
+    """Aggiunge al log della conversazione i messaggi non ancora salvati e aggiorna lo store"""
+    storage = storage or g.storage
+    history = agent.get_conversation_history()
+    storage.append_conversation(history[state['persisted']:], state['id'], date.today().isoformat())
+
+    state['history'] = history
+    state['persisted'] = len(history)
+    state['summary'] = agent.context_summary
+    state['summarized_until'] = agent.summarized_until
+    chat_store.put(state['id'], state)
+
+
+def _end_chat(state: dict, job_id: str):
+    """Segna la chat come conclusa, ricordando il job che genera il log"""
+    state['active'] = False
+    state['job_id'] = job_id
+    chat_store.put(state['id'], state)
+
+
+def _job_view(job: dict) -> dict:
+    """Stato di un job per le risposte JSON (con il risultato quando è concluso)"""
+    view = {
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'step': job['step'],
+        'attempts': job['attempts']
+    }
+    if job['status'] == 'done':
+        view.update(job['result'])
+        view.pop('emotions', None)
+    elif job['status'] == 'failed':
+        view['error'] = job['error']
+    return view
+
+
+# Job in background: si ritentano solo gli errori transitori del modello
+job_queue.register('journal', _run_journal_job, retry_on=TRANSIENT_ERRORS + (CircuitOpenError,))
+
+
+def start_background_jobs():
+    """
+    Avvio dei worker dei job e ripresa di quelli interrotti: una volta per processo server,
+    non all'import (tool e processo padre del reloader importano app senza eseguire job)
+    """
+    if config.REQUIRE_USER_HEADER and config.PROXY_SECRET is None:
+        print("⚠️  JOURNAL_REQUIRE_USER senza JOURNAL_PROXY_SECRET: tutte le richieste saranno rifiutate")
+    if not job_queue.started:
+        job_queue.start()
+
+
+def create_app() -> Flask:
+    """App factory per i server WSGI (es. gunicorn "app:create_app()")"""
+    start_background_jobs()
+    return app
+
+
 def _build_context_from_entries(entries: list) -> str:
     """Costruisce contesto dalle entries recenti"""
     if not entries:
@@ -444,4 +905,8 @@ if __name__ == '__main__':
     print("\nðŸ“± Server avviato su: http://localhost:5000")
     print("ðŸ”’ Premi CTRL+C per fermare\n")
 
+    # Con il reloader di debug il processo padre sorveglia solo i file: i job girano nel figlio
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_jobs()
+
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
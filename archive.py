@@ -0,0 +1,174 @@
+"""
+Archivio compresso per entries e conversazioni vecchie
+Un segmento per tipo e mese (es. conversations_2025-11.seg) con i record compressi
+singolarmente e una tabella degli offset in coda, così un giorno si legge con una
+sola seek e una scansione di un mese è una lettura sequenziale dello stesso file
+
+Layout di un segmento:
+    MAGIC | len(zdict) uint32 | zdict | record... | tabella (JSON zlib) | footer
+Il dizionario zdict (per le conversazioni: il system prompt) è salvato nel segmento
+stesso, quindi i segmenti restano leggibili anche se il prompt cambia
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+MAGIC = b"SEG1"
+ZDICT_HEADER = struct.Struct("<I")
+# Footer: offset della tabella, lunghezza della tabella, magic
+FOOTER = struct.Struct("<QI4s")
+
+
+class SegmentArchive:
+    """Segmenti mensili compressi con tabella degli offset"""
+
+    def __init__(self, archive_dir: str, zdicts: Optional[Dict[str, bytes]] = None):
+        """
+        archive_dir: directory dei segmenti
+        zdicts: dizionario di compressione per tipo di record (opzionale)
+        """
+        self.archive_dir = archive_dir
+        self.zdicts = zdicts or {}
+        self._headers: Dict[str, Tuple[int, bytes, Dict[str, List[int]]]] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def segment_name(kind: str, entry_date: str) -> str:
+        """Nome del segmento che contiene la data (un segmento per mese)"""
+        return f"{kind}_{entry_date[:7]}.seg"
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.archive_dir, name)
+
+    # ========== LETTURA ==========
+
+    def _header(self, name: str) -> Optional[Tuple[bytes, Dict[str, List[int]]]]:
+        """zdict e tabella degli offset del segmento (in cache finché il file non cambia)"""
+        path = self._path(name)
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        with self._lock:
+            cached = self._headers.get(name)
+            if cached is not None and cached[0] == mtime_ns:
+                return cached[1], cached[2]
+
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            (zdict_len,) = ZDICT_HEADER.unpack(f.read(ZDICT_HEADER.size))
+            zdict = f.read(zdict_len)
+
+            f.seek(-FOOTER.size, os.SEEK_END)
+            table_offset, table_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                return None
+            f.seek(table_offset)
+            table = json.loads(zlib.decompress(f.read(table_length)))
+
+        with self._lock:
+            self._headers[name] = (mtime_ns, zdict, table)
+        return zdict, table
+
+    def _decompress(self, raw: bytes, zdict: bytes) -> Dict:
+        decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+        return json.loads(decompressor.decompress(raw) + decompressor.flush())
+
+    def read_record(self, name: str, offset: int, length: int) -> Optional[Dict]:
+        """Legge un record dato segmento, offset e lunghezza (es. dall'indice degli entries)"""
+        header = self._header(name)
+        if header is None:
+            return None
+        with open(self._path(name), 'rb') as f:
+            f.seek(offset)
+            return self._decompress(f.read(length), header[0])
+
+    def locate(self, kind: str, entry_date: str) -> Optional[Tuple[str, int, int]]:
+        """(segmento, offset, lunghezza) del record di una data, se archiviato"""
+        name = self.segment_name(kind, entry_date)
+        header = self._header(name)
+        if header is None or entry_date not in header[1]:
+            return None
+        offset, length = header[1][entry_date]
+        return name, offset, length
+
+    def read(self, kind: str, entry_date: str) -> Optional[Dict]:
+        """Legge il record archiviato di una data"""
+        location = self.locate(kind, entry_date)
+        return self.read_record(*location) if location else None
+
+    def segments(self, kind: str) -> List[str]:
+        """Nomi dei segmenti di un tipo, in ordine cronologico"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        return sorted(name for name in os.listdir(self.archive_dir)
+                      if name.startswith(f"{kind}_") and name.endswith(".seg"))
+
+    def dates(self, kind: str) -> List[str]:
+        """Tutte le date archiviate di un tipo (dalle sole tabelle degli offset)"""
+        dates = []
+        for name in self.segments(kind):
+            header = self._header(name)
+            if header is not None:
+                dates.extend(header[1])
+        return sorted(dates)
+
+    def iter_records(self, kind: str) -> Iterator[Tuple[str, str, int, int, Dict]]:
+        """Scorre tutti i record di un tipo leggendo ogni segmento in sequenza"""
+        for name in self.segments(kind):
+            header = self._header(name)
+            if header is None:
+                continue
+            zdict, table = header
+            with open(self._path(name), 'rb') as f:
+                for entry_date, (offset, length) in sorted(table.items(), key=lambda item: item[1][0]):
+                    f.seek(offset)
+                    yield entry_date, name, offset, length, self._decompress(f.read(length), zdict)
+
+    # ========== SCRITTURA ==========
+
+    def write_segment(self, kind: str, month: str,
+                      records: Dict[str, Dict]) -> Dict[str, Tuple[str, int, int]]:
+        """
+        Aggiunge record al segmento del mese (unendoli a quelli già archiviati)
+        Returns: data -> (segmento, offset, lunghezza) per tutti i record del segmento
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        name = f"{kind}_{month}.seg"
+        zdict = self.zdicts.get(kind, b"")
+
+        merged = {}
+        header = self._header(name)
+        if header is not None:
+            for entry_date, (offset, length) in header[1].items():
+                merged[entry_date] = self.read_record(name, offset, length)
+        merged.update(records)
+
+        path = self._path(name)
+        tmp_path = path + ".tmp"
+        table = {}
+        with open(tmp_path, 'wb') as f:
+            f.write(MAGIC + ZDICT_HEADER.pack(len(zdict)) + zdict)
+            for entry_date in sorted(merged):
+                compressor = zlib.compressobj(9, zdict=zdict) if zdict else zlib.compressobj(9)
+                raw = json.dumps(merged[entry_date], ensure_ascii=False, separators=(',', ':'))
+                data = compressor.compress(raw.encode('utf-8')) + compressor.flush()
+                table[entry_date] = [f.tell(), len(data)]
+                f.write(data)
+
+            table_raw = zlib.compress(json.dumps(table).encode('utf-8'))
+            table_offset = f.tell()
+            f.write(table_raw)
+            f.write(FOOTER.pack(table_offset, len(table_raw), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        return {entry_date: (name, offset, length) for entry_date, (offset, length) in table.items()}
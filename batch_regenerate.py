@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Rigenerazione offline in blocco di journal entries e suggerimenti
+Da usare quando cambiano prompt o modello: legge le conversazioni salvate un giorno
+alla volta, rigenera i log (o i suggerimenti) con un pool di worker a concorrenza e
+frequenza limitate e scrive ogni risultato in modo atomico. Un file di checkpoint
+ricorda i task completati: rilanciando lo stesso comando si riprende da dove ci si era
+fermati (i task falliti vengono ritentati).
+
+Uso:
+    python batch_regenerate.py journal [--user ID ... | --all-users] [--start AAAA-MM-GG]
+                                       [--end AAAA-MM-GG] [--concurrency 4] [--rate 60]
+                                       [--output DIR] [--apply]
+    python batch_regenerate.py suggestions [--user ID ... | --all-users] [--days 7] ...
+
+Di default i risultati vanno in --output (uno JSON per task) per poterli rivedere;
+con --apply i log rigenerati sostituiscono quelli salvati (journal), tranne quelli che
+contengono testo scritto nell'editor (rigenerati solo in --output, con un avviso).
+Le chiavi del checkpoint includono modalità, modello e versione dei prompt.
+Contro il server finto: --base-url http://localhost:8001/v1 (o OPENAI_BASE_URL)
+"""
+
+import argparse
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import time
+from itertools import islice
+from typing import Dict, Iterator, Optional, Set
+
+import config
+import prompts
+from agent import MentalWellnessAgent
+from file_lock import atomic_write_json, truncate_torn_tail
+from llm_client import acomplete
+from llm_metrics import metrics
+from storage import create_storage, has_editor_text, iter_user_ids
+
+
+# ========== RATE LIMIT E CHECKPOINT ==========
+
+class RateLimiter:
+    """Token bucket: al massimo per_minute richieste al minuto, raffiche fino a burst"""
+
+    def __init__(self, per_minute: float, burst: int = 1):
+        self.rate = per_minute / 60
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Checkpoint:
+    """File JSONL con le chiavi dei task completati (una riga per task, scritta subito)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self.done.add(json.loads(line)["task"])
+                    except (json.JSONDecodeError, KeyError):
+                        continue  # ultima riga troncata da un'interruzione
+            truncate_torn_tail(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def mark(self, task: str):
+        self.done.add(task)
+        self._file.write(json.dumps({"task": task, "at": time.time()}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+# ========== TASK ==========
+
+def _user_dir(user_id: Optional[str]) -> str:
+    return user_id or "_default"
+
+
+@functools.lru_cache(maxsize=1)
+def prompt_version() -> str:
+    """Impronta dei testi dei prompt: se un prompt cambia, cambiano le chiavi dei task"""
+    texts = [value for name, value in sorted(vars(prompts).items())
+             if name.isupper() and isinstance(value, str)]
+    return hashlib.sha256("\n".join(texts).encode("utf-8")).hexdigest()[:12]
+
+
+def _task_key(args, *parts) -> str:
+    """
+    Chiave di checkpoint di un task: include modalità (apply/output), modello e versione
+    dei prompt, così una revisione in --output non fa saltare il successivo --apply e un
+    cambio di modello o di prompt rifà i task
+    """
+    mode = "apply" if args.apply else "output"
+    return ":".join([args.kind, mode, config.MODEL_NAME, prompt_version(), *parts])
+
+
+def _write_result(path: str, result: Dict):
+    """Scrittura atomica di un risultato (file temporaneo + rename)"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    atomic_write_json(path, result)
+
+
+def _iter_users(args) -> Iterator[Optional[str]]:
+    if args.all_users:
+        yield from iter_user_ids()
+    elif args.user:
+        yield from args.user
+    else:
+        yield config.DEFAULT_USER_ID
+
+
+def iter_journal_tasks(args) -> Iterator[Dict]:
+    """Un task per (utente, giorno) con conversazione, letto in streaming"""
+    for user_id in _iter_users(args):
+        storage = create_storage(user_id)
+        for conversation in storage.iter_conversations(args.start, args.end, reverse=False):
+            yield {
+                "key": _task_key(args, _user_dir(user_id), conversation["date"]),
+                "user_id": user_id,
+                "storage": storage,
+                "date": conversation["date"],
+                "messages": conversation["messages"]
+            }
+
+
+def iter_suggestion_tasks(args) -> Iterator[Dict]:
+    """Un task per utente: suggerimenti dagli ultimi --days entries (fino a --end)"""
+    for user_id in _iter_users(args):
+        storage = create_storage(user_id)
+        entries = list(islice(storage.iter_entries(args.start, args.end), args.days))
+        # Data dell'entry più recente usato: nuovi entries danno un nuovo task
+        until = entries[0]["date"] if entries else "none"
+        yield {
+            "key": _task_key(args, _user_dir(user_id), until),
+            "user_id": user_id,
+            "storage": storage,
+            "until": until,
+            "entries": entries
+        }
+
+
+async def run_journal_task(task: Dict, args) -> Dict:
+    """Rigenera il log di un giorno dalla conversazione salvata (errori sollevati, non testo)"""
+    agent = MentalWellnessAgent()
+    agent.conversation_history = task["messages"]
+
+    response = await acomplete("batch_regenerate_journal", **agent._journal_request(None))
+    entry_text = response.choices[0].message.content.strip()
+    emotions = await asyncio.to_thread(agent.extract_emotions)
+
+    result = {
+        "user_id": task["user_id"],
+        "date": task["date"],
+        "entry": entry_text,
+        "metadata": {"source": "batch", "emotions_detected": emotions, "model": config.MODEL_NAME}
+    }
+
+    path = os.path.join(args.output, _user_dir(task["user_id"]), f"entry_{task['date']}.json")
+    if args.apply:
+        storage = task["storage"]
+        previous = await asyncio.to_thread(storage.load_entry, task["date"])
+        if has_editor_text(previous):
+            # La conversazione non contiene il testo scritto nell'editor: non lo sovrascrive
+            await asyncio.to_thread(_write_result, path, result)
+            print(f"⚠️  {task['key']}: l'entry contiene testo dall'editor, non sostituito "
+                  f"(rigenerato in {path})")
+            return result
+        metadata = {**((previous or {}).get("metadata") or {}), **result["metadata"],
+                    "regenerated_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+        await asyncio.to_thread(storage.save_entry, entry_text, metadata, task["date"])
+    else:
+        await asyncio.to_thread(_write_result, path, result)
+    return result
+
+
+async def run_suggestions_task(task: Dict, args) -> Dict:
+    """Rigenera i suggerimenti di un utente (scritti sempre in --output)"""
+    from wellness_agent import WellnessAgent
+
+    wellness = WellnessAgent(task["storage"])
+    if not task["entries"]:
+        suggestions = wellness._get_default_suggestions()
+    else:
+        request = wellness._suggestions_request(wellness._build_context(task["entries"]))
+        response = await acomplete("batch_regenerate_suggestions", **request)
+        suggestions = WellnessAgent._parse_suggestions(response)
+
+    result = {"user_id": task["user_id"], "until": task["until"], "suggestions": suggestions}
+    path = os.path.join(args.output, _user_dir(task["user_id"]), f"suggestions_{task['until']}.json")
+    await asyncio.to_thread(_write_result, path, result)
+    return result
+
+
+# ========== POOL ==========
+
+async def run_batch(tasks: Iterator[Dict], handler, args) -> Dict[str, int]:
+    """
+    Esegue i task con al massimo --concurrency in corso e --rate richieste al minuto
+    La coda è limitata: i task (e le conversazioni) vengono letti man mano che servono
+    """
+    checkpoint = Checkpoint(args.checkpoint)
+    limiter = RateLimiter(args.rate, burst=args.concurrency)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def produce():
+        iterator = iter(tasks)
+        while True:
+            # Lettura dal disco in un thread: il loop resta libero per le richieste
+            task = await asyncio.to_thread(next, iterator, None)
+            if task is None:
+                break
+            if task["key"] in checkpoint.done:
+                counts["skipped"] += 1
+                continue
+            await queue.put(task)
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+    async def work():
+        while True:
+            task = await queue.get()
+            if task is None:
+                return
+            if args.dry_run:
+                print(f"• {task['key']}")
+                counts["done"] += 1
+                continue
+
+            await limiter.acquire()
+            try:
+                await handler(task, args)
+                checkpoint.mark(task["key"])
+                counts["done"] += 1
+            except Exception as e:
+                counts["failed"] += 1
+                print(f"❌ {task['key']}: {e}")
+
+            total = counts["done"] + counts["failed"]
+            if total % args.progress_every == 0:
+                elapsed = time.monotonic() - started
+                print(f"⏳ {counts['done']} completati, {counts['failed']} falliti "
+                      f"({total / elapsed:.1f} task/s)")
+
+    try:
+        await asyncio.gather(produce(), *(work() for _ in range(args.concurrency)))
+    finally:
+        checkpoint.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rigenerazione in blocco di log e suggerimenti")
+    parser.add_argument("kind", choices=["journal", "suggestions"], help="cosa rigenerare")
+    users = parser.add_mutually_exclusive_group()
+    users.add_argument("--user", action="append", help="utente da elaborare (ripetibile)")
+    users.add_argument("--all-users", action="store_true", help="tutti gli utenti in USERS_DIR")
+    parser.add_argument("--start", default=None, help="prima data (inclusa)")
+    parser.add_argument("--end", default=None, help="ultima data (inclusa)")
+    parser.add_argument("--days", type=int, default=7, help="entries per i suggerimenti")
+    parser.add_argument("--concurrency", type=int, default=4, help="richieste in corso al massimo")
+    parser.add_argument("--rate", type=float, default=60, help="richieste al minuto (0 = nessun limite)")
+    parser.add_argument("--output", default=os.path.join(config.DATA_DIR, "batch"),
+                        help="directory dei risultati")
+    parser.add_argument("--checkpoint", default=None,
+                        help="file dei task completati (default: <output>/checkpoint_<kind>.jsonl)")
+    parser.add_argument("--apply", action="store_true",
+                        help="sostituisce i log salvati invece di scrivere in --output (solo journal)")
+    parser.add_argument("--model", default=None, help="modello da usare (default: config.MODEL_NAME)")
+    parser.add_argument("--base-url", default=None, help="endpoint compatibile OpenAI (es. server finto)")
+    parser.add_argument("--dry-run", action="store_true", help="elenca i task senza chiamare il modello")
+    parser.add_argument("--progress-every", type=int, default=25)
+    args = parser.parse_args()
+
+    # Prima di creare i client: valgono per tutte le richieste del batch
+    if args.base_url:
+        config.OPENAI_BASE_URL = args.base_url
+    if args.model:
+        config.MODEL_NAME = args.model
+    args.checkpoint = args.checkpoint or os.path.join(args.output, f"checkpoint_{args.kind}.jsonl")
+
+    if args.kind == "journal":
+        tasks, handler = iter_journal_tasks(args), run_journal_task
+    else:
+        tasks, handler = iter_suggestion_tasks(args), run_suggestions_task
+
+    print(f"🔄 Rigenerazione {args.kind} | concorrenza {args.concurrency}, {args.rate:g} richieste/min")
+    started = time.monotonic()
+    counts = asyncio.run(run_batch(tasks, handler, args))
+
+    print(f"✅ Completati: {counts['done']} | già fatti: {counts['skipped']} | falliti: {counts['failed']} "
+          f"| {time.monotonic() - started:.1f}s")
+    print(metrics.log_line())
+    if counts["failed"]:
+        print("💡 Rilancia lo stesso comando per ritentare i task falliti")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Store lato server delle sessioni chat
+Il cookie di Flask contiene solo l'id opaco della chat: history, messaggi già salvati
+e stato della chat stanno qui, con scadenza dopo CHAT_SESSION_TTL secondi di inattività.
+Due implementazioni con la stessa API: LRU in memoria (un solo processo) e SQLite
+(condiviso tra più worker)
+"""
+
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import config
+
+
+class MemorySessionStore:
+    """Sessioni in un LRU in memoria con TTL (valide solo nel processo corrente)"""
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 6 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        self.expired = 0
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Stato della sessione (None se non esiste o è scaduta)"""
+        with self._lock:
+            item = self._sessions.get(session_id)
+            if item is None:
+                return None
+            expires_at, data = item
+            if expires_at < time.time():
+                del self._sessions[session_id]
+                self.expired += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            # Copia, come il backend SQLite: le modifiche del chiamante valgono solo con put()
+            return copy.deepcopy(data)
+
+    def put(self, session_id: str, data: Dict):
+        """Salva lo stato della sessione e ne rinnova la scadenza"""
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._sessions[session_id] = (time.time() + self.ttl, data)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "ttl_seconds": self.ttl,
+                "evicted": self.evicted,
+                "expired": self.expired
+            }
+
+
+class SqliteSessionStore:
+    """Sessioni in una tabella SQLite con TTL (condivise tra processi)"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS chat_sessions (
+        id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_chat_sessions_expires ON chat_sessions (expires_at);
+    """
+    # Ogni quante scritture eliminare le sessioni scadute
+    PURGE_EVERY = 100
+
+    def __init__(self, db_path: str, ttl: float = 6 * 3600):
+        self.db_path = db_path
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connessione del thread corrente"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Stato della sessione (None se non esiste o è scaduta)"""
+        row = self._conn().execute(
+            "SELECT data FROM chat_sessions WHERE id = ? AND expires_at >= ?",
+            (session_id, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, session_id: str, data: Dict):
+        """Salva lo stato della sessione e ne rinnova la scadenza"""
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO chat_sessions (id, data, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at",
+            (session_id, json.dumps(data, ensure_ascii=False), time.time() + self.ttl)
+        )
+
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, session_id: str):
+        self._conn().execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,))
+
+    def purge_expired(self) -> int:
+        """Elimina le sessioni scadute, ritorna quante"""
+        cursor = self._conn().execute("DELETE FROM chat_sessions WHERE expires_at < ?", (time.time(),))
+        return cursor.rowcount
+
+    def stats(self) -> Dict:
+        (count,) = self._conn().execute(
+            "SELECT COUNT(*) FROM chat_sessions WHERE expires_at >= ?", (time.time(),)
+        ).fetchone()
+        return {
+            "backend": "sqlite",
+            "sessions": count,
+            "ttl_seconds": self.ttl
+        }
+
+
+def create_session_store():
+    """Crea lo store del backend scelto in config.CHAT_SESSION_BACKEND ("memory" o "sqlite")"""
+    if config.CHAT_SESSION_BACKEND == "memory":
+        return MemorySessionStore(config.CHAT_SESSION_MAX, config.CHAT_SESSION_TTL)
+    if config.CHAT_SESSION_BACKEND == "sqlite":
+        return SqliteSessionStore(config.CHAT_SESSION_DB, config.CHAT_SESSION_TTL)
+    raise ValueError(f"CHAT_SESSION_BACKEND non valido: {config.CHAT_SESSION_BACKEND}")
@@ -10,15 +10,128 @@ load_dotenv()
 
 # API Configuration
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Endpoint alternativo compatibile con OpenAI (es. fake_openai_server.py per i test di carico)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 MODEL_NAME = "gpt-4o-mini"  # Più economico, ottimo per conversazioni
 MAX_TOKENS = 500
 TEMPERATURE = 0.7  # Bilanciamento creatività/coerenza
 
+# Client OpenAI condiviso dal processo: connessioni keep-alive riusate tra le richieste
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # secondi per risposta
+LLM_CONNECT_TIMEOUT = 5.0
+LLM_MAX_CONNECTIONS = 20
+LLM_MAX_KEEPALIVE_CONNECTIONS = 10
+LLM_KEEPALIVE_EXPIRY = 30.0  # secondi prima di chiudere una connessione inattiva
+# I retry li gestisce llm_transport (con deadline e circuit breaker), non il client OpenAI
+LLM_MAX_RETRIES = 0
+
+# Deadline complessiva per chiamante in secondi, retry inclusi ("default" per gli altri)
+LLM_DEADLINES = {
+    "chat": 20.0,
+    "chat_stream": 20.0,
+    "_update_context_summary": 20.0,
+    "generate_journal_entry": 30.0,
+    "update_journal_draft": 30.0,
+    "_generate_ai_suggestions": 45.0,
+    "default": 30.0,
+}
+# Retry sugli errori transitori (timeout, connessione, 429, 5xx) con backoff e jitter
+LLM_RETRY_ATTEMPTS = 3  # tentativi totali
+LLM_RETRY_BASE_DELAY = 0.5  # secondi
+LLM_RETRY_MAX_DELAY = 4.0
+# Hedging: seconda richiesta identica se la prima supera il percentile di latenza del chiamante
+# (raddoppia il costo delle chiamate lente, quindi è disattivato di default)
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "0") == "1"
+LLM_HEDGE_CALLERS = ("chat", "_update_context_summary")
+LLM_HEDGE_PERCENTILE = 0.95
+LLM_HEDGE_MIN_SAMPLES = 20  # chiamate osservate prima di usare il percentile
+LLM_HEDGE_WORKERS = 16
+# Circuit breaker: dopo N errori transitori di fila le chiamate falliscono subito per RESET secondi
+LLM_BREAKER_FAILURES = 5
+LLM_BREAKER_RESET = 30.0
+
+# Prezzi in USD per milione di token, per la stima dei costi nelle metriche LLM
+LLM_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+}
+LLM_METRICS_LOG_INTERVAL = 300  # secondi tra due righe di log delle metriche (0 = off)
+
+# Cache delle risposte LLM deterministiche (log giornaliero, suggerimenti)
+LLM_CACHE_SIZE = 512  # risposte in memoria (0 = disattivata)
+LLM_CACHE_TTL = 24 * 3600  # secondi
+# Livello su disco condiviso tra worker (None = solo memoria)
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB") or None
+
+# Finestra di contesto della chat: system prompt + riassunto dei turni vecchi + ultimi turni
+CONTEXT_MAX_TOKENS = 3000  # budget del prompt mandato al modello
+CONTEXT_KEEP_TURNS = 6  # turni recenti sempre inviati parola per parola
+CONTEXT_SUMMARY_MAX_TOKENS = 300
+CONTEXT_SUMMARY_MAX_WORDS = 150
+
 # Paths
 DATA_DIR = "data_test"
 CONVERSATIONS_DIR = os.path.join(DATA_DIR, "conversations")
 ENTRIES_DIR = os.path.join(DATA_DIR, "entries")
 USER_PROFILE_PATH = os.path.join(DATA_DIR, "user_profile.json")
+ENTRIES_INDEX_PATH = os.path.join(DATA_DIR, "entries_index.json")
+EMOTIONS_STORE_PATH = os.path.join(DATA_DIR, "emotions.bin")
+SUGGESTIONS_CACHE_PATH = os.path.join(DATA_DIR, "suggestions_cache.json")
+
+# Archivio compresso: entries e conversazioni più vecchi di N giorni vanno in segmenti mensili
+ARCHIVE_DIR = os.path.join(DATA_DIR, "archive")
+ARCHIVE_AFTER_DAYS = 60
+
+# Multi-utente: i dati di ogni utente stanno in USERS_DIR/<aa>/<bb>/<user_id>/ con la
+# stessa struttura di DATA_DIR. Senza user id si usa DATA_DIR (layout a utente singolo)
+USERS_DIR = os.path.join(DATA_DIR, "users")
+USER_SHARD_DEPTH = 2
+DEFAULT_USER_ID = os.getenv("JOURNAL_USER_ID") or None
+# Header con l'id utente, impostato dal reverse proxy che autentica le richieste
+USER_ID_HEADER = "X-User-Id"
+# Segreto condiviso col proxy, che lo manda in PROXY_SECRET_HEADER: se impostato, le
+# richieste senza il segreto giusto sono rifiutate (l'header utente non basta)
+PROXY_SECRET = os.getenv("JOURNAL_PROXY_SECRET") or None
+PROXY_SECRET_HEADER = "X-Proxy-Secret"
+# Modalità multi-utente: header utente e segreto del proxy obbligatori, nessun ripiego
+# sulla directory condivisa di DEFAULT_USER_ID
+REQUIRE_USER_HEADER = os.getenv("JOURNAL_REQUIRE_USER", "0") == "1"
+STORAGE_POOL_SIZE = 128
+
+# Storage backend: "json" (un file per entry/conversazione) o "sqlite"
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.path.join(DATA_DIR, "journal.db")
+
+# Cache in memoria dei file JSON (numero massimo di file, 0 = disattivata)
+STORAGE_CACHE_SIZE = 256
+
+# Sessioni chat lato server (nel cookie resta solo l'id della chat)
+# "memory" vale per un solo processo: con più worker usare "sqlite"
+CHAT_SESSION_BACKEND = os.getenv("CHAT_SESSION_BACKEND", "memory")
+CHAT_SESSION_TTL = 6 * 3600  # secondi di inattività prima della scadenza
+CHAT_SESSION_MAX = 1000  # solo backend "memory"
+CHAT_SESSION_DB = os.path.join(DATA_DIR, "chat_sessions.db")
+# Chiave che firma il cookie di sessione: uguale per tutti i worker e tra i riavvii
+# (senza FLASK_SECRET_KEY ne viene generata una e salvata in SECRET_KEY_PATH)
+SECRET_KEY = os.getenv("FLASK_SECRET_KEY") or None
+SECRET_KEY_PATH = os.path.join(DATA_DIR, ".secret_key")
+
+# Job in background (generazione del log alla chiusura della chat)
+JOB_DB = os.path.join(DATA_DIR, "jobs.db")
+JOB_WORKERS = 2
+JOB_MAX_ATTEMPTS = 3
+JOB_RETENTION = 7 * 24 * 3600  # secondi dopo cui i job conclusi vengono eliminati
+JOB_LEASE_SECONDS = 60.0  # senza rinnovo del lease per questo tempo un job 'running' viene ripreso
+JOB_RETRY_DELAY = 5.0  # secondi prima del primo nuovo tentativo (poi raddoppia)
+
+# Bozza del log aggiornata in background dopo ogni turno della chat
+# (una chiamata in più per turno, ma alla chiusura il log è già quasi pronto)
+JOURNAL_DRAFT_ENABLED = os.getenv("JOURNAL_DRAFT", "1") == "1"
+
+# Suggerimenti salvati con i dati dell'utente e serviti subito finché gli ultimi entries
+# non cambiano; se sono cambiati si servono i vecchi e si rigenerano in background
+SUGGESTIONS_CACHE_ENABLED = os.getenv("SUGGESTIONS_CACHE", "1") == "1"
+SUGGESTIONS_CACHE_DAYS = 7  # entries che concorrono all'impronta
 
 # Agent Behavior
 SYSTEM_PROMPT = """Sei un Mental Wellness Coach AI empatico e professionale.
@@ -0,0 +1,113 @@
+"""
+Finestra di contesto a budget di token per le conversazioni lunghe
+Al modello si mandano il system prompt, un riassunto dei turni vecchi e gli ultimi
+CONTEXT_KEEP_TURNS turni parola per parola. Il riassunto si aggiorna in modo
+incrementale: a ogni compattazione si passano solo il riassunto corrente e i
+messaggi che escono dalla finestra, mai tutta la conversazione
+"""
+
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import config
+
+try:
+    import tiktoken
+except ImportError:  # conteggio stimato se tiktoken non è installato
+    tiktoken = None
+
+
+# Token fissi per messaggio (ruolo e separatori del formato chat)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        return tiktoken.encoding_for_model(config.MODEL_NAME)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Token di un testo (stima di ~4 caratteri per token senza tiktoken)"""
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    return len(_encoding().encode(text))
+
+
+def message_tokens(message: Dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD
+
+
+class ContextWindow:
+    """Decide quali messaggi mandare al modello e quali riassumere"""
+
+    def __init__(self, max_tokens: int = 3000, keep_turns: int = 6):
+        """
+        max_tokens: budget di token del prompt (system, riassunto e turni recenti)
+        keep_turns: turni utente recenti da tenere sempre parola per parola
+        """
+        self.max_tokens = max_tokens
+        self.keep_turns = keep_turns
+
+    @staticmethod
+    def _prefix_len(history: List[Dict]) -> int:
+        """Messaggi di sistema iniziali (system prompt e contesto), mandati sempre per primi"""
+        n = 0
+        while n < len(history) and history[n]["role"] == "system":
+            n += 1
+        return n
+
+    def _turn_starts(self, history: List[Dict], start: int) -> List[int]:
+        """Indici dei messaggi utente da start in poi (ogni turno inizia con uno)"""
+        return [i for i in range(start, len(history)) if history[i]["role"] == "user"]
+
+    def build(self, history: List[Dict], summary: Optional[str],
+              summarized: int) -> List[Dict]:
+        """
+        Messaggi da mandare al modello
+        history: conversazione completa (inizia con i messaggi di sistema)
+        summary: riassunto dei messaggi tra quelli di sistema e history[summarized]
+        L'ordine (sistema, riassunto, turni) tiene stabile il prefisso tra un turno e l'altro
+        """
+        prefix = self._prefix_len(history)
+        messages = history[:prefix]
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Riassunto della conversazione finora:\n{summary}"
+            })
+        messages.extend(history[max(summarized, prefix):])
+        return messages
+
+    def tokens(self, messages: List[Dict]) -> int:
+        return sum(message_tokens(m) for m in messages)
+
+    def fold_range(self, history: List[Dict], summary: Optional[str],
+                   summarized: int) -> Optional[Tuple[int, int]]:
+        """
+        Messaggi da aggiungere al riassunto, come intervallo [start, end) della history
+        None se il prompt sta nel budget e i turni non riassunti sono al massimo il
+        doppio di keep_turns (così il riassunto si aggiorna ogni keep_turns turni,
+        non a ogni messaggio)
+        """
+        start = max(summarized, self._prefix_len(history))
+        turns = self._turn_starts(history, start)
+        over_budget = self.tokens(self.build(history, summary, summarized)) > self.max_tokens
+
+        if not over_budget and len(turns) <= 2 * self.keep_turns:
+            return None
+
+        # Tiene gli ultimi keep_turns turni, o meno se da soli superano il budget
+        keep = min(self.keep_turns, len(turns) - 1)
+        while keep > 1:
+            end = turns[-keep]
+            if self.tokens(self.build(history, summary, end)) <= self.max_tokens:
+                break
+            keep -= 1
+
+        if keep < 1:
+            return None
+        end = turns[-keep]
+        return (start, end) if end > start else None
@@ -13,9 +13,11 @@ def debug_entries():
     print("DEBUG: Visualizzazione Entries")
     print("=" * 60 + "\n")
     
+    storage = Storage(config.DEFAULT_USER_ID)
+
     # 1. Verifica directory
     print("📁 Verifica directory entries:")
-    entries_dir = config.ENTRIES_DIR
+    entries_dir = storage.entries_dir
     print(f"   Path: {entries_dir}")
     
     if not os.path.exists(entries_dir):
@@ -66,33 +68,48 @@ def debug_entries():
         except Exception as e:
             print(f"   ❌ Errore: {e}")
     
-    # 4. Usa metodo Storage
+    # 4. Usa iteratore Storage (un file alla volta, memoria costante)
     print("\n" + "=" * 60)
-    print("🔧 Test metodo Storage.get_recent_entries():")
+    print("🔧 Test metodo Storage.iter_entries():")
     print("=" * 60 + "\n")
     
-    storage = Storage()
-    
     try:
-        entries = storage.get_recent_entries(num_days=10)
+        count = 0
+        for count, entry_data in enumerate(storage.iter_entries(), 1):
+            print(f"{count}. Data: {entry_data.get('date')}")
+            entry_text = entry_data.get('entry', '')
+            print(f"   Entry: {entry_text[:80]}...")
+            print()
         
-        if not entries:
+        if not count:
             print("❌ Nessun entry ritornato dal metodo Storage!")
             print("\nPossibili cause:")
             print("1. File corrotti")
-            print("2. Problema nel metodo get_recent_entries()")
+            print("2. Indice degli entries non aggiornato (python maintenance.py rebuild-index)")
             print("3. Encoding del file")
         else:
-            print(f"✅ Trovati {len(entries)} entries:\n")
-            
-            for i, entry_data in enumerate(entries, 1):
-                print(f"{i}. Data: {entry_data.get('date')}")
-                entry_text = entry_data.get('entry', '')
-                print(f"   Entry: {entry_text[:80]}...")
-                print()
+            print(f"✅ Trovati {count} entries")
     
     except Exception as e:
-        print(f"❌ Errore nel metodo get_recent_entries(): {e}")
+        print(f"❌ Errore nel metodo iter_entries(): {e}")
+        import traceback
+        traceback.print_exc()
+
+    # 5. Conversazioni
+    print("\n" + "=" * 60)
+    print("💬 Test metodo Storage.iter_conversations():")
+    print("=" * 60 + "\n")
+
+    try:
+        count = 0
+        for count, conversation in enumerate(storage.iter_conversations(), 1):
+            print(f"{count}. Data: {conversation['date']} ({len(conversation['messages'])} messaggi)")
+
+        if not count:
+            print("⚠️  Nessuna conversazione salvata")
+
+    except Exception as e:
+        print(f"❌ Errore nel metodo iter_conversations(): {e}")
         import traceback
         traceback.print_exc()
 
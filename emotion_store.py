@@ -0,0 +1,150 @@
+"""
+Serie temporale delle emozioni in formato colonnare a record fissi
+Una riga per giorno (a partire dalla data base nell'header) con un flag di presenza
+e i contatori delle emozioni di config.EMOTION_KEYWORDS: la riga di una data si trova
+per offset diretto e una finestra di date è una sola slice del file mappato in memoria
+"""
+
+import mmap
+import os
+import struct
+from datetime import date
+from typing import Dict, Iterator, List, Optional, Tuple
+import config
+
+
+MAGIC = b"EMO1"
+EMOTIONS = list(config.EMOTION_KEYWORDS.keys())
+
+# Header: magic, ordinale della data base, numero di emozioni
+HEADER = struct.Struct("<4sIH")
+# Record: flag di presenza + un contatore uint16 per emozione
+RECORD = struct.Struct("<" + "H" * (1 + len(EMOTIONS)))
+MAX_COUNT = 0xFFFF
+
+
+class EmotionStore:
+    """File binario append-friendly con una riga a larghezza fissa per giorno"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    # ========== LAYOUT ==========
+
+    def _read_header(self, f) -> Optional[int]:
+        """Ritorna l'ordinale della data base (None se il file è vuoto o non valido)"""
+        raw = f.read(HEADER.size)
+        if len(raw) < HEADER.size:
+            return None
+        magic, base, num_emotions = HEADER.unpack(raw)
+        if magic != MAGIC or num_emotions != len(EMOTIONS):
+            return None
+        return base
+
+    @staticmethod
+    def _pack(emotions: Dict[str, int]) -> bytes:
+        counts = [min(max(int(emotions.get(name, 0)), 0), MAX_COUNT) for name in EMOTIONS]
+        return RECORD.pack(1, *counts)
+
+    # ========== SCRITTURA ==========
+
+    def put(self, entry_date: str, emotions: Optional[Dict[str, int]] = None):
+        """Scrive (o sovrascrive) la riga di una data"""
+        ordinal = date.fromisoformat(entry_date).toordinal()
+        record = self._pack(emotions or {})
+
+        if not os.path.exists(self.path):
+            with open(self.path, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, ordinal, len(EMOTIONS)) + record)
+            return
+
+        with open(self.path, 'r+b') as f:
+            base = self._read_header(f)
+            if base is None or ordinal < base:
+                # Data precedente alla base: riscrive il file con la nuova base
+                rows = self._read_all_rows(base) if base is not None else {}
+                rows[ordinal] = record
+                self._rewrite(rows)
+                return
+
+            row_offset = HEADER.size + (ordinal - base) * RECORD.size
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            if row_offset > end:
+                # Giorni mancanti: righe vuote (flag 0) fino alla data
+                f.write(b"\0" * (row_offset - end))
+            f.seek(row_offset)
+            f.write(record)
+
+    def _read_all_rows(self, base: int) -> Dict[int, bytes]:
+        with open(self.path, 'rb') as f:
+            data = f.read()[HEADER.size:]
+        rows = {}
+        for i in range(len(data) // RECORD.size):
+            raw = data[i * RECORD.size:(i + 1) * RECORD.size]
+            if RECORD.unpack(raw)[0]:
+                rows[base + i] = raw
+        return rows
+
+    def _rewrite(self, rows: Dict[int, bytes]):
+        """Riscrive il file da zero a partire dalla riga più vecchia"""
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            if rows:
+                base = min(rows)
+                buffer = bytearray(HEADER.pack(MAGIC, base, len(EMOTIONS)))
+                buffer += b"\0" * ((max(rows) - base + 1) * RECORD.size)
+                for ordinal, raw in rows.items():
+                    offset = HEADER.size + (ordinal - base) * RECORD.size
+                    buffer[offset:offset + RECORD.size] = raw
+                f.write(buffer)
+        os.replace(tmp_path, self.path)
+
+    def rebuild(self, items: Iterator[Tuple[str, Dict[str, int]]]) -> int:
+        """Ricostruisce il file da coppie (data, emozioni)"""
+        rows = {date.fromisoformat(d).toordinal(): self._pack(e or {}) for d, e in items}
+        self._rewrite(rows)
+        return len(rows)
+
+    # ========== LETTURA ==========
+
+    def _scan(self, start: Optional[str], end: Optional[str],
+              reverse: bool) -> Iterator[Tuple[str, Tuple[int, ...]]]:
+        """Scorre le righe presenti nella finestra [start, end] direttamente sul file mappato"""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) <= HEADER.size:
+            return
+
+        with open(self.path, 'rb') as f:
+            base = self._read_header(f)
+            if base is None:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                num_rows = (len(mm) - HEADER.size) // RECORD.size
+                lo = 0 if start is None else max(date.fromisoformat(start).toordinal() - base, 0)
+                hi = num_rows if end is None else min(date.fromisoformat(end).toordinal() - base + 1, num_rows)
+                if lo >= hi:
+                    return
+
+                with memoryview(mm) as full, \
+                        full[HEADER.size + lo * RECORD.size:HEADER.size + hi * RECORD.size] as view:
+                    indices = range(hi - lo - 1, -1, -1) if reverse else range(hi - lo)
+                    for i in indices:
+                        row = RECORD.unpack_from(view, i * RECORD.size)
+                        if row[0]:
+                            yield date.fromordinal(base + lo + i).isoformat(), row[1:]
+
+    def window(self, start: Optional[str] = None,
+               end: Optional[str] = None) -> List[Tuple[str, Dict[str, int]]]:
+        """Righe presenti tra start ed end (inclusi), in ordine cronologico"""
+        return [(d, dict(zip(EMOTIONS, counts))) for d, counts in self._scan(start, end, False)]
+
+    def recent(self, num_days: int) -> List[Tuple[str, Dict[str, int]]]:
+        """Ultime N righe presenti, dalla più recente"""
+        result = []
+        if num_days <= 0:
+            return result
+        for d, counts in self._scan(None, None, True):
+            result.append((d, dict(zip(EMOTIONS, counts))))
+            if len(result) >= num_days:
+                break
+        return result
@@ -0,0 +1,276 @@
+"""
+Indice persistente degli entries giornalieri
+Mappa ogni data al file che contiene l'entry (con offset) e a pochi campi derivati,
+così le query per data non devono listare né aprire i file degli entries
+"""
+
+import calendar
+import contextlib
+import json
+import os
+from bisect import bisect_left, bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+from file_lock import atomic_write_json
+
+
+INDEX_VERSION = 2
+
+# Campi di un entry che l'indice sa restituire senza aprire il file
+INDEX_FIELDS = ("date", "timestamp", "source", "words")
+
+
+def year_bitmap(dates: Iterable[str]) -> Dict[int, int]:
+    """Bitmap di completamento per anno: il bit i indica un entry nel giorno i+1 dell'anno"""
+    bitmaps: Dict[int, int] = {}
+    for entry_date in dates:
+        d = date.fromisoformat(entry_date)
+        bitmaps[d.year] = bitmaps.get(d.year, 0) | (1 << (d.timetuple().tm_yday - 1))
+    return bitmaps
+
+
+def month_bitmap(year_bits: int, year: int, month: int) -> int:
+    """Estrae dalla bitmap annuale quella del mese (bit i = giorno i+1 del mese)"""
+    first_day = date(year, month, 1).timetuple().tm_yday - 1
+    days_in_month = calendar.monthrange(year, month)[1]
+    return (year_bits >> first_day) & ((1 << days_in_month) - 1)
+
+
+def bitmap_days(bits: int) -> List[int]:
+    """Giorni (1-based) con il bit impostato"""
+    days = []
+    day = 1
+    while bits:
+        if bits & 1:
+            days.append(day)
+        bits >>= 1
+        day += 1
+    return days
+
+
+class EntryIndex:
+    """Manifest on-disk date -> posizione dell'entry"""
+
+    def __init__(self, index_path: str, entries_dir: str, archive=None, lock=None):
+        """
+        index_path: file dell'indice
+        entries_dir: directory dei file entry_<data>.json
+        archive: SegmentArchive con gli entries archiviati (opzionale)
+        lock: lock dei dati dell'utente (UserLock), preso per ricaricare o ricostruire l'indice
+        """
+        self.index_path = index_path
+        self.entries_dir = entries_dir
+        self.archive = archive
+        self._lock = lock or contextlib.nullcontext()
+        self._records: Dict[str, Dict] = {}
+        self._dates: List[str] = []
+        self._years: Dict[int, int] = {}
+        self._dir_mtime_ns: Optional[int] = None
+        self._index_mtime_ns: Optional[int] = None
+        self._load()
+
+    # ========== LETTURA / SCRITTURA ==========
+
+    def _load(self):
+        """Carica l'indice da disco, ricostruendolo se manca o è obsoleto"""
+        data = None
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, OSError):
+                data = None
+
+        if not data or data.get("version") != INDEX_VERSION:
+            self.rebuild()
+            return
+
+        self._records = data.get("entries", {})
+        self._dates = sorted(self._records)
+        self._years = {int(year): bits for year, bits in data.get("years", {}).items()}
+        self._dir_mtime_ns = data.get("dir_mtime_ns")
+
+        # File aggiunti/rimossi fuori da Storage cambiano l'mtime della directory
+        if self._dir_mtime_ns != self._current_dir_mtime():
+            self.rebuild()
+        else:
+            self._index_mtime_ns = self._current_index_mtime()
+
+    def _ensure_fresh(self):
+        """
+        Ricarica l'indice se un altro processo l'ha riscritto, o lo ricostruisce se file
+        degli entries sono stati aggiunti o rimossi fuori da Storage (due stat per query).
+        Ricarica e ricostruzione avvengono sotto il lock dell'utente, come le scritture
+        """
+        if (self._current_index_mtime() == self._index_mtime_ns
+                and self._current_dir_mtime() == self._dir_mtime_ns):
+            return
+        with self._lock:
+            # Ricontrollo sotto lock: un writer può aver appena aggiornato l'indice
+            if self._current_index_mtime() != self._index_mtime_ns:
+                self._load()
+            elif self._current_dir_mtime() != self._dir_mtime_ns:
+                self.rebuild()
+
+    def _reload_if_rewritten(self):
+        """
+        Solo per chi scrive (già sotto lock, dopo aver scritto il file dell'entry): ricarica
+        l'indice se un altro processo l'ha riscritto. L'mtime della directory è cambiato per
+        la scrittura stessa e viene registrato da _save()
+        """
+        if self._current_index_mtime() != self._index_mtime_ns:
+            self._load()
+
+    def _save(self):
+        """Scrive l'indice su disco (formato compatto)"""
+        self._dir_mtime_ns = self._current_dir_mtime()
+        data = {
+            "version": INDEX_VERSION,
+            "dir_mtime_ns": self._dir_mtime_ns,
+            "years": {str(year): bits for year, bits in self._years.items()},
+            "entries": self._records
+        }
+        atomic_write_json(self.index_path, data, indent=None)
+        self._index_mtime_ns = self._current_index_mtime()
+
+    def _current_index_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _current_dir_mtime(self) -> Optional[int]:
+        """mtime della directory entries (cambia quando si aggiungono o rimuovono file)"""
+        try:
+            return os.stat(self.entries_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    # ========== AGGIORNAMENTO ==========
+
+    @staticmethod
+    def derive_record(filename: str, data: Dict, offset: int, length: int,
+                      mtime_ns: int, archived: bool = False) -> Dict:
+        """Costruisce il record dell'indice per un entry"""
+        metadata = data.get("metadata") or {}
+        record = {
+            "file": filename,
+            "offset": offset,
+            "length": length,
+            "mtime_ns": mtime_ns,
+            "timestamp": data.get("timestamp"),
+            "source": metadata.get("source"),
+            "words": len((data.get("entry") or "").split())
+        }
+        if archived:
+            record["archived"] = True
+        return record
+
+    def _set(self, entry_date: str, record: Dict):
+        if entry_date not in self._records:
+            self._dates.insert(bisect_left(self._dates, entry_date), entry_date)
+            for year, bits in year_bitmap([entry_date]).items():
+                self._years[year] = self._years.get(year, 0) | bits
+        self._records[entry_date] = record
+
+    def update(self, entry_date: str, filename: str, data: Dict):
+        """Registra (o aggiorna) l'entry di una data dopo un salvataggio"""
+        self._reload_if_rewritten()
+        stat = os.stat(os.path.join(self.entries_dir, filename))
+        self._set(entry_date, self.derive_record(filename, data, 0, stat.st_size, stat.st_mtime_ns))
+        self._save()
+
+    def update_many(self, records: Dict[str, Dict]):
+        """Sostituisce i record di più date con una sola scrittura dell'indice"""
+        self._reload_if_rewritten()
+        for entry_date, record in records.items():
+            self._set(entry_date, record)
+        self._save()
+
+    def rebuild(self) -> int:
+        """
+        Rigenera l'indice leggendo tutti i file degli entries
+        Returns: numero di entries indicizzati
+        """
+        with self._lock:
+            return self._rebuild()
+
+    def _rebuild(self) -> int:
+        records = {}
+
+        # Prima gli entries archiviati: un file presente nella directory è più recente
+        if self.archive is not None:
+            for entry_date, name, offset, length, data in self.archive.iter_records("entries"):
+                mtime_ns = os.stat(os.path.join(self.archive.archive_dir, name)).st_mtime_ns
+                records[entry_date] = self.derive_record(name, data, offset, length, mtime_ns,
+                                                         archived=True)
+
+        if os.path.isdir(self.entries_dir):
+            for filename in os.listdir(self.entries_dir):
+                if not (filename.startswith("entry_") and filename.endswith(".json")):
+                    continue
+                filepath = os.path.join(self.entries_dir, filename)
+                try:
+                    with open(filepath, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                except (json.JSONDecodeError, OSError):
+                    continue
+                entry_date = data.get("date") or filename[len("entry_"):-len(".json")]
+                stat = os.stat(filepath)
+                records[entry_date] = self.derive_record(filename, data, 0, stat.st_size,
+                                                         stat.st_mtime_ns)
+
+        self._records = records
+        self._dates = sorted(records)
+        self._years = year_bitmap(self._dates)
+        self._save()
+        return len(records)
+
+    # ========== QUERY ==========
+
+    def __contains__(self, entry_date: str) -> bool:
+        self._ensure_fresh()
+        return entry_date in self._records
+
+    def __len__(self) -> int:
+        self._ensure_fresh()
+        return len(self._dates)
+
+    def get(self, entry_date: str) -> Optional[Dict]:
+        """Record dell'indice per una data (None se non c'è entry)"""
+        self._ensure_fresh()
+        return self._records.get(entry_date)
+
+    def dates_between(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Date con entry nell'intervallo [start, end] (estremi inclusi), in ordine crescente"""
+        self._ensure_fresh()
+        lo = bisect_left(self._dates, start) if start else 0
+        hi = bisect_right(self._dates, end) if end else len(self._dates)
+        return self._dates[lo:hi]
+
+    def year_bitmap(self, year: int) -> int:
+        """Bitmap di completamento dell'anno (bit i = giorno i+1), O(1)"""
+        self._ensure_fresh()
+        return self._years.get(year, 0)
+
+    def recent_dates(self, num_days: int) -> List[str]:
+        """Ultime N date con entry, dalla più recente"""
+        self._ensure_fresh()
+        if num_days <= 0:
+            return []
+        return self._dates[-num_days:][::-1]
+
+
+def main():
+    """Comando di rebuild: python entry_index.py [user_id]"""
+    import sys
+    from storage import Storage
+
+    user_id = sys.argv[1] if len(sys.argv) > 1 else None
+    storage = Storage(user_id)
+    count = storage.rebuild_entry_index()
+    print(f"✅ Indice ricostruito: {count} entries ({storage.entry_index.index_path})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Server finto compatibile con le chat completions di OpenAI, per test di carico offline
+Risponde a POST /v1/chat/completions (anche in streaming SSE) con latenza simulata,
+errori iniettati, cache dei prefissi simulata (cached_tokens) e risposte da template riconoscendo i prompt dell'app (chat, log
+giornaliero e sua bozza, riassunto della conversazione, suggerimenti in JSON valido)
+
+Uso:
+    python fake_openai_server.py [--port 8001] [--latency lognormal:800,0.5]
+                                 [--token-delay 20] [--error-rate 0.02]
+                                 [--error-codes 429,500,503] [--hang-rate 0.01]
+                                 [--replies risposte.json]
+
+Poi avvia l'app contro il server finto:
+    OPENAI_BASE_URL=http://localhost:8001/v1 OPENAI_API_KEY=test python app.py
+
+Distribuzioni di latenza (millisecondi, prima del primo token):
+    fixed:300   uniform:200,1200   lognormal:800,0.5 (mediana, sigma)
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import time
+import threading
+import uuid
+from collections import OrderedDict
+from flask import Flask, Response, jsonify, request
+
+
+# ========== LATENZA ==========
+
+class LatencyModel:
+    """Campiona latenze in millisecondi da una distribuzione descritta come stringa"""
+
+    def __init__(self, spec: str = "fixed:0"):
+        kind, _, params = spec.partition(":")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Distribuzione di latenza non valida: {spec}")
+
+    def sample(self) -> float:
+        if self.kind == "fixed":
+            return self.params[0] if self.params else 0.0
+        if self.kind == "uniform":
+            return random.uniform(self.params[0], self.params[1])
+        median, sigma = self.params
+        return random.lognormvariate(math.log(median), sigma)
+
+
+# ========== RISPOSTE ==========
+
+SUGGESTIONS_REPLY = {
+    "summary": "Negli ultimi giorni emergono momenti di stress alternati a buone giornate.",
+    "patterns": ["stress legato al lavoro", "energia migliore dopo l'attività fisica"],
+    "suggestions": [
+        {"title": "Pause brevi", "description": "Inserisci una pausa di cinque minuti ogni ora di lavoro."},
+        {"title": "Movimento", "description": "Una camminata dopo pranzo aiuta a scaricare la tensione."},
+        {"title": "Routine serale", "description": "Spegni gli schermi mezz'ora prima di dormire."}
+    ]
+}
+
+
+def _last_user_message(messages) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "user":
+            return message.get("content") or ""
+    return ""
+
+
+def _user_lines(text: str):
+    return [line[len("User: "):] for line in text.splitlines() if line.startswith("User: ")]
+
+
+def templated_reply(messages, canned: dict) -> str:
+    """Risposta plausibile per il tipo di prompt (o risposta fissa da --replies)"""
+    last = _last_user_message(messages)
+    system = messages[0].get("content", "") if messages else ""
+
+    # Risposte fisse: la prima chiave contenuta nell'ultimo messaggio utente
+    for needle, reply in canned.items():
+        if needle in last:
+            return reply
+
+    if "Rispondi SOLO con un oggetto JSON" in system:
+        return json.dumps(SUGGESTIONS_REPLY, ensure_ascii=False)
+
+    if "Ecco la conversazione:" in last:
+        lines = [line.rstrip(".") for line in _user_lines(last) if line]
+        if not lines:
+            return "Oggi ho scritto poco."
+        return "Oggi " + ". ".join(lines[:5]) + "."
+
+    if last.startswith("Bozza attuale:"):
+        draft = last.split('"')[1] if '"' in last else ""
+        lines = [line.rstrip(".") for line in _user_lines(last) if line]
+        return " ".join([draft] + [line + "." for line in lines]).strip()
+
+    if system.startswith("Riassumi conversazioni"):
+        lines = _user_lines(last)
+        return "L'utente ha parlato di: " + "; ".join(line[:60] for line in lines[-6:])
+
+    words = re.findall(r"\w+", last)
+    topic = " ".join(words[:6]) if words else "la tua giornata"
+    return f"Capisco. Mi racconti qualcosa in più su \"{topic}\"? Come ti sei sentito/a?"
+
+
+def _tokens(text: str) -> int:
+    return max(1, (len(text) + 3) // 4)
+
+
+class PrefixCache:
+    """
+    Simula la cache dei prefissi del provider: un prefisso di messaggi già visto è
+    servito dalla cache se lungo almeno MIN_TOKENS, a blocchi di BLOCK token
+    """
+
+    MIN_TOKENS = 1024
+    BLOCK = 128
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def cached_tokens(self, messages) -> int:
+        """Token del prefisso più lungo già visto (e registra i prefissi di questa richiesta)"""
+        digest = hashlib.sha256()
+        tokens = cached = 0
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps([message.get("role"), message.get("content")]).encode("utf-8"))
+                tokens += _tokens(message.get("content") or "") + 4
+                key = digest.hexdigest()
+                if key in self._seen:
+                    self._seen.move_to_end(key)
+                    cached = tokens
+                else:
+                    self._seen[key] = None
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+        if cached < self.MIN_TOKENS:
+            return 0
+        return cached // self.BLOCK * self.BLOCK
+
+
+def _usage(messages, reply: str, cached_tokens: int = 0) -> dict:
+    prompt_tokens = sum(_tokens(m.get("content") or "") + 4 for m in messages)
+    completion_tokens = _tokens(reply)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)}
+    }
+
+
+# ========== SERVER ==========
+
+def create_app(latency: LatencyModel, token_delay_ms: float = 0, error_rate: float = 0,
+               error_codes=(500,), hang_rate: float = 0, hang_seconds: float = 120,
+               canned=None) -> Flask:
+    """
+    App Flask del server finto
+    hang_rate: frazione di richieste che non rispondono per hang_seconds (per le deadline)
+    """
+    app = Flask(__name__)
+    canned = canned or {}
+    stats = {"requests": 0, "errors": 0, "hangs": 0, "streams": 0, "cached_tokens": 0}
+    prefix_cache = PrefixCache()
+
+    def error_response(status: int):
+        stats["errors"] += 1
+        error_type = "rate_limit_error" if status == 429 else "server_error"
+        return jsonify({"error": {"message": f"Errore simulato {status}", "type": error_type,
+                                  "code": None, "param": None}}), status
+
+    @app.route("/v1/models", methods=["GET"])
+    def models():
+        return jsonify({"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model", "owned_by": "fake"}]})
+
+    @app.route("/v1/chat/completions", methods=["POST"])
+    def chat_completions():
+        body = request.get_json()
+        stats["requests"] += 1
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-4o-mini")
+
+        if hang_rate and random.random() < hang_rate:
+            stats["hangs"] += 1
+            time.sleep(hang_seconds)
+
+        time.sleep(latency.sample() / 1000)
+        if error_rate and random.random() < error_rate:
+            return error_response(random.choice(error_codes))
+
+        reply = templated_reply(messages, canned)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        usage = _usage(messages, reply, prefix_cache.cached_tokens(messages))
+        stats["cached_tokens"] += usage["prompt_tokens_details"]["cached_tokens"]
+
+        if not body.get("stream"):
+            return jsonify({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": reply}}],
+                "usage": usage
+            })
+
+        stats["streams"] += 1
+        include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        def generate():
+            yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n"
+            for piece in re.findall(r"\S+\s*", reply):
+                if token_delay_ms:
+                    time.sleep(token_delay_ms / 1000)
+                yield f"data: {json.dumps(chunk({'content': piece}), ensure_ascii=False)}\n\n"
+            yield f"data: {json.dumps(chunk({}, 'stop'))}\n\n"
+            if include_usage:
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [], "usage": usage}
+                yield f"data: {json.dumps(final)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(generate(), mimetype="text/event-stream")
+
+    @app.route("/stats", methods=["GET"])
+    def server_stats():
+        return jsonify(stats)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Server finto compatibile con OpenAI per test di carico")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default="lognormal:800,0.5",
+                        help="latenza prima del primo token: fixed:MS, uniform:MIN,MAX, lognormal:MEDIANA,SIGMA")
+    parser.add_argument("--token-delay", type=float, default=20,
+                        help="millisecondi tra due chunk in streaming")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="frazione di richieste che falliscono (0-1)")
+    parser.add_argument("--error-codes", default="500",
+                        help="codici HTTP degli errori iniettati, separati da virgola")
+    parser.add_argument("--hang-rate", type=float, default=0.0,
+                        help="frazione di richieste che restano appese (timeout lato client)")
+    parser.add_argument("--hang-seconds", type=float, default=120)
+    parser.add_argument("--replies", default=None,
+                        help="file JSON {testo contenuto nel messaggio: risposta} con risposte fisse")
+    args = parser.parse_args()
+
+    canned = {}
+    if args.replies:
+        with open(args.replies, "r", encoding="utf-8") as f:
+            canned = json.load(f)
+
+    app = create_app(
+        LatencyModel(args.latency),
+        token_delay_ms=args.token_delay,
+        error_rate=args.error_rate,
+        error_codes=[int(code) for code in args.error_codes.split(",")],
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        canned=canned
+    )
+
+    print(f"🧪 Server OpenAI finto su http://{args.host}:{args.port}/v1")
+    print(f"   Latenza: {args.latency} | token: {args.token_delay}ms | errori: {args.error_rate:.0%} | appese: {args.hang_rate:.0%}")
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
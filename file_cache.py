@@ -0,0 +1,86 @@
+"""
+Cache LRU in-process per file JSON
+Ogni voce è validata con mtime/size del file, quindi modifiche esterne
+(altri processi, script) invalidano automaticamente la copia in memoria
+"""
+
+import copy
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class JsonFileCache:
+    """Cache LRU limitata path -> contenuto JSON già parsato"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _signature(stat: os.stat_result) -> tuple:
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self, path: str) -> Any:
+        """
+        Legge un file JSON passando dalla cache
+        Ritorna sempre una copia, così i chiamanti possono modificarla liberamente
+        """
+        stat = os.stat(path)
+        signature = self._signature(stat)
+
+        with self._lock:
+            cached = self._entries.get(path)
+            if cached is not None and cached[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return copy.deepcopy(cached[1])
+            self.misses += 1
+
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        self._put(path, signature, data)
+        return copy.deepcopy(data)
+
+    def store(self, path: str, data: Any):
+        """Aggiorna la cache dopo una scrittura fatta da Storage stesso"""
+        self._put(path, self._signature(os.stat(path)), copy.deepcopy(data))
+
+    def invalidate(self, path: Optional[str] = None):
+        """Rimuove un path dalla cache (o svuota tutto se path è None)"""
+        with self._lock:
+            if path is None:
+                self.invalidations += len(self._entries)
+                self._entries.clear()
+            elif self._entries.pop(path, None) is not None:
+                self.invalidations += 1
+
+    def _put(self, path: str, signature: tuple, data: Any):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[path] = (signature, data)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict:
+        """Contatori hit/miss della cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0
+            }
@@ -0,0 +1,183 @@
+"""
+Lock tra processi e scritture atomiche per lo storage su file
+Con più worker (es. gunicorn) ogni read-modify-write dei file di un utente deve
+avvenire sotto lo stesso lock advisory, e ogni file va sostituito in un colpo solo
+(scrittura su file temporaneo + rename) per non lasciare mai JSON troncati
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def atomic_write_bytes(path: str, data: bytes):
+    """Scrive un file in modo atomico: file temporaneo nella stessa directory, fsync, rename"""
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path: str, data: Any, indent: Optional[int] = 2):
+    """Serializza e scrive un file JSON in modo atomico"""
+    separators = None if indent is not None else (',', ':')
+    text = json.dumps(data, indent=indent, ensure_ascii=False, separators=separators)
+    atomic_write_bytes(path, text.encode('utf-8'))
+
+
+def truncate_torn_tail(path: str) -> int:
+    """
+    Prepara un file append-only (JSONL) per un nuovo append: se l'ultima riga non termina
+    con "\\n" (scrittura interrotta) la tronca, così la riga successiva non si fonde con
+    quella rotta e non va persa. Va chiamata sotto lo stesso lock degli append.
+    Restituisce il numero di byte rimossi.
+    """
+    try:
+        size = os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+    if size == 0:
+        return 0
+    with open(path, 'r+b') as f:
+        f.seek(size - 1)
+        if f.read(1) == b"\n":
+            return 0
+        # Cerca all'indietro l'ultimo "\n" a blocchi: la riga rotta è al massimo una
+        end = size
+        keep = 0
+        while end > 0:
+            start = max(0, end - 4096)
+            f.seek(start)
+            pos = f.read(end - start).rfind(b"\n")
+            if pos >= 0:
+                keep = start + pos + 1
+                break
+            end = start
+        f.truncate(keep)
+        f.flush()
+        os.fsync(f.fileno())
+    return size - keep
+
+
+class UserLock:
+    """
+    Lock advisory rientrante sui dati di un utente, valido tra thread e tra processi
+    Registra quante acquisizioni hanno dovuto attendere e per quanto tempo
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd: Optional[int] = None
+
+        self._stats_lock = threading.Lock()
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    # ========== LOCK DEL FILE ==========
+
+    def _lock_file(self, blocking: bool) -> bool:
+        if fcntl is not None:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(self._fd, flags)
+                return True
+            except BlockingIOError:
+                return False
+
+        while True:
+            try:
+                msvcrt.locking(self._fd, msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+                time.sleep(0.01)
+
+    def _unlock_file(self):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    # ========== API ==========
+
+    def acquire(self):
+        start = time.perf_counter()
+        contended = not self._thread_lock.acquire(blocking=False)
+        if contended:
+            self._thread_lock.acquire()
+
+        if self._depth == 0:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                if not self._lock_file(blocking=False):
+                    contended = True
+                    self._lock_file(blocking=True)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._thread_lock.release()
+                raise
+
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.acquisitions += 1
+                if contended:
+                    self.contended += 1
+                    self.wait_seconds += waited
+                    self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            try:
+                self._unlock_file()
+            finally:
+                os.close(self._fd)
+                self._fd = None
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+    def stats(self) -> Dict:
+        """Metriche di contesa del lock (per processo)"""
+        with self._stats_lock:
+            return {
+                "enabled": True,
+                "pid": os.getpid(),
+                "acquisitions": self.acquisitions,
+                "contended": self.contended,
+                "contention_rate": round(self.contended / self.acquisitions, 3) if self.acquisitions else 0.0,
+                "total_wait_ms": round(self.wait_seconds * 1000, 1),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 1)
+            }
@@ -0,0 +1,286 @@
+"""
+Coda di job in background con tabella persistente su SQLite
+I job (es. generazione del log alla chiusura della chat) vengono salvati nella tabella
+jobs e poi eseguiti da un pool di thread del processo: la richiesta HTTP ritorna subito
+con l'id del job, lo stato si legge con get(). Gli handler possono salvare checkpoint
+(step e risultati parziali) per riprendere dal punto giusto.
+Chi esegue un job lo tiene in lease: aggiorna updated_at ogni JOB_LEASE_SECONDS / 3.
+Alla partenza (e poi periodicamente) i job in coda o con il lease scaduto, cioè
+interrotti da un processo terminato o da un riavvio del container, tornano in esecuzione.
+Database e thread vengono creati al primo uso, non all'import
+"""
+
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple, Type
+import config
+
+
+# handler(job, checkpoint) -> risultato (dict serializzabile in JSON)
+# checkpoint(step, partial=None) aggiorna lo step e unisce partial al risultato salvato
+Handler = Callable[[Dict, Callable[[str, Optional[Dict]], None]], Dict]
+
+
+def _owner() -> str:
+    """Identifica una presa in carico di un job (host:pid:casuale, unico anche tra riavvii)"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """Job persistenti in SQLite eseguiti da un ThreadPoolExecutor"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        user_id TEXT,
+        status TEXT NOT NULL,
+        step TEXT,
+        payload TEXT NOT NULL,
+        result TEXT,
+        error TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        owner TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, updated_at);
+    """
+
+    def __init__(self, db_path: str, workers: int = 2, max_attempts: int = 3,
+                 retention: float = 7 * 24 * 3600, lease: float = 60.0, retry_delay: float = 5.0):
+        self.db_path = db_path
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.lease = lease
+        self.retry_delay = retry_delay
+        self._handlers: Dict[str, Handler] = {}
+        self._retry_on: Dict[str, Tuple[Type[BaseException], ...]] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._heartbeat: Optional[threading.Thread] = None
+        self._running: Dict[str, str] = {}  # job in esecuzione in questo processo -> owner
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = False
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connessione del thread corrente (il database viene creato alla prima)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="job-worker")
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(target=self._heartbeat_loop,
+                                                   name="job-heartbeat", daemon=True)
+                self._heartbeat.start()
+            return self._executor
+
+    # ========== API ==========
+
+    def register(self, kind: str, handler: Handler,
+                 retry_on: Tuple[Type[BaseException], ...] = ()):
+        """
+        Associa un tipo di job alla funzione che lo esegue
+        retry_on: errori transitori per cui il job viene ritentato (gli altri lo fanno fallire subito)
+        """
+        self._handlers[kind] = handler
+        self._retry_on[kind] = retry_on
+
+    def start(self) -> int:
+        """
+        Da chiamare all'avvio del server (non all'import): pulisce i job vecchi e rimette
+        in esecuzione quelli in coda o con il lease scaduto
+        Returns: quanti job sono stati ripresi
+        """
+        self.started = True
+        self._conn().execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+            (time.time() - self.retention,)
+        )
+        resumed = self._recover(include_queued=True)
+        self._pool()
+        if resumed:
+            print(f"🔁 Ripresi {resumed} job in background")
+        return resumed
+
+    def submit(self, kind: str, user_id: Optional[str], payload: Dict) -> str:
+        """Salva un nuovo job e lo mette in esecuzione, ritorna l'id (user_id None = utente unico)"""
+        if kind not in self._handlers:
+            raise ValueError(f"Tipo di job sconosciuto: {kind}")
+
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._conn().execute(
+            "INSERT INTO jobs (id, kind, user_id, status, step, payload, created_at, updated_at) "
+            "VALUES (?, ?, ?, 'queued', 'queued', ?, ?, ?)",
+            (job_id, kind, user_id, json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        self._pool().submit(self._run, job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Stato del job (None se non esiste)"""
+        row = self._conn().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else {}
+        return job
+
+    def stats(self) -> Dict:
+        counts = {row["status"]: row["n"] for row in self._conn().execute(
+            "SELECT status, COUNT(*) AS n FROM jobs GROUP BY status"
+        )}
+        return {
+            "workers": self.workers,
+            "max_attempts": self.max_attempts,
+            "lease_seconds": self.lease,
+            "started": self.started,
+            "jobs": counts
+        }
+
+    # ========== LEASE ==========
+
+    def _recover(self, include_queued: bool = False) -> int:
+        """
+        Rimette in coda i job 'running' con il lease scaduto (e quelli 'queued' fermi da
+        più di un lease o, con include_queued, tutti): il processo che li aveva è terminato
+        """
+        conn = self._conn()
+        now = time.time()
+        expired = now - self.lease
+        rows = conn.execute(
+            "SELECT id, status FROM jobs WHERE (status = 'running' AND updated_at < ?) "
+            "OR (status = 'queued' AND (? OR updated_at < ?))",
+            (expired, include_queued, expired)
+        ).fetchall()
+
+        resumed = 0
+        for row in rows:
+            # Condizionale: un altro processo può averlo già ripreso
+            requeued = conn.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, updated_at = ? "
+                "WHERE id = ? AND status = ? AND (status = 'queued' OR updated_at < ?)",
+                (now, row["id"], row["status"], expired)
+            ).rowcount
+            if requeued:
+                resumed += 1
+                self._pool().submit(self._run, row["id"])
+        return resumed
+
+    def _heartbeat_loop(self):
+        """Rinnova il lease dei job in esecuzione nel processo e riprende quelli abbandonati"""
+        while True:
+            time.sleep(self.lease / 3)
+            try:
+                with self._lock:
+                    running = list(self._running.items())
+                for job_id, owner in running:
+                    self._conn().execute(
+                        "UPDATE jobs SET updated_at = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                        (time.time(), job_id, owner)
+                    )
+                if self.started:
+                    self._recover()
+            except sqlite3.Error as e:
+                print(f"Errore rinnovo lease dei job: {e}")
+
+    # ========== ESECUZIONE ==========
+
+    def _checkpoint(self, job_id: str, owner: str, step: str, partial: Optional[Dict] = None):
+        conn = self._conn()
+        if partial:
+            job = self.get(job_id)
+            result = {**job["result"], **partial}
+            conn.execute(
+                "UPDATE jobs SET step = ?, result = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                (step, json.dumps(result, ensure_ascii=False), time.time(), job_id, owner)
+            )
+        else:
+            conn.execute("UPDATE jobs SET step = ?, updated_at = ? WHERE id = ? AND owner = ?",
+                         (step, time.time(), job_id, owner))
+
+    def _run(self, job_id: str):
+        conn = self._conn()
+        owner = _owner()
+        # Solo un worker (anche di un altro processo) può prendere in carico il job
+        claimed = conn.execute(
+            "UPDATE jobs SET status = 'running', owner = ?, attempts = attempts + 1, updated_at = ? "
+            "WHERE id = ? AND status = 'queued'",
+            (owner, time.time(), job_id)
+        ).rowcount
+        if not claimed:
+            return
+
+        with self._lock:
+            self._running[job_id] = owner
+        job = self.get(job_id)
+        try:
+            handler = self._handlers[job["kind"]]
+            result = handler(job, lambda step, partial=None: self._checkpoint(job_id, owner, step, partial))
+            result = {**self.get(job_id)["result"], **(result or {})}
+            # Solo se il lease è ancora nostro (altrimenti il job è già stato ripreso altrove)
+            conn.execute(
+                "UPDATE jobs SET status = 'done', step = 'done', result = ?, error = NULL, updated_at = ? "
+                "WHERE id = ? AND owner = ?",
+                (json.dumps(result, ensure_ascii=False), time.time(), job_id, owner)
+            )
+
+        except Exception as e:
+            transient = isinstance(e, self._retry_on.get(job["kind"], ()))
+            retry = transient and job["attempts"] < self.max_attempts
+            print(f"Errore job {job['kind']} {job_id} (tentativo {job['attempts']}): {e}")
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, owner = NULL, updated_at = ? WHERE id = ? AND owner = ?",
+                ("queued" if retry else "failed", str(e), time.time(), job_id, owner)
+            )
+            if retry:
+                # Backoff esponenziale; se il processo termina nell'attesa lo riprende _recover()
+                delay = self.retry_delay * (2 ** (job["attempts"] - 1))
+                timer = threading.Timer(delay, lambda: self._pool().submit(self._run, job_id))
+                timer.daemon = True
+                timer.start()
+
+        finally:
+            with self._lock:
+                self._running.pop(job_id, None)
+
+
+# Nessun file né thread finché non si usa la coda (start() all'avvio del server, submit(), get())
+job_queue = JobQueue(config.JOB_DB, config.JOB_WORKERS, config.JOB_MAX_ATTEMPTS, config.JOB_RETENTION,
+                     config.JOB_LEASE_SECONDS, config.JOB_RETRY_DELAY)
+
+
+def _reset_after_fork():
+    # I thread del pool e le connessioni SQLite non valgono nel worker creato con fork:
+    # il figlio riparte da zero e riprende i job rimasti in coda
+    job_queue._executor = None
+    job_queue._heartbeat = None
+    job_queue._running = {}
+    job_queue._lock = threading.Lock()
+    job_queue._local = threading.local()
+    if job_queue.started:
+        job_queue.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,64 @@
+"""
+Ricerca delle parole chiave di crisi ed emozioni in un solo passaggio
+I lessici di config (CRISIS_KEYWORDS, EMOTION_KEYWORDS) vengono compilati una volta
+in un'unica regex con confini di parola, su testo normalizzato (minuscolo, senza
+accenti): "stress" non conta dentro "stressato", "giu" trova anche "giù".
+Se due parole chiave si sovrappongono vince la più lunga ("farmi male" è crisi,
+non "male")
+"""
+
+import re
+import unicodedata
+from typing import Dict, Iterable, List
+import config
+
+
+CRISIS = "crisis"
+
+
+def normalize(text: str) -> str:
+    """Minuscolo e senza accenti (NFKD senza segni diacritici)"""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+class KeywordMatcher:
+    """Lessici {categoria: parole chiave} compilati in una regex con alternative"""
+
+    def __init__(self, lexicons: Dict[str, Iterable[str]]):
+        self.categories = list(lexicons.keys())
+        self._categories_of: Dict[str, List[str]] = {}
+        for category, keywords in lexicons.items():
+            for keyword in keywords:
+                key = " ".join(normalize(keyword).split())
+                categories = self._categories_of.setdefault(key, [])
+                if category not in categories:
+                    categories.append(category)
+
+        # Alternative dalla più lunga: a parità di posizione vince la frase intera
+        alternatives = sorted(self._categories_of, key=len, reverse=True)
+        pattern = "|".join(r"\s+".join(map(re.escape, key.split())) for key in alternatives)
+        self._regex = re.compile(rf"(?<!\w)(?:{pattern})(?!\w)")
+
+    def _matches(self, text: str):
+        for match in self._regex.finditer(normalize(text)):
+            yield " ".join(match.group().split())
+
+    def scan(self, text: str) -> Dict[str, int]:
+        """Occorrenze per categoria nel testo (tutte le categorie, anche a zero)"""
+        counts = {category: 0 for category in self.categories}
+        for key in self._matches(text):
+            for category in self._categories_of[key]:
+                counts[category] += 1
+        return counts
+
+    def scan_many(self, texts: Iterable[str]) -> List[Dict[str, int]]:
+        """scan() su più testi (es. i messaggi di una conversazione)"""
+        return [self.scan(text) for text in texts]
+
+    def contains(self, text: str, category: str) -> bool:
+        """True alla prima occorrenza di una parola chiave della categoria"""
+        return any(category in self._categories_of[key] for key in self._matches(text))
+
+
+keyword_matcher = KeywordMatcher({CRISIS: config.CRISIS_KEYWORDS, **config.EMOTION_KEYWORDS})
@@ -0,0 +1,167 @@
+"""
+Cache delle risposte LLM indirizzata per contenuto
+La chiave è l'hash di modello, messaggi e parametri di campionamento: la stessa
+richiesta (retry, /api/chat/close ripetuto, dashboard ricaricata) non paga una
+seconda completion. Due livelli: LRU in memoria e, opzionale, SQLite su disco
+condiviso tra processi. Ogni voce scade dopo LLM_CACHE_TTL secondi
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import config
+
+
+# Parametri che non cambiano il contenuto della risposta
+IGNORED_PARAMS = {"stream", "stream_options", "timeout", "extra_headers"}
+
+
+def cache_key(request: Dict) -> str:
+    """Hash SHA-256 della richiesta in forma canonica (chiavi ordinate)"""
+    canonical = {k: v for k, v in request.items() if k not in IGNORED_PARAMS}
+    raw = json.dumps(canonical, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """LRU in memoria con TTL, con livello SQLite opzionale sotto"""
+
+    # Ogni quante scritture eliminare dal disco le risposte scadute
+    PURGE_EVERY = 100
+
+    def __init__(self, max_entries: int = 512, ttl: float = 24 * 3600,
+                 db_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.purged = 0
+        self._writes = 0
+
+        if db_path:
+            os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+            self._conn().executescript(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL"
+                ") WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires ON llm_cache (expires_at);"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connessione del thread corrente al livello su disco"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key: str, expires_at: float, response: Dict):
+        with self._lock:
+            self._entries[key] = (expires_at, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    # ========== API ==========
+
+    def get(self, key: str) -> Optional[Dict]:
+        """Risposta in cache (dict serializzato) o None"""
+        now = time.time()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                if item[0] >= now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return item[1]
+                del self._entries[key]
+
+        if self.db_path:
+            row = self._conn().execute(
+                "SELECT response, expires_at FROM llm_cache WHERE key = ? AND expires_at >= ?",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                response = json.loads(row[0])
+                self._remember(key, row[1], response)
+                with self._lock:
+                    self.disk_hits += 1
+                return response
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, response: Dict):
+        """Salva una risposta (dict serializzabile in JSON)"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, response)
+        if self.db_path:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO llm_cache (key, response, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(response, ensure_ascii=False), expires_at)
+            )
+            with self._lock:
+                self._writes += 1
+                purge = self._writes % self.PURGE_EVERY == 0
+            if purge:
+                self.purge_expired()
+
+    def purge_expired(self) -> int:
+        """Elimina dal disco le risposte scadute (le letture le saltano già), ritorna quante"""
+        if not self.db_path:
+            return 0
+        removed = self._conn().execute("DELETE FROM llm_cache WHERE expires_at < ?", (time.time(),)).rowcount
+        with self._lock:
+            self.purged += removed
+        return removed
+
+    def invalidate(self, key: str):
+        """Rimuove una risposta da entrambi i livelli"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.db_path:
+            self._conn().execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+
+    def clear(self) -> int:
+        """Svuota la cache, ritorna quante voci in memoria sono state rimosse"""
+        with self._lock:
+            removed = len(self._entries)
+            self._entries.clear()
+        if self.db_path:
+            self._conn().execute("DELETE FROM llm_cache")
+        return removed
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "enabled": self.max_entries > 0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "disk": bool(self.db_path),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "purged": self.purged,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else 0.0
+            }
+
+
+response_cache = ResponseCache(config.LLM_CACHE_SIZE, config.LLM_CACHE_TTL, config.LLM_CACHE_DB)
@@ -0,0 +1,298 @@
+"""
+Client OpenAI condiviso dal processo
+Un solo client (e quindi un solo pool di connessioni HTTP keep-alive) per processo,
+creato alla prima richiesta: i turni di chat riusano le connessioni già aperte invece
+di rifare ogni volta DNS, TCP e handshake TLS.
+Tutte le chiamate passano da complete() (o acomplete() per il percorso asincrono),
+che applica la politica di trasporto (deadline, retry, hedging, circuit breaker),
+registra le metriche per chiamante e (a richiesta) risponde dalla cache delle risposte
+"""
+
+import asyncio
+import os
+import threading
+import time
+import weakref
+from typing import Optional
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+from openai.types.chat import ChatCompletion
+import config
+from llm_cache import cache_key, response_cache
+from llm_metrics import metrics
+from llm_transport import DeadlineExceeded, TRANSIENT_ERRORS, transport
+
+
+_client: Optional[OpenAI] = None
+_client_lock = threading.Lock()
+
+
+def _build_client() -> OpenAI:
+    http_client = DefaultHttpxClient(
+        timeout=httpx.Timeout(config.LLM_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY
+        )
+    )
+    return OpenAI(
+        api_key=config.OPENAI_API_KEY,
+        base_url=config.OPENAI_BASE_URL,
+        max_retries=config.LLM_MAX_RETRIES,
+        http_client=http_client
+    )
+
+
+def get_client() -> OpenAI:
+    """Ritorna il client OpenAI del processo (thread-safe, creato alla prima chiamata)"""
+    global _client
+    if _client is None:
+        if not config.OPENAI_API_KEY:
+            raise ValueError("OPENAI_API_KEY non trovata! Controlla il file .env")
+        with _client_lock:
+            if _client is None:
+                _client = _build_client()
+    return _client
+
+
+def close_client():
+    """Chiude il pool di connessioni (il prossimo get_client() ne crea uno nuovo)"""
+    global _client
+    with _client_lock:
+        client, _client = _client, None
+    if client is not None:
+        client.close()
+
+
+def _usage_tokens(usage):
+    """(prompt, completion, prompt serviti dalla cache dei prefissi del provider)"""
+    if usage is None:
+        return 0, 0, 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) or 0
+    return usage.prompt_tokens or 0, usage.completion_tokens or 0, cached
+
+
+class InstrumentedStream:
+    """
+    Stream di chunk che registra time-to-first-token, durata e token a fine stream
+    La deadline del chiamante vale fino all'ultimo chunk: il timeout passato al client è
+    solo per singola lettura, quindi uno stream che continua a gocciolare token verrebbe
+    servito oltre la deadline. Un timer chiude lo stream alla scadenza; gli errori a metà
+    stream contano come fallimenti per il circuit breaker
+    """
+
+    def __init__(self, stream, caller: str, model: str, start: float, deadline: float):
+        self._stream = stream
+        self.caller = caller
+        self.model = model
+        self._start = start
+        self._deadline = deadline
+        self._first_token: Optional[float] = None
+        self._usage = None
+        self._recorded = False
+        self._timed_out = False
+        self._watchdog = threading.Timer(max(deadline - time.monotonic(), 0), self._expire)
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def _expire(self):
+        """Timer della deadline: chiude la connessione, sbloccando la lettura in corso"""
+        self._timed_out = True
+        self._stream.close()
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                if self._timed_out:
+                    break
+                if self._first_token is None and chunk.choices and chunk.choices[0].delta.content:
+                    self._first_token = time.perf_counter()
+                # Con include_usage l'ultimo chunk (senza choices) porta il conteggio dei token
+                if getattr(chunk, "usage", None) is not None:
+                    self._usage = chunk.usage
+                yield chunk
+            # Uno stream chiuso dal timer può anche finire senza errori: risposta troncata
+            if self._timed_out:
+                raise DeadlineExceeded(f"Deadline superata durante lo stream ({self.caller})")
+        except Exception as e:
+            self._recorded = True
+            self._watchdog.cancel()
+            self._stream.close()
+            metrics.record_error(self.caller, self.model)
+            if self._timed_out and not isinstance(e, DeadlineExceeded):
+                # Lettura interrotta dal timer della deadline
+                e = DeadlineExceeded(f"Deadline superata durante lo stream ({self.caller})")
+            if isinstance(e, TRANSIENT_ERRORS + (httpx.TransportError,)):
+                transport.breaker.on_failure()
+            raise e
+        self._watchdog.cancel()
+        self._record()
+
+    def _record(self):
+        if self._recorded:
+            return
+        self._recorded = True
+        end = time.perf_counter()
+        ttft = None if self._first_token is None else (self._first_token - self._start) * 1000
+        prompt_tokens, completion_tokens, cached_tokens = _usage_tokens(self._usage)
+        metrics.record(self.caller, self.model, (end - self._start) * 1000, ttft,
+                       prompt_tokens, completion_tokens, cached_tokens)
+
+    def close(self):
+        # Stream interrotto (es. client disconnesso): registra comunque la parte ricevuta
+        self._watchdog.cancel()
+        self._record()
+        self._stream.close()
+
+
+def _cached_response(caller: str, cache: bool, kwargs: dict):
+    """(chiave di cache, risposta in cache) per la richiesta; chiave None se non va in cache"""
+    if not cache or kwargs.get("stream") or response_cache.max_entries <= 0:
+        return None, None
+    key = cache_key(kwargs)
+    cached = response_cache.get(key)
+    if cached is not None:
+        metrics.record_cache_hit(caller)
+        return key, ChatCompletion.model_validate(cached)
+    return key, None
+
+
+def _record_response(caller: str, model: str, start: float, key: Optional[str], response):
+    prompt_tokens, completion_tokens, cached_tokens = _usage_tokens(getattr(response, "usage", None))
+    metrics.record(caller, model, (time.perf_counter() - start) * 1000, None,
+                   prompt_tokens, completion_tokens, cached_tokens)
+    if key is not None:
+        response_cache.put(key, response.model_dump(mode="json"))
+
+
+def complete(caller: str, client: Optional[OpenAI] = None, cache: bool = False, **kwargs):
+    """
+    chat.completions.create con metriche (token, latenza, TTFT, costo) per chiamante
+    caller: nome della funzione che chiama il modello (es. "chat", "generate_journal_entry")
+    cache: risponde dalla cache se la stessa richiesta è già stata fatta (non per stream)
+    Con stream=True ritorna uno stream che registra le metriche quando si esaurisce
+    """
+    client = client or get_client()
+    model = kwargs.get("model", config.MODEL_NAME)
+    if kwargs.get("stream"):
+        kwargs.setdefault("stream_options", {"include_usage": True})
+
+    key, cached = _cached_response(caller, cache, kwargs)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    deadline = time.monotonic() + transport.deadline_for(caller)
+    try:
+        response = transport.call(
+            caller, lambda timeout: client.chat.completions.create(timeout=timeout, **kwargs),
+            hedge=not kwargs.get("stream")
+        )
+    except Exception:
+        metrics.record_error(caller, model)
+        raise
+
+    if kwargs.get("stream"):
+        return InstrumentedStream(response, caller, model, start, deadline)
+
+    _record_response(caller, model, start, key, response)
+    return response
+
+
+# ========== ASYNC ==========
+
+# Un client asincrono per event loop: il pool di connessioni di httpx è legato al loop
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def get_async_client() -> AsyncOpenAI:
+    """Client AsyncOpenAI dell'event loop corrente (da chiamare dentro una coroutine)"""
+    if not config.OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY non trovata! Controlla il file .env")
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        http_client = DefaultAsyncHttpxClient(
+            timeout=httpx.Timeout(config.LLM_TIMEOUT, connect=config.LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=config.LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=config.LLM_KEEPALIVE_EXPIRY
+            )
+        )
+        client = _async_clients[loop] = AsyncOpenAI(
+            api_key=config.OPENAI_API_KEY,
+            base_url=config.OPENAI_BASE_URL,
+            max_retries=config.LLM_MAX_RETRIES,
+            http_client=http_client
+        )
+    return client
+
+
+async def acomplete(caller: str, client: Optional[AsyncOpenAI] = None, cache: bool = False, **kwargs):
+    """Versione asincrona di complete() (senza stream)"""
+    client = client or get_async_client()
+    model = kwargs.get("model", config.MODEL_NAME)
+
+    key, cached = _cached_response(caller, cache, kwargs)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    try:
+        response = await transport.acall(
+            caller, lambda timeout: client.chat.completions.create(timeout=timeout, **kwargs)
+        )
+    except Exception:
+        metrics.record_error(caller, model)
+        raise
+
+    _record_response(caller, model, start, key, response)
+    return response
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """Event loop di processo in un thread dedicato, creato alla prima richiesta"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_async(coro, timeout: Optional[float] = None):
+    """
+    Esegue una coroutine sull'event loop di processo e ne attende il risultato
+    Tutte le richieste condividono lo stesso loop, quindi lo stesso client asincrono
+    e le sue connessioni keep-alive
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result(timeout)
+
+
+def spawn(coro):
+    """Avvia una coroutine sull'event loop di processo senza attenderla (ritorna il Future)"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop())
+
+
+def _reset_after_fork():
+    # I socket e il thread dell'event loop del processo padre non passano ai worker creati con fork
+    global _client, _client_lock, _async_clients, _loop, _loop_lock
+    _client = None
+    _client_lock = threading.Lock()
+    _async_clients = weakref.WeakKeyDictionary()
+    _loop = None
+    _loop_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
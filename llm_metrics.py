@@ -0,0 +1,202 @@
+"""
+Metriche delle chiamate LLM per chiamante (chat, generate_journal_entry, ...)
+Token (anche quelli serviti dalla cache dei prefissi del provider), costo stimato,
+latenza totale e time-to-first-token aggregati in istogrammi
+a bucket fissi: la memoria resta costante qualunque sia il numero di chiamate.
+Le metriche sono per processo
+"""
+
+import threading
+import time
+from typing import Dict, Optional
+import config
+
+
+# Limiti superiori dei bucket in millisecondi (l'ultimo raccoglie tutto il resto)
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, float("inf"))
+
+
+class Histogram:
+    """Istogramma a bucket fissi con percentili approssimati al limite del bucket"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets, self.counts):
+            seen += n
+            if seen >= rank:
+                return round(min(bound, self.max), 1)
+        return round(self.max, 1)
+
+    def snapshot(self) -> Dict:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 1) if self.count else None,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": round(self.max, 1),
+            "buckets": {("+inf" if bound == float("inf") else str(bound)): n
+                        for bound, n in zip(self.buckets, self.counts)}
+        }
+
+
+class CallerStats:
+    """Aggregati delle chiamate di un chiamante"""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.events: Dict[str, int] = {}
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.models: Dict[str, int] = {}
+        self.latency_ms = Histogram()
+        self.ttft_ms = Histogram()
+
+    def snapshot(self) -> Dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "events": dict(self.events),
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cached_ratio": round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "models": dict(self.models),
+            "latency_ms": self.latency_ms.snapshot(),
+            "ttft_ms": self.ttft_ms.snapshot()
+        }
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int,
+                  cached_tokens: int = 0) -> float:
+    """
+    Costo in USD secondo config.LLM_PRICING (0 per modelli senza prezzo)
+    I token di input in cache (inclusi in prompt_tokens) costano "cached_input"
+    """
+    pricing = config.LLM_PRICING.get(model)
+    if pricing is None:
+        return 0.0
+    cached_price = pricing.get("cached_input", pricing["input"])
+    return ((prompt_tokens - cached_tokens) * pricing["input"] + cached_tokens * cached_price
+            + completion_tokens * pricing["output"]) / 1_000_000
+
+
+class LLMMetrics:
+    """Registro delle metriche LLM del processo"""
+
+    def __init__(self, log_interval: float = 0):
+        """log_interval: secondi tra due righe di log riassuntive (0 = nessun log)"""
+        self.log_interval = log_interval
+        self._callers: Dict[str, CallerStats] = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._last_log = time.monotonic()
+
+    def _stats(self, caller: str) -> CallerStats:
+        stats = self._callers.get(caller)
+        if stats is None:
+            stats = self._callers[caller] = CallerStats()
+        return stats
+
+    def record(self, caller: str, model: str, latency_ms: float,
+               ttft_ms: Optional[float] = None, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0):
+        """Registra una chiamata conclusa (cached_tokens: parte di prompt_tokens in cache)"""
+        with self._lock:
+            stats = self._stats(caller)
+            stats.calls += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.cached_tokens += cached_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost_usd += estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+            stats.models[model] = stats.models.get(model, 0) + 1
+            stats.latency_ms.observe(latency_ms)
+            stats.ttft_ms.observe(latency_ms if ttft_ms is None else ttft_ms)
+        self._maybe_log()
+
+    def record_error(self, caller: str, model: str):
+        """Registra una chiamata fallita"""
+        with self._lock:
+            stats = self._stats(caller)
+            stats.errors += 1
+            stats.models[model] = stats.models.get(model, 0) + 1
+        self._maybe_log()
+
+    def record_cache_hit(self, caller: str):
+        """Registra una risposta servita dalla cache (nessun token pagato)"""
+        with self._lock:
+            self._stats(caller).cache_hits += 1
+
+    def record_event(self, caller: str, event: str):
+        """Conta un evento del trasporto (es. "retries", "hedges")"""
+        with self._lock:
+            events = self._stats(caller).events
+            events[event] = events.get(event, 0) + 1
+
+    def latency_percentile(self, caller: str, q: float, min_samples: int = 1) -> Optional[float]:
+        """Percentile della latenza in ms (None con meno di min_samples chiamate)"""
+        with self._lock:
+            stats = self._callers.get(caller)
+            if stats is None or stats.latency_ms.count < min_samples:
+                return None
+            return stats.latency_ms.percentile(q)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            callers = {caller: stats.snapshot() for caller, stats in self._callers.items()}
+        return {
+            "since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self._started)),
+            "total_cost_usd": round(sum(c["cost_usd"] for c in callers.values()), 6),
+            "total_cached_tokens": sum(c["cached_tokens"] for c in callers.values()),
+            "callers": callers
+        }
+
+    def log_line(self) -> str:
+        """Riga riassuntiva: chiamate, p95 di latenza e TTFT, token e costo per chiamante"""
+        parts = []
+        for caller, s in sorted(self.snapshot()["callers"].items()):
+            parts.append(
+                f"{caller}: {s['calls']} chiamate ({s['errors']} errori, {s['cache_hits']} dalla cache), "
+                f"p95 {s['latency_ms']['p95']}ms, ttft p95 {s['ttft_ms']['p95']}ms, "
+                f"{s['prompt_tokens']}+{s['completion_tokens']} token "
+                f"({s['cached_ratio']:.0%} del prompt in cache), ${s['cost_usd']:.4f}"
+            )
+        return "📊 LLM | " + (" | ".join(parts) if parts else "nessuna chiamata")
+
+    def _maybe_log(self):
+        if not self.log_interval:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_log < self.log_interval:
+                return
+            self._last_log = now
+        print(self.log_line(), flush=True)
+
+
+metrics = LLMMetrics(config.LLM_METRICS_LOG_INTERVAL)
@@ -0,0 +1,281 @@
+"""
+Politica di trasporto per le chiamate LLM
+- deadline per chiamante: tempo massimo complessivo, retry inclusi
+- retry limitati con backoff esponenziale e jitter sugli errori transitori
+- hedging opzionale: se la risposta tarda oltre un percentile della latenza osservata
+  per quel chiamante, parte una seconda richiesta identica e vince la prima che arriva
+- circuit breaker: dopo troppi errori transitori di fila le chiamate falliscono subito
+  per un periodo, poi una sola richiesta di prova decide se richiudere il circuito
+Tutti i parametri sono in config.py (sezione LLM_*)
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Awaitable, Callable, Dict, Optional
+
+import openai
+import config
+from llm_metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """Il provider è considerato degradato: chiamata rifiutata senza tentarla"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """La chiamata non si è conclusa entro la deadline del chiamante"""
+
+
+# Errori per cui ha senso riprovare (e che contano per il circuit breaker)
+TRANSIENT_ERRORS = (
+    openai.APIConnectionError,  # include APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    DeadlineExceeded,
+)
+
+
+class CircuitBreaker:
+    """Circuit breaker a tre stati: closed, open, half_open"""
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Solleva CircuitOpenError se la chiamata non va tentata"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == "open":
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpenError("Servizio AI momentaneamente non disponibile")
+                self.state = "half_open"
+                self._probe_in_flight = False
+
+            if self.state == "half_open":
+                # Una sola richiesta di prova alla volta
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    raise CircuitOpenError("Servizio AI momentaneamente non disponibile")
+                self._probe_in_flight = True
+
+    def on_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold > 0:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected
+            }
+
+
+class TransportPolicy:
+    """Deadline, retry, hedging e circuit breaker attorno a una funzione di invio"""
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(config.LLM_BREAKER_FAILURES, config.LLM_BREAKER_RESET)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    # ========== PARAMETRI ==========
+
+    @staticmethod
+    def deadline_for(caller: str) -> float:
+        return config.LLM_DEADLINES.get(caller, config.LLM_DEADLINES["default"])
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        """Full jitter: attesa casuale tra 0 e base * 2^tentativo (con un massimo)"""
+        cap = min(config.LLM_RETRY_MAX_DELAY, config.LLM_RETRY_BASE_DELAY * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    @staticmethod
+    def _hedge_delay(caller: str, hedge: bool) -> Optional[float]:
+        """Secondi dopo cui partire con la richiesta di riserva (None = niente hedging)"""
+        if not (hedge and config.LLM_HEDGE_ENABLED and caller in config.LLM_HEDGE_CALLERS):
+            return None
+        latency_ms = metrics.latency_percentile(caller, config.LLM_HEDGE_PERCENTILE,
+                                                config.LLM_HEDGE_MIN_SAMPLES)
+        return None if latency_ms is None else latency_ms / 1000
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(config.LLM_HEDGE_WORKERS,
+                                                        thread_name_prefix="llm-hedge")
+        return self._executor
+
+    # ========== SINCRONO ==========
+
+    def call(self, caller: str, send: Callable[[float], object], hedge: bool = True):
+        """
+        Esegue send(timeout) con la politica del chiamante
+        send riceve il tempo rimasto prima della deadline, da passare come timeout
+        """
+        deadline = time.monotonic() + self.deadline_for(caller)
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline di {self.deadline_for(caller)}s superata ({caller})")
+
+            try:
+                result = self._attempt(caller, send, remaining, hedge)
+            except TRANSIENT_ERRORS:
+                self.breaker.on_failure()
+                attempt += 1
+                delay = self._backoff(attempt)
+                if attempt >= config.LLM_RETRY_ATTEMPTS or time.monotonic() + delay >= deadline:
+                    raise
+                metrics.record_event(caller, "retries")
+                time.sleep(delay)
+                continue
+            except Exception:
+                # Errore non transitorio (richiesta non valida, autenticazione): il provider risponde
+                self.breaker.on_success()
+                raise
+
+            self.breaker.on_success()
+            return result
+
+    def _attempt(self, caller: str, send, remaining: float, hedge: bool):
+        hedge_delay = self._hedge_delay(caller, hedge)
+        if hedge_delay is None or hedge_delay >= remaining:
+            return send(remaining)
+
+        start = time.monotonic()
+        pending = {self._pool().submit(send, remaining)}
+        done, pending = wait(pending, timeout=hedge_delay)
+        if not done:
+            metrics.record_event(caller, "hedges")
+            pending.add(self._pool().submit(send, remaining - (time.monotonic() - start)))
+
+        error = None
+        while True:
+            for future in done:
+                if future.exception() is None:
+                    # La richiesta perdente finisce in background e viene ignorata
+                    return future.result()
+                error = future.exception()
+            if not pending:
+                raise error
+            left = remaining - (time.monotonic() - start)
+            if left <= 0:
+                raise DeadlineExceeded(f"Deadline superata ({caller})")
+            done, pending = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+
+    # ========== ASINCRONO ==========
+
+    async def acall(self, caller: str, send: Callable[[float], Awaitable], hedge: bool = True):
+        """Versione asincrona di call(): la deadline è applicata anche con asyncio.wait_for"""
+        deadline = time.monotonic() + self.deadline_for(caller)
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise DeadlineExceeded(f"Deadline di {self.deadline_for(caller)}s superata ({caller})")
+
+            try:
+                result = await self._aattempt(caller, send, remaining, hedge)
+            except TRANSIENT_ERRORS:
+                self.breaker.on_failure()
+                attempt += 1
+                delay = self._backoff(attempt)
+                if attempt >= config.LLM_RETRY_ATTEMPTS or time.monotonic() + delay >= deadline:
+                    raise
+                metrics.record_event(caller, "retries")
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.on_success()
+                raise
+
+            self.breaker.on_success()
+            return result
+
+    async def _aattempt(self, caller: str, send, remaining: float, hedge: bool):
+        start = time.monotonic()
+        tasks = {asyncio.ensure_future(send(remaining))}
+        hedge_delay = self._hedge_delay(caller, hedge)
+
+        try:
+            if hedge_delay is not None and hedge_delay < remaining:
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                if not done:
+                    metrics.record_event(caller, "hedges")
+                    tasks.add(asyncio.ensure_future(send(remaining - (time.monotonic() - start))))
+
+            error = None
+            pending = set(tasks)
+            while pending:
+                left = remaining - (time.monotonic() - start)
+                if left <= 0:
+                    raise DeadlineExceeded(f"Deadline superata ({caller})")
+                done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(f"Deadline superata ({caller})")
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+
+        finally:
+            # Le richieste ancora in corso (perdente dell'hedging, deadline) vengono annullate
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict:
+        return {
+            "breaker": self.breaker.stats(),
+            "deadlines": dict(config.LLM_DEADLINES),
+            "retry_attempts": config.LLM_RETRY_ATTEMPTS,
+            "hedging": config.LLM_HEDGE_ENABLED
+        }
+
+
+transport = TransportPolicy()
+
+
+def _reset_after_fork():
+    # I thread del pool di hedging non esistono nei worker creati con fork
+    transport._executor = None
+    transport._executor_lock = threading.Lock()
+    transport.breaker._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -5,8 +5,9 @@ Entry point principale dell'applicazione
 
 import sys
 from datetime import date
+from itertools import islice
 from agent import MentalWellnessAgent
-from storage import Storage
+from storage import create_storage
 import config
 
 
@@ -14,7 +15,7 @@ class TerminalInterface:
     """Interfaccia da terminale per il diario"""
 
     def __init__(self):
-        self.storage = Storage()
+        self.storage = create_storage(config.DEFAULT_USER_ID)
         self.agent = None
 
     def print_header(self):
@@ -113,6 +114,10 @@ class TerminalInterface:
 
                 print(f"\n{config.Colors.OKCYAN}AI: {result['response']}{config.Colors.ENDC}\n")
 
+                # Riassunto dei turni vecchi dopo la risposta, mentre l'utente legge
+                if not result['should_end']:
+                    self.agent._update_context_summary()
+
                 # Termina se richiesto o crisi
                 if result['should_end']:
                     if result['crisis_detected']:
@@ -226,17 +231,17 @@ class TerminalInterface:
         except:
             num = 7
 
-        entries = self.storage.get_recent_entries(num)
-
-        if not entries:
-            print("Nessun entry trovato.\n")
-            return
-
-        for entry_data in entries:
+        shown = 0
+        for entry_data in islice(self.storage.iter_entries(), num):
             print(f"\n{config.Colors.BOLD}📅 {entry_data['date']}{config.Colors.ENDC}")
             print("-" * 60)
             print(entry_data['entry'])
             print()
+            shown += 1
+
+        if not shown:
+            print("Nessun entry trovato.\n")
+            return
 
         input("\nPremi INVIO per tornare al menu...")
 
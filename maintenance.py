@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Operazioni di manutenzione sui dati del diario
+
+Uso:
+    python maintenance.py rebuild-index
+    python maintenance.py rebuild-emotions
+    python maintenance.py compact-conversations [--before AAAA-MM-GG]
+    python maintenance.py archive [--days N]
+    python maintenance.py purge-llm-cache
+"""
+
+import argparse
+import config
+from llm_cache import response_cache
+from storage import create_storage
+
+
+def cmd_rebuild_index(storage, args):
+    """Rigenera l'indice degli entries dai file"""
+    count = storage.rebuild_entry_index()
+    print(f"✅ Indice ricostruito: {count} entries")
+
+
+def cmd_rebuild_emotions(storage, args):
+    """Rigenera la serie temporale delle emozioni dagli entries"""
+    count = storage.rebuild_emotion_store()
+    print(f"✅ Serie emozioni ricostruita: {count} giorni")
+
+
+def cmd_compact_conversations(storage, args):
+    """Compatta i log append-only delle conversazioni dei giorni conclusi"""
+    count = storage.compact_conversations(before=args.before)
+    print(f"✅ Giorni compattati: {count}")
+
+
+def cmd_archive(storage, args):
+    """Sposta entries e conversazioni vecchi nei segmenti compressi"""
+    counts = storage.archive_old_data(older_than_days=args.days)
+    print(f"✅ Archiviati: {counts['entries']} entries, {counts['conversations']} conversazioni")
+
+
+def cmd_purge_llm_cache(storage, args):
+    """Elimina le risposte scadute dal livello su disco della cache LLM (LLM_CACHE_DB)"""
+    if not response_cache.db_path:
+        print("ℹ️  Nessuna cache LLM su disco (LLM_CACHE_DB non impostato)")
+        return
+    count = response_cache.purge_expired()
+    print(f"✅ Risposte scadute eliminate: {count}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manutenzione dati Mental Wellness Journal")
+    parser.add_argument("--user", default=config.DEFAULT_USER_ID,
+                        help="utente su cui operare (default: layout a utente singolo)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rebuild = subparsers.add_parser("rebuild-index", help="rigenera l'indice degli entries")
+    rebuild.set_defaults(func=cmd_rebuild_index)
+
+    emotions = subparsers.add_parser("rebuild-emotions", help="rigenera la serie delle emozioni")
+    emotions.set_defaults(func=cmd_rebuild_emotions)
+
+    compact = subparsers.add_parser("compact-conversations",
+                                    help="compatta i log delle conversazioni dei giorni conclusi")
+    compact.add_argument("--before", default=None,
+                         help="compatta solo i giorni precedenti a questa data (default: oggi)")
+    compact.set_defaults(func=cmd_compact_conversations)
+
+    archive = subparsers.add_parser("archive",
+                                    help="archivia entries e conversazioni più vecchi di N giorni")
+    archive.add_argument("--days", type=int, default=None,
+                         help="età minima in giorni (default: config.ARCHIVE_AFTER_DAYS)")
+    archive.set_defaults(func=cmd_archive)
+
+    purge = subparsers.add_parser("purge-llm-cache",
+                                  help="elimina le risposte scadute dalla cache LLM su disco")
+    purge.set_defaults(func=cmd_purge_llm_cache)
+
+    args = parser.parse_args()
+    args.func(create_storage(args.user), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Migrazione dei dati JSON di un utente nel backend SQLite
+I dati vengono letti attraverso Storage (iter_entries / iter_conversations), quindi
+comprendono entries e conversazioni archiviati nei segmenti compressi, i log .jsonl
+delle conversazioni e i file compattati. Alla fine i conteggi vengono confrontati
+con il database: giorni o messaggi mancanti vengono segnalati
+
+Uso:
+    python migrate_to_sqlite.py [--user ID] [--db data_test/journal.db]
+"""
+
+import argparse
+import sys
+import config
+from sqlite_storage import SqliteStorage
+from storage import Storage, user_path
+
+
+def migrate(user_id, db_path: str) -> dict:
+    """
+    Importa profilo, entries e conversazioni dello storage JSON dell'utente
+    Returns: conteggi degli elementi importati e di quelli mancanti nel database
+    """
+    source = Storage(user_id)
+    storage = SqliteStorage(db_path)
+    counts = {"profile": 0, "entries": 0, "conversations": 0, "messages": 0, "skipped": 0}
+    expected = {"entries": set(), "conversations": {}}
+
+    # Profilo utente
+    storage.save_user_profile(source.load_user_profile())
+    counts["profile"] = 1
+
+    # Entries
+    for entry in source.iter_entries(reverse=False):
+        expected["entries"].add(entry["date"])
+        try:
+            storage.import_entry(entry)
+            counts["entries"] += 1
+        except KeyError as e:
+            print(f"   ⚠️  entry {entry.get('date')} saltato: {e}")
+            counts["skipped"] += 1
+
+    # Conversazioni (tutte le sessioni del giorno in una)
+    for conversation in source.iter_conversations(reverse=False):
+        messages = conversation["messages"]
+        expected["conversations"][conversation["date"]] = len(messages)
+        storage.import_conversation({"date": conversation["date"], "messages": messages})
+        counts["conversations"] += 1
+        counts["messages"] += len(messages)
+
+    counts.update(verify(storage, expected))
+    storage.close()
+    return counts
+
+
+def verify(storage: SqliteStorage, expected: dict) -> dict:
+    """Confronta i giorni e i messaggi letti dalla sorgente con quelli nel database"""
+    entry_dates = set(storage.get_entry_dates())
+    migrated = {c["date"]: len(c["messages"]) for c in storage.iter_conversations(reverse=False)}
+
+    missing_entries = sorted(expected["entries"] - entry_dates)
+    missing_conversations = sorted(
+        d for d, n in expected["conversations"].items() if migrated.get(d, -1) != n
+    )
+    for entry_date in missing_entries:
+        print(f"   ❌ Entry mancante nel database: {entry_date}")
+    for entry_date in missing_conversations:
+        print(f"   ❌ Conversazione incompleta nel database: {entry_date} "
+              f"({migrated.get(entry_date, 0)}/{expected['conversations'][entry_date]} messaggi)")
+    return {"missing_entries": len(missing_entries), "missing_conversations": len(missing_conversations)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra i dati JSON nel database SQLite")
+    parser.add_argument("--user", default=config.DEFAULT_USER_ID,
+                        help="utente da migrare (default: layout a utente singolo in DATA_DIR)")
+    parser.add_argument("--db", default=None,
+                        help="percorso del database SQLite (default: database dell'utente)")
+    args = parser.parse_args()
+    args.db = args.db or user_path(args.user, config.SQLITE_PATH)
+
+    print(f"📦 Migrazione utente {args.user or '(singolo)'} -> {args.db}")
+    counts = migrate(args.user, args.db)
+
+    print(f"   ✅ Profilo: {counts['profile']}")
+    print(f"   ✅ Entries: {counts['entries']}")
+    print(f"   ✅ Conversazioni: {counts['conversations']} ({counts['messages']} messaggi)")
+    if counts["skipped"]:
+        print(f"   ⚠️  Entries saltati: {counts['skipped']}")
+    if counts["missing_entries"] or counts["missing_conversations"]:
+        print(f"   ❌ Dati mancanti: {counts['missing_entries']} entries, "
+              f"{counts['missing_conversations']} conversazioni")
+        sys.exit(1)
+    print("\nImposta STORAGE_BACKEND=sqlite per usare il nuovo backend.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Composizione dei prompt mandati al modello
+Ogni prompt mette prima la parte statica (istruzioni, regole, formato) e in fondo
+quella variabile (contesto dell'utente, conversazione, lunghezza target): così
+richieste diverse condividono un prefisso identico e il provider può riusarlo dalla
+sua cache dei prefissi (meno latenza, token di input in cache pagati meno).
+I token serviti dalla cache del provider si vedono in /api/llm/metrics (cached_tokens)
+"""
+
+from typing import Dict, List, Optional
+import config
+
+
+# ========== CHAT ==========
+
+def chat_system_messages(context: Optional[str] = None) -> List[Dict]:
+    """
+    System prompt della chat: quello fisso per tutti e, in un messaggio separato dopo,
+    il contesto dalle sessioni precedenti dell'utente
+    """
+    messages = [{"role": "system", "content": config.SYSTEM_PROMPT}]
+    if context:
+        messages.append({
+            "role": "system",
+            "content": f"Contesto dalle sessioni precedenti:\n{context}"
+        })
+    return messages
+
+
+# ========== LOG GIORNALIERO ==========
+
+JOURNAL_SYSTEM = "Sei un assistente che trascrive fedelmente ciò che l'utente ha detto, senza aggiungere nulla. Sii MOLTO conciso e letterale."
+
+JOURNAL_NEW_RULES = """Basandoti SOLO sulla conversazione che ti viene data, genera un log di diario in prima persona.
+
+REGOLE CRITICHE:
+- Scrivi dal punto di vista dell'utente (usa "io", "mi sono sentito", ecc.)
+- Rispetta la lunghezza TARGET indicata in fondo (MASSIMO)
+- USA SOLO informazioni ESPLICITAMENTE menzionate dall'utente
+- NON inventare dettagli, emozioni o riflessioni non dette
+- NON aggiungere interpretazioni psicologiche
+- NON espandere o elaborare oltre ciò che è stato detto
+- Se l'utente ha scritto poco, il log DEVE essere molto breve
+- Stile: semplice, diretto, fedele alle parole dell'utente
+
+Esempio per conversazione BREVE (2-3 messaggi):
+"Oggi è andata tutto bene. Ho fatto una challenge di programmazione che mi è piaciuta."
+
+Rispondi solo con il log, basato SOLO su ciò che l'utente ha effettivamente scritto."""
+
+JOURNAL_UPDATE_RULES = """Oggi è già stato scritto un log: ti viene dato insieme alla NUOVA conversazione appena avuta. Aggiorna il log combinando le informazioni.
+
+REGOLE CRITICHE:
+- Mantieni tutto ciò che era nel log precedente
+- Aggiungi SOLO le nuove informazioni dalla conversazione appena conclusa
+- Scrivi in prima persona (uso "io", "mi sono sentito", ecc.)
+- Rispetta la lunghezza totale TARGET indicata in fondo (MASSIMO)
+- USA SOLO informazioni ESPLICITAMENTE menzionate
+- NON inventare dettagli o emozioni non dette
+- Stile: semplice, diretto, cronologico
+
+Rispondi solo con il log aggiornato, che include sia il contenuto precedente che le nuove informazioni."""
+
+JOURNAL_DRAFT_RULES = """Ti viene data la bozza del log di oggi, scritta dalla prima parte della conversazione, e i nuovi messaggi. Aggiorna la bozza aggiungendo SOLO le nuove informazioni dette dall'utente.
+
+REGOLE CRITICHE:
+- Mantieni tutto ciò che era nella bozza
+- Scrivi in prima persona (uso "io", "mi sono sentito", ecc.)
+- Rispetta la lunghezza totale TARGET indicata in fondo (MASSIMO)
+- USA SOLO informazioni ESPLICITAMENTE menzionate
+- NON inventare dettagli o emozioni non dette
+- Stile: semplice, diretto, cronologico
+
+Rispondi solo con la bozza aggiornata."""
+
+
+def journal_messages(conversation: str, target_words: str,
+                     existing_entry: Optional[str] = None) -> List[Dict]:
+    """Log dalla conversazione completa (combinato con il log esistente se c'è)"""
+    rules = JOURNAL_UPDATE_RULES if existing_entry else JOURNAL_NEW_RULES
+    existing = f'Log già scritto oggi:\n\n"{existing_entry}"\n\n' if existing_entry else ""
+    return [
+        {"role": "system", "content": f"{JOURNAL_SYSTEM}\n\n{rules}"},
+        {"role": "user", "content": f"{existing}Ecco la conversazione:\n\n{conversation}\n\n"
+                                    f"Lunghezza TARGET: {target_words} parole (MASSIMO)"}
+    ]
+
+
+def journal_draft_messages(draft: str, new_messages: str, target_words: str) -> List[Dict]:
+    """Aggiornamento incrementale della bozza del log con i soli messaggi nuovi"""
+    return [
+        {"role": "system", "content": f"{JOURNAL_SYSTEM}\n\n{JOURNAL_DRAFT_RULES}"},
+        {"role": "user", "content": f'Bozza attuale:\n\n"{draft}"\n\n'
+                                    f"Nuovi messaggi della conversazione:\n\n{new_messages}\n\n"
+                                    f"Lunghezza totale TARGET: {target_words} parole (MASSIMO)"}
+    ]
+
+
+# ========== RIASSUNTO DEL CONTESTO ==========
+
+def context_fold_messages(summary: Optional[str], transcript: str) -> List[Dict]:
+    """Aggiornamento del riassunto con i messaggi che escono dalla finestra di contesto"""
+    return [
+        {"role": "system", "content": f"""Riassumi conversazioni di un diario del benessere in modo fedele e conciso, in italiano, senza aggiungere interpretazioni.
+
+Ti vengono dati il riassunto attuale e i nuovi messaggi: aggiorna il riassunto includendo i nuovi messaggi. Conserva fatti, persone, emozioni e temi già presenti. Massimo {config.CONTEXT_SUMMARY_MAX_WORDS} parole."""},
+        {"role": "user", "content": f"""Riassunto attuale:
+{summary or "(nessuno)"}
+
+Nuovi messaggi:
+{transcript}"""}
+    ]
+
+
+# ========== SUGGERIMENTI ==========
+
+SUGGESTIONS_SYSTEM = """Sei un wellness coach esperto e empatico.
+
+Il tuo compito:
+1. Analizzare i diari recenti dell'utente
+2. Identificare pattern emotivi (stress, felicità, energie, problemi ricorrenti)
+3. Fornire 3-4 suggerimenti CONCRETI e PERSONALIZZATI per migliorare il benessere
+
+Regole:
+- Sii empatico e non giudicante
+- Suggerimenti pratici e attuabili
+- Basati sui pattern specifici dell'utente, non generici
+- Breve e diretto (max 2-3 frasi per suggerimento)
+- Usa emoji appropriati ma con moderazione
+
+Formato risposta JSON:
+{
+    "summary": "Breve osservazione su come sta l'utente (2 frasi max)",
+    "patterns": ["pattern1", "pattern2"],
+    "suggestions": [
+        {
+            "title": "Titolo suggerimento",
+            "description": "Descrizione pratica"
+        }
+    ]
+}
+
+IMPORTANTE: NON usare emoji nei suggerimenti, solo testo pulito.
+
+Basandoti SOLO sui diari che ti vengono dati, genera suggerimenti personalizzati.
+
+IMPORTANTE: Rispondi SOLO con un oggetto JSON valido, senza altro testo."""
+
+
+def suggestions_messages(context: str) -> List[Dict]:
+    """Suggerimenti personalizzati: istruzioni e formato fissi, poi i diari dell'utente"""
+    return [
+        {"role": "system", "content": SUGGESTIONS_SYSTEM},
+        {"role": "user", "content": context}
+    ]
@@ -0,0 +1,511 @@
+"""
+Backend di storage su SQLite
+Stessa API pubblica di storage.Storage, ma con tabelle indicizzate, WAL e
+aggiornamenti transazionali invece di un file JSON per ogni entry/conversazione
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, date
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+import config
+from entry_index import year_bitmap, month_bitmap
+from storage import default_user_profile, apply_streak_update, project_entry, user_path
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profile (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    created_at TEXT,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    total_entries INTEGER NOT NULL DEFAULT 0,
+    last_entry_date TEXT,
+    milestones_achieved TEXT NOT NULL DEFAULT '[]',
+    preferences TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    date TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}'
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS conversations (
+    date TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    sessions INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    session INTEGER NOT NULL,
+    session_key TEXT,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_messages_date ON messages (date, id);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (date, session_key);
+
+CREATE TABLE IF NOT EXISTS suggestions_cache (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    data TEXT NOT NULL
+);
+"""
+
+# Query parametrizzate: sqlite3 mantiene in cache i prepared statement per testo SQL
+SQL_LOAD_PROFILE = "SELECT * FROM profile WHERE id = 1"
+SQL_SAVE_PROFILE = """
+INSERT INTO profile (id, created_at, current_streak, longest_streak, total_entries,
+                     last_entry_date, milestones_achieved, preferences)
+VALUES (1, :created_at, :current_streak, :longest_streak, :total_entries,
+        :last_entry_date, :milestones_achieved, :preferences)
+ON CONFLICT (id) DO UPDATE SET
+    created_at = excluded.created_at,
+    current_streak = excluded.current_streak,
+    longest_streak = excluded.longest_streak,
+    total_entries = excluded.total_entries,
+    last_entry_date = excluded.last_entry_date,
+    milestones_achieved = excluded.milestones_achieved,
+    preferences = excluded.preferences
+"""
+SQL_SAVE_ENTRY = """
+INSERT INTO entries (date, timestamp, entry, metadata) VALUES (?, ?, ?, ?)
+ON CONFLICT (date) DO UPDATE SET
+    timestamp = excluded.timestamp, entry = excluded.entry, metadata = excluded.metadata
+"""
+SQL_LOAD_ENTRY = "SELECT date, timestamp, entry, metadata FROM entries WHERE date = ?"
+SQL_HAS_ENTRY = "SELECT 1 FROM entries WHERE date = ?"
+SQL_ENTRY_DATES = "SELECT date FROM entries WHERE date >= ? AND date <= ? ORDER BY date"
+SQL_ENTRIES_BETWEEN = """
+SELECT date, timestamp, entry, metadata FROM entries WHERE date >= ? AND date <= ? ORDER BY date
+"""
+SQL_ENTRIES_BETWEEN_DESC = """
+SELECT date, timestamp, entry, metadata FROM entries WHERE date >= ? AND date <= ? ORDER BY date DESC
+"""
+SQL_CONVERSATION_DATES = "SELECT date FROM conversations WHERE date >= ? AND date <= ? ORDER BY date"
+SQL_RECENT_DATES = "SELECT date FROM entries ORDER BY date DESC LIMIT ?"
+SQL_RECENT_STAMPS = "SELECT date, timestamp FROM entries ORDER BY date DESC LIMIT ?"
+SQL_RECENT_METADATA = "SELECT date, metadata FROM entries ORDER BY date DESC LIMIT ?"
+SQL_METADATA_BETWEEN = """
+SELECT date, metadata FROM entries WHERE date >= ? AND date <= ? ORDER BY date
+"""
+SQL_OPEN_SESSION = """
+INSERT INTO conversations (date, timestamp, sessions) VALUES (?, ?, 1)
+ON CONFLICT (date) DO UPDATE SET timestamp = excluded.timestamp, sessions = sessions + 1
+RETURNING sessions
+"""
+SQL_INSERT_MESSAGE = """
+INSERT INTO messages (date, session, session_key, role, content) VALUES (?, ?, ?, ?, ?)
+"""
+SQL_FIND_SESSION = "SELECT session FROM messages WHERE date = ? AND session_key = ? LIMIT 1"
+SQL_LOAD_MESSAGES = "SELECT role, content FROM messages WHERE date = ? ORDER BY id"
+SQL_HAS_CONVERSATION = "SELECT 1 FROM conversations WHERE date = ?"
+SQL_LOAD_SUGGESTIONS = "SELECT data FROM suggestions_cache WHERE id = 1"
+SQL_SAVE_SUGGESTIONS = "INSERT OR REPLACE INTO suggestions_cache (id, data) VALUES (1, ?)"
+
+
+class SqliteStorage:
+    """Storage su un singolo database SQLite (una connessione per thread)"""
+
+    def __init__(self, db_path: Optional[str] = None, user_id: Optional[str] = None):
+        """
+        Apre il database e crea lo schema se necessario
+        Senza db_path usa il database dell'utente (un file per utente, nel layout sharded)
+        """
+        self.user_id = user_id
+        self.db_path = db_path or user_path(user_id, config.SQLITE_PATH)
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._lock_stats = {"acquisitions": 0, "contended": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        self._ensure_user_profile()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Connessione del thread corrente (sqlite3 non è condivisibile tra thread)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: le transazioni sono aperte esplicitamente con BEGIN
+            conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _begin(self, conn: sqlite3.Connection):
+        """Apre una transazione di scrittura, misurando l'attesa sul lock del database"""
+        start = time.perf_counter()
+        conn.execute("BEGIN IMMEDIATE")
+        waited = time.perf_counter() - start
+
+        with self._stats_lock:
+            stats = self._lock_stats
+            stats["acquisitions"] += 1
+            # Sotto al millisecondo non c'è stata attesa su un altro writer
+            if waited > 0.001:
+                stats["contended"] += 1
+                stats["wait_seconds"] += waited
+                stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+
+    def _ensure_user_profile(self):
+        """Crea il profilo utente se non esiste"""
+        if self._conn().execute(SQL_LOAD_PROFILE).fetchone() is None:
+            self.save_user_profile(default_user_profile())
+
+    def close(self):
+        """Chiude la connessione del thread corrente"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # ========== USER PROFILE ==========
+
+    @staticmethod
+    def _row_to_profile(row: sqlite3.Row) -> Dict:
+        return {
+            "created_at": row["created_at"],
+            "current_streak": row["current_streak"],
+            "longest_streak": row["longest_streak"],
+            "total_entries": row["total_entries"],
+            "last_entry_date": row["last_entry_date"],
+            "milestones_achieved": json.loads(row["milestones_achieved"]),
+            "preferences": json.loads(row["preferences"])
+        }
+
+    @staticmethod
+    def _profile_params(profile: Dict) -> Dict:
+        return {
+            "created_at": profile.get("created_at"),
+            "current_streak": profile.get("current_streak", 0),
+            "longest_streak": profile.get("longest_streak", 0),
+            "total_entries": profile.get("total_entries", 0),
+            "last_entry_date": profile.get("last_entry_date"),
+            "milestones_achieved": json.dumps(profile.get("milestones_achieved", []), ensure_ascii=False),
+            "preferences": json.dumps(profile.get("preferences", {}), ensure_ascii=False)
+        }
+
+    def load_user_profile(self) -> Dict:
+        """Carica il profilo utente"""
+        return self._row_to_profile(self._conn().execute(SQL_LOAD_PROFILE).fetchone())
+
+    def save_user_profile(self, profile: Dict):
+        """Salva il profilo utente"""
+        self._conn().execute(SQL_SAVE_PROFILE, self._profile_params(profile))
+
+    def update_streak(self) -> Dict:
+        """
+        Aggiorna lo streak in una transazione (BEGIN IMMEDIATE blocca gli altri writer)
+        Returns: dict con info su streak e milestone raggiunta (se presente)
+        """
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            profile = self._row_to_profile(conn.execute(SQL_LOAD_PROFILE).fetchone())
+            result, changed = apply_streak_update(profile, date.today())
+            if changed:
+                conn.execute(SQL_SAVE_PROFILE, self._profile_params(profile))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    # ========== CONVERSATIONS ==========
+
+    def save_conversation(self, conversation: List[Dict], entry_date: Optional[str] = None,
+                          session_id: Optional[str] = None) -> str:
+        """
+        Salva una conversazione completa come nuova sessione del giorno
+        conversation: lista di dict {"role": "user/assistant", "content": "..."}
+        Returns: id della sessione
+        """
+        session_id = session_id or uuid.uuid4().hex
+        self.append_conversation(conversation, session_id, entry_date)
+        return session_id
+
+    def append_conversation(self, messages: List[Dict], session_id: str,
+                            entry_date: Optional[str] = None):
+        """Aggiunge messaggi alla sessione indicata (la crea se è nuova)"""
+        if not messages:
+            return
+        if entry_date is None:
+            entry_date = date.today().isoformat()
+
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            row = conn.execute(SQL_FIND_SESSION, (entry_date, session_id)).fetchone()
+            if row is not None:
+                session_num = row["session"]
+            else:
+                session_num = conn.execute(SQL_OPEN_SESSION,
+                                           (entry_date, datetime.now().isoformat())).fetchone()[0]
+            conn.executemany(SQL_INSERT_MESSAGE, [
+                (entry_date, session_num, session_id, msg["role"], msg["content"])
+                for msg in messages
+            ])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_conversation(self, entry_date: str) -> Optional[List[Dict]]:
+        """Carica una conversazione specifica"""
+        conn = self._conn()
+        if conn.execute(SQL_HAS_CONVERSATION, (entry_date,)).fetchone() is None:
+            return None
+        return [{"role": row["role"], "content": row["content"]}
+                for row in conn.execute(SQL_LOAD_MESSAGES, (entry_date,))]
+
+    # ========== ENTRIES (log giornalieri narrativi) ==========
+
+    @staticmethod
+    def _row_to_entry(row: sqlite3.Row) -> Dict:
+        return {
+            "date": row["date"],
+            "timestamp": row["timestamp"],
+            "entry": row["entry"],
+            "metadata": json.loads(row["metadata"])
+        }
+
+    def save_entry(self, entry_text: str, metadata: Optional[Dict] = None,
+                   entry_date: Optional[str] = None):
+        """
+        Salva un log giornaliero narrativo generato dall'AI
+        Se esiste già un entry per oggi, lo sovrascrive (perché sarà già stato combinato)
+        """
+        if entry_date is None:
+            entry_date = date.today().isoformat()
+
+        self._conn().execute(SQL_SAVE_ENTRY, (
+            entry_date,
+            datetime.now().isoformat(),
+            entry_text,
+            json.dumps(metadata or {}, ensure_ascii=False)
+        ))
+
+    def append_to_entry(self, entry_text: str, metadata: Optional[Dict] = None,
+                        entry_date: Optional[str] = None):
+        """Aggiunge testo all'entry del giorno (o lo crea) in un'unica transazione"""
+        if entry_date is None:
+            entry_date = date.today().isoformat()
+
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            row = conn.execute(SQL_LOAD_ENTRY, (entry_date,)).fetchone()
+            if row is not None and row["entry"]:
+                entry_text = row["entry"] + "\n\n" + entry_text
+            conn.execute(SQL_SAVE_ENTRY, (
+                entry_date,
+                datetime.now().isoformat(),
+                entry_text,
+                json.dumps(metadata or {}, ensure_ascii=False)
+            ))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def load_entry(self, entry_date: str) -> Optional[Dict]:
+        """Carica un entry specifico"""
+        row = self._conn().execute(SQL_LOAD_ENTRY, (entry_date,)).fetchone()
+        return self._row_to_entry(row) if row else None
+
+    def has_entry(self, entry_date: str) -> bool:
+        """Verifica se esiste un entry per la data"""
+        return self._conn().execute(SQL_HAS_ENTRY, (entry_date,)).fetchone() is not None
+
+    def get_entry_dates(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Date con entry nell'intervallo [start, end] in ordine crescente"""
+        rows = self._conn().execute(SQL_ENTRY_DATES, (start or "", end or "9999-12-31"))
+        return [row["date"] for row in rows]
+
+    def get_recent_entry_dates(self, num_days: int = 7) -> List[str]:
+        """Ultime N date con entry, dalla più recente"""
+        return [row["date"] for row in self._conn().execute(SQL_RECENT_DATES, (max(num_days, 0),))]
+
+    def get_entries_between(self, start: Optional[str] = None, end: Optional[str] = None,
+                            fields: Optional[List[str]] = None) -> List[Dict]:
+        """Entries tra start ed end (inclusi) in ordine cronologico, ridotti ai campi richiesti"""
+        return [project_entry(entry, fields) for entry in self.iter_entries(start, end, reverse=False)]
+
+    def get_completion_bitmap(self, year: int, month: Optional[int] = None) -> int:
+        """
+        Bitmap dei giorni con entry: bit i = giorno i+1 del mese (o dell'anno se month è None)
+        Range scan sulla chiave primaria limitato a un anno: costo indipendente dallo storico
+        """
+        dates = self.get_entry_dates(f"{year:04d}-01-01", f"{year:04d}-12-31")
+        year_bits = year_bitmap(dates).get(year, 0)
+        if month is None:
+            return year_bits
+        return month_bitmap(year_bits, year, month)
+
+    def get_today_entry_text(self) -> Optional[str]:
+        """
+        Ottiene il testo del log di oggi se esiste
+        Returns: Il testo del log o None se non esiste
+        """
+        entry_data = self.load_entry(date.today().isoformat())
+        if entry_data:
+            return entry_data.get("entry")
+        return None
+
+    def get_recent_entries(self, num_days: int = 7) -> List[Dict]:
+        """Ottiene gli ultimi N giorni di entries"""
+        return list(islice(self.iter_entries(), max(num_days, 0)))
+
+    # ========== ITERATORI (streaming) ==========
+
+    def iter_entries(self, start: Optional[str] = None, end: Optional[str] = None,
+                     reverse: bool = True) -> Iterator[Dict]:
+        """Scorre gli entries tra start ed end (inclusi) una riga alla volta dal cursore"""
+        sql = SQL_ENTRIES_BETWEEN_DESC if reverse else SQL_ENTRIES_BETWEEN
+        cursor = self._conn().execute(sql, (start or "", end or "9999-12-31"))
+        try:
+            for row in cursor:
+                yield self._row_to_entry(row)
+        finally:
+            # Interrotto a metà (es. islice): chiude subito lo statement e il suo snapshot
+            cursor.close()
+
+    def iter_conversations(self, start: Optional[str] = None, end: Optional[str] = None,
+                           reverse: bool = True) -> Iterator[Dict]:
+        """
+        Scorre le conversazioni giornaliere tra start ed end, un giorno alla volta
+        Yields: {"date": ..., "messages": [...]}
+        """
+        dates = [row["date"] for row in
+                 self._conn().execute(SQL_CONVERSATION_DATES, (start or "", end or "9999-12-31"))]
+        for entry_date in (reversed(dates) if reverse else dates):
+            yield {"date": entry_date, "messages": self.load_conversation(entry_date) or []}
+
+    # ========== EMOZIONI (serie temporale) ==========
+
+    @staticmethod
+    def _row_to_emotions(row: sqlite3.Row) -> Tuple[str, Dict[str, int]]:
+        emotions = json.loads(row["metadata"]).get("emotions_detected") or {}
+        return row["date"], {name: emotions.get(name, 0) for name in config.EMOTION_KEYWORDS}
+
+    def get_recent_emotions(self, num_days: int = 30) -> List[Tuple[str, Dict[str, int]]]:
+        """Ultimi N giorni con entry e relativi contatori emozioni, dal più recente"""
+        rows = self._conn().execute(SQL_RECENT_METADATA, (max(num_days, 0),))
+        return [self._row_to_emotions(row) for row in rows]
+
+    def get_emotions_between(self, start: Optional[str] = None,
+                             end: Optional[str] = None) -> List[Tuple[str, Dict[str, int]]]:
+        """Contatori emozioni dei giorni con entry tra start ed end, in ordine cronologico"""
+        rows = self._conn().execute(SQL_METADATA_BETWEEN, (start or "", end or "9999-12-31"))
+        return [self._row_to_emotions(row) for row in rows]
+
+    # ========== SUGGERIMENTI (cache) ==========
+
+    def entries_fingerprint(self, num_days: int = 7) -> str:
+        """Impronta degli ultimi N entries (data e timestamp di salvataggio)"""
+        rows = self._conn().execute(SQL_RECENT_STAMPS, (max(num_days, 0),))
+        parts = [f"{row['date']}:{row['timestamp']}" for row in rows]
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
+
+    def load_suggestions(self) -> Optional[Dict]:
+        """Ultimi suggerimenti salvati ({fingerprint, date, generated_at, data}) o None"""
+        row = self._conn().execute(SQL_LOAD_SUGGESTIONS).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def save_suggestions(self, cached: Dict):
+        """Salva i suggerimenti generati insieme all'impronta degli entries usati"""
+        self._conn().execute(SQL_SAVE_SUGGESTIONS, (json.dumps(cached, ensure_ascii=False),))
+
+    # ========== UTILITY ==========
+
+    def get_stats(self) -> Dict:
+        """Ottiene statistiche generali"""
+        profile = self.load_user_profile()
+
+        return {
+            "total_entries": profile["total_entries"],
+            "current_streak": profile["current_streak"],
+            "longest_streak": profile["longest_streak"],
+            "milestones": profile["milestones_achieved"],
+            "last_entry": profile["last_entry_date"]
+        }
+
+    def rebuild_entry_index(self) -> int:
+        """Nessun indice separato: la tabella entries (chiave date) è già l'indice. Ritorna gli entries"""
+        (count,) = self._conn().execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    def rebuild_emotion_store(self) -> int:
+        """Nessuna serie separata: le emozioni si leggono dai metadata degli entries. Ritorna i giorni"""
+        return self.rebuild_entry_index()
+
+    def compact_conversations(self, before: Optional[str] = None) -> int:
+        """Nessun log da compattare: i messaggi sono già righe di tabella"""
+        return 0
+
+    def archive_old_data(self, older_than_days: Optional[int] = None) -> Dict[str, int]:
+        """Nessun archivio separato: righe e pagine del database sono già compatte"""
+        return {"entries": 0, "conversations": 0}
+
+    def lock_stats(self) -> Dict:
+        """Metriche di contesa sulle transazioni di scrittura (per processo)"""
+        with self._stats_lock:
+            stats = dict(self._lock_stats)
+        return {
+            "enabled": True,
+            "pid": os.getpid(),
+            "acquisitions": stats["acquisitions"],
+            "contended": stats["contended"],
+            "contention_rate": round(stats["contended"] / stats["acquisitions"], 3) if stats["acquisitions"] else 0.0,
+            "total_wait_ms": round(stats["wait_seconds"] * 1000, 1),
+            "max_wait_ms": round(stats["max_wait_seconds"] * 1000, 1)
+        }
+
+    def cache_stats(self) -> Dict:
+        """Nessuna cache applicativa: le letture sono servite dalla page cache di SQLite"""
+        return {"enabled": False}
+
+    # ========== MIGRAZIONE ==========
+
+    def import_entry(self, data: Dict):
+        """Importa un entry già serializzato (mantiene il timestamp originale)"""
+        self._conn().execute(SQL_SAVE_ENTRY, (
+            data["date"],
+            data.get("timestamp") or datetime.now().isoformat(),
+            data.get("entry", ""),
+            json.dumps(data.get("metadata") or {}, ensure_ascii=False)
+        ))
+
+    def import_conversation(self, data: Dict):
+        """Importa una conversazione giornaliera già serializzata (tutti i messaggi in una sessione)"""
+        conn = self._conn()
+        self._begin(conn)
+        try:
+            conn.execute("DELETE FROM messages WHERE date = ?", (data["date"],))
+            conn.execute(
+                "INSERT OR REPLACE INTO conversations (date, timestamp, sessions) VALUES (?, ?, ?)",
+                (data["date"], data.get("timestamp") or datetime.now().isoformat(),
+                 data.get("sessions", 1))
+            )
+            conn.executemany(SQL_INSERT_MESSAGE, [
+                (data["date"], 1, None, msg["role"], msg["content"])
+                for msg in data.get("messages", [])
+            ])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
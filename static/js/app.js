@@ -218,6 +218,87 @@ function addChatMessage(role, content) {
     elements.chatMessages.scrollTop = elements.chatMessages.scrollHeight;
 
     state.chatMessages.push({ role, content });
+
+    return bubbleDiv;
+}
+
+function appendToChatMessage(bubbleDiv, delta) {
+    bubbleDiv.textContent += delta;
+    state.chatMessages[state.chatMessages.length - 1].content = bubbleDiv.textContent;
+    elements.chatMessages.scrollTop = elements.chatMessages.scrollHeight;
+}
+
+// Legge uno stream Server-Sent Events da una risposta fetch (POST, quindi niente EventSource)
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+
+            let event = 'message';
+            let data = '';
+            for (const line of rawEvent.split('\n')) {
+                if (line.startsWith('event: ')) event = line.slice(7);
+                else if (line.startsWith('data: ')) data += line.slice(6);
+            }
+            onEvent(event, data ? JSON.parse(data) : {});
+        }
+    }
+}
+
+// Il log viene generato in background: interroga lo stato del job finché non è pronto
+async function waitForJob(jobId, intervalMs = 1000, maxAttempts = 120) {
+    for (let i = 0; i < maxAttempts; i++) {
+        const response = await fetch(`/api/jobs/${jobId}`);
+        const job = await response.json();
+
+        if (job.status === 'done') return job;
+        if (job.status === 'failed' || !response.ok) {
+            throw new Error(job.error || 'Generazione diario fallita');
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+    throw new Error('Generazione diario in ritardo');
+}
+
+async function handleChatEnd(data) {
+    if (data.should_end && data.job_id) {
+        showToast('Sto scrivendo il diario...', 'success');
+        try {
+            const job = await waitForJob(data.job_id);
+            handleChatEnd({ should_end: true, journal_entry: job.journal_entry, streak: job.streak });
+        } catch (error) {
+            console.error('Error generating journal:', error);
+            showToast('Errore generazione diario', 'error');
+        }
+        return;
+    }
+
+    if (data.should_end && data.journal_entry) {
+        // Show generated journal entry
+        showToast('Diario generato!', 'success');
+
+        // Update streak
+        if (data.streak) {
+            elements.streakNumber.textContent = data.streak;
+        }
+
+        // Show journal entry in a modal or editor
+        setTimeout(() => {
+            closeChatMode();
+            elements.journalEditor.value = data.journal_entry;
+            updateWordCount();
+        }, 2000);
+    }
 }
 
 elements.chatSendBtn.addEventListener('click', sendChatMessage);
@@ -244,7 +325,7 @@ async function sendChatMessage() {
     elements.chatSendBtn.disabled = true;
 
     try {
-        const response = await fetch('/api/chat/message', {
+        const response = await fetch('/api/chat/stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
@@ -252,32 +333,23 @@ async function sendChatMessage() {
             body: JSON.stringify({ message })
         });
 
-        const data = await response.json();
+        if (!response.ok) {
+            const data = await response.json();
+            throw new Error(data.error || 'Errore invio messaggio');
+        }
 
-        if (data.success) {
-            // Add AI response
-            addChatMessage('assistant', data.response);
-
-            // Check if conversation ended
-            if (data.should_end) {
-                if (data.journal_entry) {
-                    // Show generated journal entry
-                    showToast('Diario generato!', 'success');
-
-                    // Update streak
-                    if (data.streak) {
-                        elements.streakNumber.textContent = data.streak;
-                    }
-
-                    // Show journal entry in a modal or editor
-                    setTimeout(() => {
-                        closeChatMode();
-                        elements.journalEditor.value = data.journal_entry;
-                        updateWordCount();
-                    }, 2000);
-                }
+        // La bolla della risposta si riempie man mano che arrivano i token
+        const bubble = addChatMessage('assistant', '');
+
+        await readEventStream(response, (event, data) => {
+            if (event === 'token') {
+                appendToChatMessage(bubble, data.delta);
+            } else if (event === 'done') {
+                handleChatEnd(data);
+            } else if (event === 'error') {
+                throw new Error(data.error);
             }
-        }
+        });
     } catch (error) {
         console.error('Error sending message:', error);
         showToast('Errore invio messaggio', 'error');
@@ -1,180 +1,399 @@
 """
 Gestione dello storage dei dati (JSON-based)
+Il backend SQLite alternativo è in sqlite_storage.py, selezionabile con config.STORAGE_BACKEND
 """
 
+import functools
+import hashlib
 import json
 import os
-from datetime import datetime, date
-from typing import Dict, List, Optional
+import re
+import threading
+import uuid
+from collections import OrderedDict, defaultdict
+from itertools import islice
+from datetime import datetime, date, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
 import config
+from archive import SegmentArchive
+from emotion_store import EmotionStore
+from entry_index import EntryIndex, INDEX_FIELDS, month_bitmap
+from file_cache import JsonFileCache
+from file_lock import UserLock, atomic_write_json, truncate_torn_tail
+
+
+USER_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}$")
+
+
+def user_data_dir(user_id: Optional[str] = None) -> str:
+    """
+    Directory dei dati di un utente
+    user_id None = layout a utente singolo in config.DATA_DIR; altrimenti
+    users/<aa>/<bb>/<user_id>, con i prefissi presi dall'hash dell'id così che
+    nessuna directory contenga più di 256 sottodirectory per livello
+    """
+    if user_id is None:
+        return config.DATA_DIR
+    if not USER_ID_PATTERN.match(user_id):
+        raise ValueError(f"user_id non valido: {user_id!r}")
+
+    digest = hashlib.sha1(user_id.encode('utf-8')).hexdigest()
+    shards = [digest[i * 2:i * 2 + 2] for i in range(config.USER_SHARD_DEPTH)]
+    return os.path.join(config.USERS_DIR, *shards, user_id)
+
+
+def user_path(user_id: Optional[str], config_path: str) -> str:
+    """Trasla un path di config (relativo a DATA_DIR) nella directory dell'utente"""
+    return os.path.join(user_data_dir(user_id), os.path.relpath(config_path, config.DATA_DIR))
+
+
+def iter_user_ids() -> Iterator[str]:
+    """Id degli utenti con una directory in USERS_DIR (in ordine, shard per shard)"""
+    def walk(path: str, depth: int) -> Iterator[str]:
+        if not os.path.isdir(path):
+            return
+        for name in sorted(os.listdir(path)):
+            child = os.path.join(path, name)
+            if not os.path.isdir(child):
+                continue
+            if depth == 0:
+                if USER_ID_PATTERN.match(name):
+                    yield name
+            else:
+                yield from walk(child, depth - 1)
+
+    yield from walk(config.USERS_DIR, config.USER_SHARD_DEPTH)
+
+
+def project_entry(entry: Dict, fields: Optional[List[str]] = None) -> Dict:
+    """
+    Riduce un entry ai campi richiesti
+    Oltre ai campi salvati supporta quelli derivati dell'indice ("source", "words")
+    """
+    if fields is None:
+        return entry
+    derived = {
+        "source": (entry.get("metadata") or {}).get("source"),
+        "words": len((entry.get("entry") or "").split())
+    }
+    return {field: entry[field] if field in entry else derived.get(field) for field in fields}
+
+
+def has_editor_text(entry: Optional[Dict]) -> bool:
+    """
+    True se l'entry contiene testo scritto dall'utente nell'editor: salvato dall'editor
+    o rigenerato da una chat a partire da un entry che lo conteneva
+    """
+    metadata = (entry or {}).get("metadata") or {}
+    return metadata.get("source") == "editor" or bool(metadata.get("editor_text"))
+
+
+def default_user_profile() -> Dict:
+    """Profilo utente iniziale"""
+    return {
+        "created_at": datetime.now().isoformat(),
+        "current_streak": 0,
+        "longest_streak": 0,
+        "total_entries": 0,
+        "last_entry_date": None,
+        "milestones_achieved": [],
+        "preferences": {
+            "name": None,
+            "timezone": "Europe/Rome"
+        }
+    }
+
+
+def apply_streak_update(profile: Dict, today_date: date) -> Tuple[Dict, bool]:
+    """
+    Applica al profilo (in place) l'aggiornamento dello streak per la data indicata.
+    Condivisa da tutti i backend di storage.
+    Returns: (dict con info su streak e milestone, True se il profilo è cambiato)
+    """
+    today = today_date.isoformat()
+    last_entry = profile.get("last_entry_date")
+    if last_entry:
+        # Profili vecchi salvano un datetime completo: conta solo il giorno
+        last_entry = last_entry[:10]
+
+    result = {
+        "streak_continued": False,
+        "streak_broken": False,
+        "new_milestone": None,
+        "current_streak": 0
+    }
+
+    if last_entry is None:
+        # Prima entry in assoluto
+        profile["current_streak"] = 1
+        profile["last_entry_date"] = today
+        result["streak_continued"] = True
+        result["current_streak"] = 1
+
+    elif last_entry == today:
+        # Già scritto oggi
+        result["current_streak"] = profile["current_streak"]
+        return result, False
+
+    else:
+        # Calcola differenza giorni
+        last_date = date.fromisoformat(last_entry)
+        days_diff = (today_date - last_date).days
+
+        if days_diff == 1:
+            # Streak continua!
+            profile["current_streak"] += 1
+            profile["last_entry_date"] = today
+            result["streak_continued"] = True
+            result["current_streak"] = profile["current_streak"]
+
+            # Controlla milestone
+            streak = profile["current_streak"]
+            if streak in config.STREAK_MILESTONES:
+                milestone_name = config.STREAK_MILESTONES[streak]
+                if milestone_name not in profile["milestones_achieved"]:
+                    profile["milestones_achieved"].append(milestone_name)
+                    result["new_milestone"] = {
+                        "days": streak,
+                        "name": milestone_name
+                    }
+
+            # Aggiorna longest streak
+            if profile["current_streak"] > profile["longest_streak"]:
+                profile["longest_streak"] = profile["current_streak"]
+
+        else:
+            # Streak interrotto
+            result["streak_broken"] = True
+            result["previous_streak"] = profile["current_streak"]
+            profile["current_streak"] = 1
+            profile["last_entry_date"] = today
+            result["current_streak"] = 1
+
+    # Incrementa totale entries
+    profile["total_entries"] += 1
+
+    return result, True
+
+
+def _locked(method):
+    """Esegue il metodo sotto il lock dei dati dell'utente (rientrante, valido tra processi)"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
 
 
 class Storage:
     """Gestisce il salvataggio e caricamento di tutti i dati dell'applicazione"""
 
-    def __init__(self):
-        """Inizializza le directory necessarie"""
+    def __init__(self, user_id: Optional[str] = None):
+        """
+        Inizializza le directory necessarie
+        user_id: utente proprietario dei dati (None = layout a utente singolo)
+        """
+        self.user_id = user_id
+        self.data_dir = user_data_dir(user_id)
+        self.entries_dir = user_path(user_id, config.ENTRIES_DIR)
+        self.conversations_dir = user_path(user_id, config.CONVERSATIONS_DIR)
+        self.profile_path = user_path(user_id, config.USER_PROFILE_PATH)
+        self.suggestions_path = user_path(user_id, config.SUGGESTIONS_CACHE_PATH)
+        emotions_path = user_path(user_id, config.EMOTIONS_STORE_PATH)
+
+        self.cache = JsonFileCache(config.STORAGE_CACHE_SIZE)
         self._ensure_directories()
-        self._ensure_user_profile()
+        self.lock = UserLock(os.path.join(self.data_dir, ".lock"))
+
+        with self.lock:
+            self._ensure_user_profile()
+            self.archive = SegmentArchive(user_path(user_id, config.ARCHIVE_DIR),
+                                          zdicts={"conversations": config.SYSTEM_PROMPT.encode('utf-8')})
+            self.entry_index = EntryIndex(user_path(user_id, config.ENTRIES_INDEX_PATH), self.entries_dir,
+                                          archive=self.archive, lock=self.lock)
+            self.emotion_store = EmotionStore(emotions_path)
+            if not os.path.exists(emotions_path) and len(self.entry_index):
+                self.rebuild_emotion_store()
 
     def _ensure_directories(self):
         """Crea le directory se non esistono"""
-        os.makedirs(config.DATA_DIR, exist_ok=True)
-        os.makedirs(config.CONVERSATIONS_DIR, exist_ok=True)
-        os.makedirs(config.ENTRIES_DIR, exist_ok=True)
+        os.makedirs(self.data_dir, exist_ok=True)
+        os.makedirs(self.conversations_dir, exist_ok=True)
+        os.makedirs(self.entries_dir, exist_ok=True)
 
     def _ensure_user_profile(self):
         """Crea il profilo utente se non esiste"""
-        if not os.path.exists(config.USER_PROFILE_PATH):
-            default_profile = {
-                "created_at": datetime.now().isoformat(),
-                "current_streak": 0,
-                "longest_streak": 0,
-                "total_entries": 0,
-                "last_entry_date": None,
-                "milestones_achieved": [],
-                "preferences": {
-                    "name": None,
-                    "timezone": "Europe/Rome"
-                }
-            }
-            self.save_user_profile(default_profile)
+        if not os.path.exists(self.profile_path):
+            self.save_user_profile(default_user_profile())
+
+    # ========== FILE I/O ==========
+
+    def _read_json(self, path: str):
+        """Legge un file JSON (servito dalla cache se mtime/size non sono cambiati)"""
+        return self.cache.load(path)
+
+    def _write_json(self, path: str, data, indent: Optional[int] = 2):
+        """Scrive un file JSON in modo atomico e aggiorna la cache con il nuovo contenuto"""
+        atomic_write_json(path, data, indent=indent)
+        self.cache.store(path, data)
+
+    def cache_stats(self) -> Dict:
+        """Contatori hit/miss della cache dei file"""
+        return self.cache.stats()
+
+    def lock_stats(self) -> Dict:
+        """Metriche di contesa del lock dei dati dell'utente"""
+        return self.lock.stats()
 
     # ========== USER PROFILE ==========
 
     def load_user_profile(self) -> Dict:
         """Carica il profilo utente"""
-        with open(config.USER_PROFILE_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return self._read_json(self.profile_path)
 
+    @_locked
     def save_user_profile(self, profile: Dict):
         """Salva il profilo utente"""
-        with open(config.USER_PROFILE_PATH, 'w', encoding='utf-8') as f:
-            json.dump(profile, f, indent=2, ensure_ascii=False)
+        self._write_json(self.profile_path, profile)
 
+    @_locked
     def update_streak(self) -> Dict:
         """
         Aggiorna lo streak basandosi sulla data corrente.
         Returns: dict con info su streak e milestone raggiunta (se presente)
         """
         profile = self.load_user_profile()
-        today = date.today().isoformat()
-        last_entry = profile.get("last_entry_date")
-
-        result = {
-            "streak_continued": False,
-            "streak_broken": False,
-            "new_milestone": None,
-            "current_streak": 0
-        }
-
-        if last_entry is None:
-            # Prima entry in assoluto
-            profile["current_streak"] = 1
-            profile["last_entry_date"] = today
-            result["streak_continued"] = True
-            result["current_streak"] = 1
-
-        elif last_entry == today:
-            # Già scritto oggi
-            result["current_streak"] = profile["current_streak"]
-            return result
-
-        else:
-            # Calcola differenza giorni
-            last_date = date.fromisoformat(last_entry)
-            today_date = date.today()
-            days_diff = (today_date - last_date).days
-
-            if days_diff == 1:
-                # Streak continua!
-                profile["current_streak"] += 1
-                profile["last_entry_date"] = today
-                result["streak_continued"] = True
-                result["current_streak"] = profile["current_streak"]
-
-                # Controlla milestone
-                streak = profile["current_streak"]
-                if streak in config.STREAK_MILESTONES:
-                    milestone_name = config.STREAK_MILESTONES[streak]
-                    if milestone_name not in profile["milestones_achieved"]:
-                        profile["milestones_achieved"].append(milestone_name)
-                        result["new_milestone"] = {
-                            "days": streak,
-                            "name": milestone_name
-                        }
-
-                # Aggiorna longest streak
-                if profile["current_streak"] > profile["longest_streak"]:
-                    profile["longest_streak"] = profile["current_streak"]
-
-            else:
-                # Streak interrotto
-                result["streak_broken"] = True
-                result["previous_streak"] = profile["current_streak"]
-                profile["current_streak"] = 1
-                profile["last_entry_date"] = today
-                result["current_streak"] = 1
+        result, changed = apply_streak_update(profile, date.today())
 
-        # Incrementa totale entries
-        profile["total_entries"] += 1
-
-        self.save_user_profile(profile)
+        if changed:
+            self.save_user_profile(profile)
         return result
 
     # ========== CONVERSATIONS ==========
 
-    def save_conversation(self, conversation: List[Dict], entry_date: Optional[str] = None):
+    def _conversation_paths(self, entry_date: str) -> Tuple[str, str]:
+        """Path del file compatto (.json) e del log append-only (.jsonl) di un giorno"""
+        base = os.path.join(self.conversations_dir, f"conversation_{entry_date}")
+        return base + ".json", base + ".jsonl"
+
+    def save_conversation(self, conversation: List[Dict], entry_date: Optional[str] = None,
+                          session_id: Optional[str] = None) -> str:
         """
-        Salva una conversazione completa
+        Salva una conversazione completa come nuova sessione del giorno
         conversation: lista di dict {"role": "user/assistant", "content": "..."}
+        Returns: id della sessione
         """
+        session_id = session_id or uuid.uuid4().hex
+        self.append_conversation(conversation, session_id, entry_date)
+        return session_id
+
+    @_locked
+    def append_conversation(self, messages: List[Dict], session_id: str,
+                            entry_date: Optional[str] = None):
+        """
+        Aggiunge messaggi al log append-only del giorno (una riga JSON per messaggio).
+        Costo proporzionale ai soli messaggi nuovi; un crash perde al massimo la riga in scrittura.
+        """
+        if not messages:
+            return
         if entry_date is None:
             entry_date = date.today().isoformat()
 
-        filename = f"conversation_{entry_date}.json"
-        filepath = os.path.join(config.CONVERSATIONS_DIR, filename)
-
-        # Se esiste già una conversazione oggi, aggiungi invece di sovrascrivere
-        existing_data = None
-        if os.path.exists(filepath):
-            with open(filepath, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-
-        if existing_data:
-            # Aggiungi le nuove conversazioni a quelle esistenti
-            data = {
-                "date": entry_date,
-                "timestamp": datetime.now().isoformat(),
-                "messages": existing_data["messages"] + conversation,
-                "sessions": existing_data.get("sessions", 1) + 1
-            }
-        else:
-            # Prima conversazione della giornata
-            data = {
-                "date": entry_date,
-                "timestamp": datetime.now().isoformat(),
-                "messages": conversation,
-                "sessions": 1
-            }
+        _, log_path = self._conversation_paths(entry_date)
+        timestamp = datetime.now().isoformat()
+        lines = [
+            json.dumps({"session": session_id, "timestamp": timestamp,
+                        "role": msg["role"], "content": msg["content"]},
+                       ensure_ascii=False)
+            for msg in messages
+        ]
+
+        # Una riga troncata da un crash precedente verrebbe fusa con la prima riga nuova
+        truncate_torn_tail(log_path)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _iter_log_records(self, log_path: str) -> Iterator[Dict]:
+        """Legge il log .jsonl riga per riga (ignora un'eventuale ultima riga troncata)"""
+        with open(log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def iter_conversation_messages(self, entry_date: str) -> Iterator[Dict]:
+        """
+        Messaggi di un giorno in ordine: prima la parte archiviata o compattata,
+        poi il log append-only
+        """
+        compact_path, log_path = self._conversation_paths(entry_date)
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        archived = self.archive.read("conversations", entry_date)
+        if archived is not None:
+            yield from archived.get("messages", [])
+
+        if os.path.exists(compact_path):
+            yield from self._read_json(compact_path).get("messages", [])
+
+        if os.path.exists(log_path):
+            for record in self._iter_log_records(log_path):
+                yield {"role": record["role"], "content": record["content"]}
 
     def load_conversation(self, entry_date: str) -> Optional[List[Dict]]:
         """Carica una conversazione specifica"""
-        filename = f"conversation_{entry_date}.json"
-        filepath = os.path.join(config.CONVERSATIONS_DIR, filename)
+        compact_path, log_path = self._conversation_paths(entry_date)
 
-        if not os.path.exists(filepath):
+        if (not os.path.exists(compact_path) and not os.path.exists(log_path)
+                and self.archive.locate("conversations", entry_date) is None):
             return None
 
-        with open(filepath, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data.get("messages", [])
+        return list(self.iter_conversation_messages(entry_date))
+
+    @_locked
+    def compact_conversations(self, before: Optional[str] = None) -> int:
+        """
+        Compatta i log append-only dei giorni conclusi (data < before, default oggi)
+        in un unico JSON compatto per giorno
+        Returns: numero di giorni compattati
+        """
+        before = before or date.today().isoformat()
+        compacted = 0
+
+        for filename in sorted(os.listdir(self.conversations_dir)):
+            if not (filename.startswith("conversation_") and filename.endswith(".jsonl")):
+                continue
+            entry_date = filename[len("conversation_"):-len(".jsonl")]
+            if entry_date >= before:
+                continue
+
+            compact_path, log_path = self._conversation_paths(entry_date)
+            data = {"date": entry_date, "timestamp": None, "messages": [], "sessions": 0}
+            if os.path.exists(compact_path):
+                data.update(self._read_json(compact_path))
+
+            sessions = set()
+            for record in self._iter_log_records(log_path):
+                sessions.add(record["session"])
+                data["messages"].append({"role": record["role"], "content": record["content"]})
+                data["timestamp"] = record["timestamp"]
+            data["sessions"] += len(sessions)
+
+            # Scrittura atomica: il log si elimina solo a compattazione completata
+            self._write_json(compact_path, data, indent=None)
+            os.remove(log_path)
+            compacted += 1
+
+        return compacted
 
     # ========== ENTRIES (log giornalieri narrativi) ==========
 
+    @_locked
     def save_entry(self, entry_text: str, metadata: Optional[Dict] = None,
                    entry_date: Optional[str] = None):
         """
@@ -185,7 +404,7 @@ class Storage:
             entry_date = date.today().isoformat()
 
         filename = f"entry_{entry_date}.json"
-        filepath = os.path.join(config.ENTRIES_DIR, filename)
+        filepath = os.path.join(self.entries_dir, filename)
 
         data = {
             "date": entry_date,
@@ -194,19 +413,84 @@ class Storage:
             "metadata": metadata or {}
         }
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        self._write_json(filepath, data)
+
+        self.entry_index.update(entry_date, filename, data)
+        self.emotion_store.put(entry_date, data["metadata"].get("emotions_detected"))
+
+    @_locked
+    def append_to_entry(self, entry_text: str, metadata: Optional[Dict] = None,
+                        entry_date: Optional[str] = None):
+        """
+        Aggiunge testo all'entry del giorno (o lo crea) con un unico read-modify-write sotto lock
+        """
+        if entry_date is None:
+            entry_date = date.today().isoformat()
+
+        existing = self.load_entry(entry_date)
+        if existing and existing.get("entry"):
+            entry_text = existing["entry"] + "\n\n" + entry_text
+        self.save_entry(entry_text, metadata, entry_date)
 
     def load_entry(self, entry_date: str) -> Optional[Dict]:
         """Carica un entry specifico"""
-        filename = f"entry_{entry_date}.json"
-        filepath = os.path.join(config.ENTRIES_DIR, filename)
+        record = self.entry_index.get(entry_date)
+        if record is None:
+            return None
+
+        if record.get("archived"):
+            return self.archive.read_record(record["file"], record["offset"], record["length"])
 
+        filepath = os.path.join(self.entries_dir, record["file"])
         if not os.path.exists(filepath):
             return None
 
-        with open(filepath, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        return self._read_json(filepath)
+
+    def has_entry(self, entry_date: str) -> bool:
+        """Verifica se esiste un entry per la data (solo indice, nessun file aperto)"""
+        return entry_date in self.entry_index
+
+    def get_entry_dates(self, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+        """Date con entry nell'intervallo [start, end] in ordine crescente (solo indice)"""
+        return self.entry_index.dates_between(start, end)
+
+    def get_recent_entry_dates(self, num_days: int = 7) -> List[str]:
+        """Ultime N date con entry, dalla più recente (solo indice)"""
+        return self.entry_index.recent_dates(num_days)
+
+    def get_entries_between(self, start: Optional[str] = None, end: Optional[str] = None,
+                            fields: Optional[List[str]] = None) -> List[Dict]:
+        """
+        Entries tra start ed end (inclusi) in ordine cronologico
+        fields: campi da restituire; se sono tutti in INDEX_FIELDS risponde solo l'indice
+        """
+        dates = self.entry_index.dates_between(start, end)
+
+        if fields is not None and set(fields) <= set(INDEX_FIELDS):
+            rows = []
+            for entry_date in dates:
+                record = {"date": entry_date, **self.entry_index.get(entry_date)}
+                rows.append({field: record.get(field) for field in fields})
+            return rows
+
+        return [project_entry(entry, fields)
+                for entry in self.iter_entries(start, end, reverse=False)]
+
+    def get_completion_bitmap(self, year: int, month: Optional[int] = None) -> int:
+        """
+        Bitmap dei giorni con entry: bit i = giorno i+1 del mese (o dell'anno se month è None)
+        Costo costante, indipendente dalla lunghezza dello storico
+        """
+        year_bits = self.entry_index.year_bitmap(year)
+        if month is None:
+            return year_bits
+        return month_bitmap(year_bits, year, month)
+
+    @_locked
+    def rebuild_entry_index(self) -> int:
+        """Rigenera l'indice degli entries dai file su disco"""
+        return self.entry_index.rebuild()
     
     def get_today_entry_text(self) -> Optional[str]:
         """
@@ -222,18 +506,171 @@ class Storage:
 
     def get_recent_entries(self, num_days: int = 7) -> List[Dict]:
         """Ottiene gli ultimi N giorni di entries"""
-        entries = []
+        return list(islice(self.iter_entries(), max(num_days, 0)))
+
+    # ========== ITERATORI (streaming) ==========
+
+    def iter_entries(self, start: Optional[str] = None, end: Optional[str] = None,
+                     reverse: bool = True) -> Iterator[Dict]:
+        """
+        Scorre gli entries tra start ed end (inclusi) leggendo un file alla volta
+        reverse=True parte dal più recente
+        """
+        dates = self.entry_index.dates_between(start, end)
+        for entry_date in (reversed(dates) if reverse else dates):
+            entry = self.load_entry(entry_date)
+            if entry is not None:
+                yield entry
+
+    def _conversation_dates(self, start: Optional[str], end: Optional[str]) -> List[str]:
+        """Date con una conversazione (archiviata, compattata o in log) nell'intervallo, in ordine crescente"""
+        dates = {d for d in self.archive.dates("conversations")
+                 if (start is None or d >= start) and (end is None or d <= end)}
+        with os.scandir(self.conversations_dir) as it:
+            for dir_entry in it:
+                name = dir_entry.name
+                if not name.startswith("conversation_"):
+                    continue
+                stem, _, ext = name[len("conversation_"):].partition(".")
+                if ext not in ("json", "jsonl"):
+                    continue
+                if (start is None or stem >= start) and (end is None or stem <= end):
+                    dates.add(stem)
+        return sorted(dates)
+
+    def iter_conversations(self, start: Optional[str] = None, end: Optional[str] = None,
+                           reverse: bool = True) -> Iterator[Dict]:
+        """
+        Scorre le conversazioni giornaliere tra start ed end, un giorno alla volta
+        Yields: {"date": ..., "messages": [...]}
+        """
+        dates = self._conversation_dates(start, end)
+        for entry_date in (reversed(dates) if reverse else dates):
+            yield {"date": entry_date, "messages": list(self.iter_conversation_messages(entry_date))}
 
-        for filename in sorted(os.listdir(config.ENTRIES_DIR), reverse=True):
-            if filename.startswith("entry_") and filename.endswith(".json"):
-                filepath = os.path.join(config.ENTRIES_DIR, filename)
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    entries.append(json.load(f))
+    # ========== ARCHIVIO ==========
 
-                if len(entries) >= num_days:
-                    break
+    @_locked
+    def archive_old_data(self, older_than_days: Optional[int] = None) -> Dict[str, int]:
+        """
+        Sposta entries e conversazioni più vecchi di N giorni (default config.ARCHIVE_AFTER_DAYS)
+        nei segmenti mensili compressi e rimuove i file originali
+        Returns: numero di entries e giornate di conversazione archiviati
+        """
+        if older_than_days is None:
+            older_than_days = config.ARCHIVE_AFTER_DAYS
+        cutoff = (date.today() - timedelta(days=older_than_days)).isoformat()
+        counts = {"entries": 0, "conversations": 0}
+
+        # Entries: segmento scritto -> file rimossi -> indice aggiornato (una sola scrittura)
+        by_month = defaultdict(dict)
+        for entry_date in self.entry_index.dates_between():
+            if entry_date >= cutoff:
+                break
+            record = self.entry_index.get(entry_date)
+            if record.get("archived"):
+                continue
+            entry = self.load_entry(entry_date)
+            if entry is not None:
+                by_month[entry_date[:7]][entry_date] = entry
+
+        for month, entries in sorted(by_month.items()):
+            locations = self.archive.write_segment("entries", month, entries)
+            segment_mtime = os.stat(os.path.join(self.archive.archive_dir, f"entries_{month}.seg")).st_mtime_ns
+            # Path letti prima di rimuovere: dopo la prima rimozione l'indice risulterebbe obsoleto
+            filepaths = [os.path.join(self.entries_dir, self.entry_index.get(entry_date)["file"])
+                         for entry_date in entries]
+            for filepath in filepaths:
+                os.remove(filepath)
+                self.cache.invalidate(filepath)
+            self.entry_index.update_many({
+                entry_date: EntryIndex.derive_record(name, self.archive.read_record(name, offset, length),
+                                                     offset, length, segment_mtime, archived=True)
+                for entry_date, (name, offset, length) in locations.items()
+            })
+            counts["entries"] += len(entries)
+
+        # Conversazioni: prima si compattano i log, poi si archiviano i JSON compatti
+        self.compact_conversations(before=cutoff)
+        by_month = defaultdict(dict)
+        for filename in os.listdir(self.conversations_dir):
+            if not (filename.startswith("conversation_") and filename.endswith(".json")):
+                continue
+            entry_date = filename[len("conversation_"):-len(".json")]
+            if entry_date < cutoff:
+                by_month[entry_date[:7]][entry_date] = self._read_json(
+                    os.path.join(self.conversations_dir, filename))
+
+        for month, conversations in sorted(by_month.items()):
+            # Una giornata già archiviata riceve in coda i messaggi arrivati dopo
+            for entry_date, data in conversations.items():
+                archived = self.archive.read("conversations", entry_date)
+                if archived is not None:
+                    data["messages"] = archived.get("messages", []) + data.get("messages", [])
+                    data["sessions"] = archived.get("sessions", 0) + data.get("sessions", 0)
+            self.archive.write_segment("conversations", month, conversations)
+            for entry_date in conversations:
+                compact_path, _ = self._conversation_paths(entry_date)
+                os.remove(compact_path)
+                self.cache.invalidate(compact_path)
+            counts["conversations"] += len(conversations)
+
+        return counts
+
+    # ========== EMOZIONI (serie temporale) ==========
+
+    def get_recent_emotions(self, num_days: int = 30) -> List[Tuple[str, Dict[str, int]]]:
+        """Ultimi N giorni con entry e relativi contatori emozioni, dal più recente"""
+        return self.emotion_store.recent(num_days)
+
+    def get_emotions_between(self, start: Optional[str] = None,
+                             end: Optional[str] = None) -> List[Tuple[str, Dict[str, int]]]:
+        """Contatori emozioni dei giorni con entry tra start ed end, in ordine cronologico"""
+        return self.emotion_store.window(start, end)
+
+    @_locked
+    def rebuild_emotion_store(self) -> int:
+        """Rigenera la serie delle emozioni dagli entries"""
+        def items():
+            for entry_date in self.entry_index.dates_between():
+                entry = self.load_entry(entry_date)
+                if entry is not None:
+                    yield entry_date, (entry.get("metadata") or {}).get("emotions_detected")
+
+        return self.emotion_store.rebuild(items())
+
+    # ========== SUGGERIMENTI (cache) ==========
+
+    def entries_fingerprint(self, num_days: int = 7) -> str:
+        """
+        Impronta degli ultimi N entries (data, mtime e dimensione dei file): cambia quando
+        un entry viene aggiunto, riscritto o modificato a mano. Solo indice e stat, nessuna lettura
+        """
+        parts = []
+        for entry_date in self.entry_index.recent_dates(num_days):
+            record = self.entry_index.get(entry_date) or {}
+            filepath = os.path.join(self.entries_dir, record.get("file", ""))
+            if not record.get("archived") and os.path.isfile(filepath):
+                st = os.stat(filepath)
+                parts.append(f"{entry_date}:{st.st_mtime_ns}:{st.st_size}")
+            else:
+                # Entries archiviati: immutabili, basta il timestamp dell'indice
+                parts.append(f"{entry_date}:{record.get('timestamp')}")
+        return hashlib.sha1("|".join(parts).encode('utf-8')).hexdigest()
 
-        return entries
+    def load_suggestions(self) -> Optional[Dict]:
+        """Ultimi suggerimenti salvati ({fingerprint, date, generated_at, data}) o None"""
+        if not os.path.exists(self.suggestions_path):
+            return None
+        try:
+            return self._read_json(self.suggestions_path)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    @_locked
+    def save_suggestions(self, cached: Dict):
+        """Salva i suggerimenti generati insieme all'impronta degli entries usati"""
+        self._write_json(self.suggestions_path, cached)
 
     # ========== UTILITY ==========
 
@@ -247,4 +684,40 @@ class Storage:
             "longest_streak": profile["longest_streak"],
             "milestones": profile["milestones_achieved"],
             "last_entry": profile["last_entry_date"]
-        }
\ No newline at end of file
+        }
+
+
+def create_storage(user_id: Optional[str] = None):
+    """Crea lo storage del backend scelto in config.STORAGE_BACKEND ("json" o "sqlite")"""
+    if config.STORAGE_BACKEND == "sqlite":
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(user_id=user_id)
+    if config.STORAGE_BACKEND == "json":
+        return Storage(user_id)
+    raise ValueError(f"STORAGE_BACKEND non valido: {config.STORAGE_BACKEND}")
+
+
+class StoragePool:
+    """
+    Storage per utente tenuti aperti in un LRU limitato, così indice, profilo e
+    cache di un utente attivo non vengono ricaricati a ogni richiesta
+    """
+
+    def __init__(self, max_users: int = 128):
+        self.max_users = max_users
+        self._storages: "OrderedDict[Optional[str], object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Optional[str] = None):
+        """Storage dell'utente (creato alla prima richiesta)"""
+        with self._lock:
+            storage = self._storages.get(user_id)
+            if storage is not None:
+                self._storages.move_to_end(user_id)
+                return storage
+
+            storage = create_storage(user_id)
+            self._storages[user_id] = storage
+            while len(self._storages) > self.max_users:
+                self._storages.popitem(last=False)
+            return storage
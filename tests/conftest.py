@@ -0,0 +1,21 @@
+"""
+Fixture comuni dei test
+I path di config sono relativi (DATA_DIR = "data_test"): ogni test gira in una
+directory temporanea vuota, così i dati del repository non vengono toccati
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """Directory dei dati vuota (config.DATA_DIR dentro una directory temporanea)"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / config.DATA_DIR
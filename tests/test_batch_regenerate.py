@@ -0,0 +1,106 @@
+"""
+Rigenerazione in blocco: chiavi di checkpoint separate per modalità e modello,
+righe del checkpoint troncate e testo dell'editor mai sovrascritto da --apply
+"""
+
+import argparse
+import asyncio
+import json
+import os
+
+import pytest
+
+import batch_regenerate
+import config
+from batch_regenerate import Checkpoint, iter_journal_tasks, run_batch, run_journal_task
+from storage import Storage
+
+
+class _Response:
+    def __init__(self, text):
+        message = type("Message", (), {"content": text})()
+        self.choices = [type("Choice", (), {"message": message})()]
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Modello finto: ogni log rigenerato è lo stesso testo"""
+    calls = []
+
+    async def acomplete(operation, **request):
+        calls.append(operation)
+        return _Response("Log rigenerato")
+
+    monkeypatch.setattr(config, "OPENAI_API_KEY", config.OPENAI_API_KEY or "test")
+    monkeypatch.setattr(batch_regenerate, "acomplete", acomplete)
+    return calls
+
+
+def _args(data_dir, **overrides) -> argparse.Namespace:
+    args = argparse.Namespace(kind="journal", user=None, all_users=False, start=None, end=None,
+                              days=7, concurrency=2, rate=0, output=str(data_dir / "batch"),
+                              checkpoint=None, apply=False, dry_run=False, progress_every=100)
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    args.checkpoint = args.checkpoint or os.path.join(args.output, "checkpoint_journal.jsonl")
+    return args
+
+
+def _chat_day(storage: Storage, entry_date: str):
+    storage.append_conversation([{"role": "user", "content": "oggi ho corso"},
+                                 {"role": "assistant", "content": "bene!"}], "s1", entry_date)
+
+
+def test_keys_depend_on_mode_and_model(data_dir, monkeypatch):
+    _chat_day(Storage(), "2026-10-01")
+
+    review = next(iter_journal_tasks(_args(data_dir)))["key"]
+    apply = next(iter_journal_tasks(_args(data_dir, apply=True)))["key"]
+    monkeypatch.setattr(config, "MODEL_NAME", "altro-modello")
+    other_model = next(iter_journal_tasks(_args(data_dir)))["key"]
+
+    assert len({review, apply, other_model}) == 3
+
+
+def test_apply_after_review_is_not_skipped(data_dir, fake_model):
+    storage = Storage()
+    _chat_day(storage, "2026-10-01")
+
+    review = _args(data_dir)
+    assert asyncio.run(run_batch(iter_journal_tasks(review), run_journal_task, review))["done"] == 1
+    assert storage.load_entry("2026-10-01") is None
+
+    apply = _args(data_dir, apply=True)
+    counts = asyncio.run(run_batch(iter_journal_tasks(apply), run_journal_task, apply))
+
+    assert counts == {"done": 1, "skipped": 0, "failed": 0}
+    assert storage.load_entry("2026-10-01")["entry"] == "Log rigenerato"
+
+
+def test_apply_keeps_editor_text(data_dir, fake_model):
+    storage = Storage()
+    _chat_day(storage, "2026-10-01")
+    storage.append_to_entry("Scritto a mano", {"source": "editor"}, "2026-10-01")
+    args = _args(data_dir, apply=True)
+
+    task = next(iter_journal_tasks(args))
+    asyncio.run(run_journal_task(task, args))
+
+    assert storage.load_entry("2026-10-01")["entry"] == "Scritto a mano"
+    with open(os.path.join(args.output, "_default", "entry_2026-10-01.json"), encoding="utf-8") as f:
+        assert json.load(f)["entry"] == "Log rigenerato"
+
+
+def test_checkpoint_drops_torn_line(data_dir):
+    path = str(data_dir / "checkpoint.jsonl")
+    checkpoint = Checkpoint(path)
+    checkpoint.mark("a")
+    checkpoint.close()
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"task": "b", "a')
+
+    checkpoint = Checkpoint(path)
+    checkpoint.mark("c")
+    checkpoint.close()
+
+    assert Checkpoint(path).done == {"a", "c"}
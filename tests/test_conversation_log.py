@@ -0,0 +1,86 @@
+"""
+Log append-only delle conversazioni: append per sessione, compattazione dei giorni
+conclusi e letture che uniscono parte compattata e log
+"""
+
+import os
+
+from storage import Storage
+
+
+def _messages(*texts):
+    roles = ("user", "assistant")
+    return [{"role": roles[i % 2], "content": text} for i, text in enumerate(texts)]
+
+
+def test_append_then_load_in_order(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("ciao", "come stai?"), "s1", "2026-10-01")
+    storage.append_conversation(_messages("bene"), "s1", "2026-10-01")
+
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["ciao", "come stai?", "bene"]
+
+
+def test_compact_keeps_messages_and_removes_log(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("prima", "risposta"), "s1", "2026-10-01")
+    storage.append_conversation(_messages("seconda sessione"), "s2", "2026-10-01")
+    before = storage.load_conversation("2026-10-01")
+
+    assert storage.compact_conversations(before="2026-10-02") == 1
+
+    compact_path, log_path = storage._conversation_paths("2026-10-01")
+    assert os.path.exists(compact_path)
+    assert not os.path.exists(log_path)
+    assert storage.load_conversation("2026-10-01") == before
+    assert storage._read_json(compact_path)["sessions"] == 2
+
+
+def test_append_after_compact_goes_after_compacted_part(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("mattina"), "s1", "2026-10-01")
+    storage.compact_conversations(before="2026-10-02")
+
+    storage.append_conversation(_messages("sera"), "s2", "2026-10-01")
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["mattina", "sera"]
+
+    # Una seconda compattazione unisce il log al JSON compatto esistente
+    assert storage.compact_conversations(before="2026-10-02") == 1
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["mattina", "sera"]
+    compact_path, _ = storage._conversation_paths("2026-10-01")
+    assert storage._read_json(compact_path)["sessions"] == 2
+
+
+def test_compact_skips_days_not_concluded(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("oggi"), "s1", "2026-10-05")
+
+    assert storage.compact_conversations(before="2026-10-05") == 0
+    _, log_path = storage._conversation_paths("2026-10-05")
+    assert os.path.exists(log_path)
+
+
+def test_truncated_last_line_is_ignored(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("intero"), "s1", "2026-10-01")
+    _, log_path = storage._conversation_paths("2026-10-01")
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"session": "s1", "role": "user", "cont')
+
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["intero"]
+    assert storage.compact_conversations(before="2026-10-02") == 1
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["intero"]
+
+
+def test_append_after_torn_line_is_not_lost(data_dir):
+    storage = Storage()
+    storage.append_conversation(_messages("prima"), "s1", "2026-10-01")
+    _, log_path = storage._conversation_paths("2026-10-01")
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"session": "s1", "role": "assistant", "cont')
+
+    storage.append_conversation(_messages("dopo il crash"), "s2", "2026-10-01")
+
+    assert [m["content"] for m in storage.load_conversation("2026-10-01")] == ["prima", "dopo il crash"]
+    with open(log_path, "rb") as f:
+        assert f.read().endswith(b"\n")
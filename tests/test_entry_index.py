@@ -0,0 +1,86 @@
+"""
+Freschezza dell'indice degli entries: modifiche fatte da un altro processo o a mano
+nella directory degli entries devono essere visibili senza riavviare
+"""
+
+import json
+import os
+
+from storage import Storage
+
+
+def _write_entry_file(storage: Storage, entry_date: str, text: str):
+    """Scrive un file entry direttamente su disco, senza passare da Storage"""
+    path = os.path.join(storage.entries_dir, f"entry_{entry_date}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"date": entry_date, "timestamp": f"{entry_date}T10:00:00",
+                   "entry": text, "metadata": {}}, f)
+    return path
+
+
+def test_entry_saved_by_storage_is_indexed(data_dir):
+    storage = Storage()
+    storage.save_entry("Oggi ho corso", {"source": "chat"}, "2026-10-01")
+
+    assert storage.has_entry("2026-10-01")
+    assert storage.get_recent_entry_dates(7) == ["2026-10-01"]
+    assert storage.load_entry("2026-10-01")["entry"] == "Oggi ho corso"
+
+
+def test_file_added_outside_storage_is_visible(data_dir):
+    storage = Storage()
+    storage.save_entry("primo", None, "2026-10-01")
+
+    _write_entry_file(storage, "2026-10-02", "scritto a mano")
+
+    assert storage.has_entry("2026-10-02")
+    assert storage.get_entry_dates() == ["2026-10-01", "2026-10-02"]
+    assert storage.load_entry("2026-10-02")["entry"] == "scritto a mano"
+
+
+def test_file_removed_outside_storage_disappears(data_dir):
+    storage = Storage()
+    storage.save_entry("primo", None, "2026-10-01")
+    path = _write_entry_file(storage, "2026-10-02", "scritto a mano")
+    assert storage.has_entry("2026-10-02")
+
+    os.remove(path)
+
+    assert not storage.has_entry("2026-10-02")
+    assert storage.load_entry("2026-10-02") is None
+    assert storage.get_recent_entry_dates(7) == ["2026-10-01"]
+
+
+def test_entry_saved_by_another_instance_is_visible(data_dir):
+    # Due istanze sugli stessi file, come due worker dello stesso utente
+    first, second = Storage(), Storage()
+    first.get_entry_dates()
+
+    second.save_entry("dall'altro worker", None, "2026-10-03")
+
+    assert first.has_entry("2026-10-03")
+    assert first.load_entry("2026-10-03")["entry"] == "dall'altro worker"
+
+
+def test_own_save_does_not_rebuild(data_dir, monkeypatch):
+    storage = Storage()
+    storage.save_entry("primo", None, "2026-10-01")
+
+    rebuilds = []
+    original = storage.entry_index._rebuild
+    monkeypatch.setattr(storage.entry_index, "_rebuild", lambda: rebuilds.append(1) or original())
+
+    storage.save_entry("secondo", None, "2026-10-02")
+    storage.save_entry("secondo, riscritto", None, "2026-10-02")
+
+    assert storage.get_entry_dates() == ["2026-10-01", "2026-10-02"]
+    assert rebuilds == []
+
+
+def test_index_survives_restart(data_dir):
+    Storage().save_entry("persistente", None, "2026-10-01")
+
+    reopened = Storage()
+
+    assert reopened.get_entry_dates() == ["2026-10-01"]
+    assert reopened.get_completion_bitmap(2026, 10) == 1
@@ -0,0 +1,167 @@
+"""
+Coda dei job persistente: ripresa dopo un riavvio (lease scaduto), checkpoint,
+retry solo sugli errori transitori e creazione pigra del database
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from job_queue import JobQueue
+
+
+class TransientError(Exception):
+    pass
+
+
+def _queue(data_dir, **kwargs) -> JobQueue:
+    kwargs.setdefault("lease", 1.0)
+    kwargs.setdefault("retry_delay", 0.01)
+    return JobQueue(str(data_dir / "jobs.db"), **kwargs)
+
+
+def _wait(queue: JobQueue, job_id: str, timeout: float = 5.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.01)
+    pytest.fail(f"job {job_id} non concluso: {queue.get(job_id)}")
+
+
+def _insert_running(queue: JobQueue, job_id: str, updated_at: float, result=None):
+    """Job lasciato 'running' da un processo precedente (es. container riavviato)"""
+    queue._conn().execute(
+        "INSERT INTO jobs (id, kind, user_id, status, step, payload, result, attempts, owner, "
+        "created_at, updated_at) VALUES (?, 'echo', NULL, 'running', 'generating', ?, ?, 1, "
+        "'vecchio-host:1:abcd', ?, ?)",
+        (job_id, json.dumps({"n": 1}), json.dumps(result) if result else None, updated_at, updated_at)
+    )
+
+
+def test_database_is_created_lazily(data_dir):
+    queue = _queue(data_dir)
+    assert not os.path.exists(queue.db_path)
+
+    queue.stats()
+    assert os.path.exists(queue.db_path)
+
+
+def test_submit_runs_handler(data_dir):
+    queue = _queue(data_dir)
+    queue.register("echo", lambda job, checkpoint: {"value": job["payload"]["n"] * 2})
+
+    job = _wait(queue, queue.submit("echo", "u1", {"n": 21}))
+
+    assert job["status"] == "done"
+    assert job["result"] == {"value": 42}
+    assert job["user_id"] == "u1"
+
+
+def test_start_resumes_running_job_with_expired_lease(data_dir):
+    queue = _queue(data_dir)
+    queue.register("echo", lambda job, checkpoint: {"value": job["payload"]["n"]})
+    _insert_running(queue, "orfano", time.time() - 10)
+
+    assert queue.start() == 1
+    job = _wait(queue, "orfano")
+
+    assert job["status"] == "done"
+    assert job["attempts"] == 2
+
+
+def test_start_leaves_running_job_with_live_lease(data_dir):
+    queue = _queue(data_dir, lease=60.0)
+    queue.register("echo", lambda job, checkpoint: {})
+    _insert_running(queue, "vivo", time.time())
+
+    assert queue.start() == 0
+    assert queue.get("vivo")["status"] == "running"
+
+
+def test_lease_expiring_after_start_is_recovered(data_dir):
+    queue = _queue(data_dir, lease=0.3)
+    queue.register("echo", lambda job, checkpoint: {"ripreso": True})
+    _insert_running(queue, "scade", time.time())
+    assert queue.start() == 0
+
+    # Nessun heartbeat del proprietario: il thread di heartbeat lo riprende dopo il lease
+    assert _wait(queue, "scade")["result"] == {"ripreso": True}
+
+
+def test_resumed_job_continues_from_checkpoint(data_dir):
+    queue = _queue(data_dir)
+    calls = []
+
+    def handler(job, checkpoint):
+        calls.append(dict(job["result"]))
+        if "draft" not in job["result"]:
+            checkpoint("saving", {"draft": "costoso"})
+        return {"final": job["result"].get("draft", "rigenerato")}
+
+    queue.register("echo", handler)
+    _insert_running(queue, "a-meta", time.time() - 10, result={"draft": "già fatto"})
+
+    queue.start()
+    job = _wait(queue, "a-meta")
+
+    assert calls == [{"draft": "già fatto"}]
+    assert job["result"] == {"draft": "già fatto", "final": "già fatto"}
+
+
+def test_queued_jobs_survive_restart(data_dir):
+    first = _queue(data_dir)
+    first._conn().execute(
+        "INSERT INTO jobs (id, kind, user_id, status, step, payload, created_at, updated_at) "
+        "VALUES ('in-coda', 'echo', NULL, 'queued', 'queued', '{}', ?, ?)",
+        (time.time(), time.time())
+    )
+
+    restarted = _queue(data_dir)
+    restarted.register("echo", lambda job, checkpoint: {"ok": True})
+    assert restarted.start() == 1
+    assert _wait(restarted, "in-coda")["status"] == "done"
+
+
+def test_transient_errors_are_retried(data_dir):
+    queue = _queue(data_dir, max_attempts=3)
+    attempts = []
+
+    def handler(job, checkpoint):
+        attempts.append(job["attempts"])
+        if len(attempts) < 3:
+            raise TransientError("provider non disponibile")
+        return {"ok": True}
+
+    queue.register("echo", handler, retry_on=(TransientError,))
+    job = _wait(queue, queue.submit("echo", None, {}))
+
+    assert job["status"] == "done"
+    assert attempts == [1, 2, 3]
+
+
+def test_permanent_errors_fail_at_once(data_dir):
+    queue = _queue(data_dir, max_attempts=3)
+    queue.register("echo", lambda job, checkpoint: 1 / 0, retry_on=(TransientError,))
+
+    job = _wait(queue, queue.submit("echo", None, {}))
+
+    assert job["status"] == "failed"
+    assert job["attempts"] == 1
+    assert "division by zero" in job["error"]
+
+
+def test_transient_errors_stop_after_max_attempts(data_dir):
+    queue = _queue(data_dir, max_attempts=2)
+
+    def handler(job, checkpoint):
+        raise TransientError("sempre giù")
+
+    queue.register("echo", handler, retry_on=(TransientError,))
+    job = _wait(queue, queue.submit("echo", None, {}))
+
+    assert job["status"] == "failed"
+    assert job["attempts"] == 2
@@ -0,0 +1,207 @@
+"""
+Circuit breaker e politica di trasporto delle chiamate LLM: transizioni
+closed -> open -> half_open, retry solo sugli errori transitori, errori a metà stream
+"""
+
+import time
+
+import httpx
+import openai
+import pytest
+
+import config
+import llm_client
+import llm_transport
+from llm_transport import CircuitBreaker, CircuitOpenError, DeadlineExceeded, TransportPolicy
+
+
+def _connection_error():
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://test/v1/chat/completions"))
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(config, "LLM_RETRY_ATTEMPTS", 3)
+    monkeypatch.setattr(config, "LLM_RETRY_BASE_DELAY", 0.001)
+    monkeypatch.setattr(config, "LLM_RETRY_MAX_DELAY", 0.001)
+    monkeypatch.setattr(config, "LLM_HEDGE_ENABLED", False)
+
+
+# ========== CIRCUIT BREAKER ==========
+
+def test_breaker_opens_after_threshold():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    for _ in range(2):
+        breaker.on_failure()
+    breaker.allow()
+    assert breaker.state == "closed"
+
+    breaker.on_failure()
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    assert breaker.stats()["trips"] == 1
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+    breaker.on_failure()
+    breaker.on_failure()
+    breaker.on_success()
+    breaker.on_failure()
+
+    assert breaker.state == "closed"
+    assert breaker.failures == 1
+
+
+def test_half_open_allows_a_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    time.sleep(0.06)
+
+    breaker.allow()
+    assert breaker.state == "half_open"
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_successful_probe_closes_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.on_failure()
+    time.sleep(0.06)
+    breaker.allow()
+
+    breaker.on_success()
+
+    assert breaker.state == "closed"
+    breaker.allow()
+
+
+def test_failed_probe_reopens_circuit():
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.05)
+    for _ in range(5):
+        breaker.on_failure()
+    time.sleep(0.06)
+    breaker.allow()
+
+    breaker.on_failure()
+
+    assert breaker.state == "open"
+    assert breaker.stats()["trips"] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+
+def test_zero_threshold_disables_breaker():
+    breaker = CircuitBreaker(failure_threshold=0, reset_timeout=60)
+    for _ in range(10):
+        breaker.on_failure()
+    breaker.allow()
+    assert breaker.state == "closed"
+
+
+# ========== POLITICA DI TRASPORTO ==========
+
+def test_transient_errors_are_retried_then_succeed(fast_retries):
+    policy = TransportPolicy()
+    attempts = []
+
+    def send(timeout):
+        attempts.append(timeout)
+        if len(attempts) < 3:
+            raise _connection_error()
+        return "ok"
+
+    assert policy.call("test", send) == "ok"
+    assert len(attempts) == 3
+    assert policy.breaker.state == "closed"
+    assert policy.breaker.failures == 0
+
+
+def test_repeated_transient_errors_trip_the_breaker(fast_retries, monkeypatch):
+    monkeypatch.setattr(config, "LLM_RETRY_ATTEMPTS", 1)
+    policy = TransportPolicy()
+    policy.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+
+    def send(timeout):
+        raise _connection_error()
+
+    for _ in range(2):
+        with pytest.raises(openai.APIConnectionError):
+            policy.call("test", send)
+
+    with pytest.raises(CircuitOpenError):
+        policy.call("test", send)
+
+
+def test_non_transient_errors_are_not_retried(fast_retries):
+    policy = TransportPolicy()
+    attempts = []
+
+    def send(timeout):
+        attempts.append(timeout)
+        raise ValueError("richiesta non valida")
+
+    with pytest.raises(ValueError):
+        policy.call("test", send)
+    assert len(attempts) == 1
+    assert policy.breaker.failures == 0
+
+
+# ========== STREAM ==========
+
+class _Chunk:
+    def __init__(self, text):
+        self.choices = [type("Choice", (), {"delta": type("Delta", (), {"content": text})()})()]
+        self.usage = None
+
+
+class _FakeStream:
+    def __init__(self, chunks, error=None, delay=0.0):
+        self.chunks = chunks
+        self.error = error
+        self.delay = delay
+        self.closed = False
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            if self.closed:
+                return
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        self.closed = True
+
+
+def test_error_mid_stream_counts_for_breaker(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    monkeypatch.setattr(llm_transport.transport, "breaker", breaker)
+    stream = llm_client.InstrumentedStream(_FakeStream([_Chunk("ciao")], error=_connection_error()),
+                                           "test", "gpt-4o-mini", time.perf_counter(),
+                                           time.monotonic() + 30)
+
+    with pytest.raises(openai.APIConnectionError):
+        list(stream)
+    assert breaker.state == "open"
+
+
+def test_stream_is_cut_at_deadline(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=60)
+    monkeypatch.setattr(llm_transport.transport, "breaker", breaker)
+    fake = _FakeStream([_Chunk("x")] * 50, delay=0.02)
+    stream = llm_client.InstrumentedStream(fake, "test", "gpt-4o-mini", time.perf_counter(),
+                                           time.monotonic() + 0.1)
+
+    received = []
+    with pytest.raises(DeadlineExceeded):
+        for chunk in stream:
+            received.append(chunk)
+
+    assert 0 < len(received) < 50
+    assert fake.closed
+    assert breaker.failures == 1
@@ -0,0 +1,62 @@
+"""
+Identificazione dell'utente dietro il proxy: l'header utente vale solo col segreto
+del proxy e in modalità multi-utente non si ripiega mai sulla directory condivisa
+"""
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def client(data_dir, monkeypatch):
+    monkeypatch.setattr(config, "SECRET_KEY", "test")
+    monkeypatch.setattr(config, "OPENAI_API_KEY", config.OPENAI_API_KEY or "test")
+    import app
+    return app.app.test_client()
+
+
+@pytest.fixture
+def multi_user(monkeypatch):
+    monkeypatch.setattr(config, "REQUIRE_USER_HEADER", True)
+    monkeypatch.setattr(config, "PROXY_SECRET", "segreto")
+
+
+def _user(user_id=None, secret=None):
+    headers = {}
+    if user_id is not None:
+        headers[config.USER_ID_HEADER] = user_id
+    if secret is not None:
+        headers[config.PROXY_SECRET_HEADER] = secret
+    return headers
+
+
+def test_single_user_mode_needs_no_header(client):
+    assert client.get("/api/llm/metrics").status_code == 200
+
+
+@pytest.mark.parametrize("headers", [
+    _user(),
+    _user("alice"),
+    _user("alice", "sbagliato"),
+    _user(secret="segreto"),
+])
+def test_multi_user_rejects_unauthenticated_requests(client, multi_user, headers):
+    assert client.get("/api/llm/metrics", headers=headers).status_code == 401
+
+
+def test_multi_user_accepts_proxy_requests(client, multi_user):
+    assert client.get("/api/llm/metrics", headers=_user("alice", "segreto")).status_code == 200
+
+
+def test_multi_user_without_secret_rejects_everything(client, monkeypatch):
+    monkeypatch.setattr(config, "REQUIRE_USER_HEADER", True)
+
+    assert client.get("/api/llm/metrics", headers=_user("alice")).status_code == 401
+
+
+def test_secret_is_checked_in_single_user_mode(client, monkeypatch):
+    monkeypatch.setattr(config, "PROXY_SECRET", "segreto")
+
+    assert client.get("/api/llm/metrics", headers=_user("alice")).status_code == 401
+    assert client.get("/api/llm/metrics", headers=_user("alice", "segreto")).status_code == 200
@@ -3,21 +3,51 @@ Wellness Agent - Agente AI per suggerimenti personalizzati sul benessere mentale
 Analizza i log dell'utente e fornisce consigli basati sui pattern rilevati
 """
 
-from openai import OpenAI
+import asyncio
+import json
+import os
+import random
+from datetime import date, datetime
 from typing import List, Dict, Optional
 import config
-from storage import Storage
+import prompts
+from llm_cache import cache_key, response_cache
+from llm_client import acomplete, complete, get_client
+from storage import create_storage
+
+
+QUICK_TIPS = [
+    "💧 Ricordati di bere acqua! L'idratazione influenza anche l'umore.",
+    "🌤️ Prova a passare 10 minuti alla luce naturale oggi.",
+    "📱 Fai una pausa dagli schermi per 20 minuti.",
+    "🎵 Ascolta una canzone che ti fa stare bene.",
+    "🙏 Ringrazia qualcuno oggi, anche per piccole cose.",
+    "✍️ Scrivi una cosa che hai fatto bene oggi.",
+    "🧘 3 respiri profondi adesso. Inspira... espira...",
+    "💪 Fai stretching per 5 minuti, il tuo corpo ti ringrazierà.",
+]
+
+
+def get_quick_tip() -> str:
+    """Quick tip giornaliero (non serve un agente né una chiamata AI)"""
+    return random.choice(QUICK_TIPS)
+
+
+# Rigenerazioni dei suggerimenti in corso sull'event loop, una per utente (chiave: dati dell'utente)
+_refresh_tasks: Dict[str, asyncio.Task] = {}
+
 
 class WellnessAgent:
     """Agente AI specializzato per analisi e suggerimenti di benessere"""
     
-    def __init__(self):
-        """Inizializza l'agente wellness"""
-        if not config.OPENAI_API_KEY:
-            raise ValueError("OPENAI_API_KEY non trovata!")
-        
-        self.client = OpenAI(api_key=config.OPENAI_API_KEY)
-        self.storage = Storage()
+    def __init__(self, storage=None):
+        """
+        Inizializza l'agente wellness
+        storage: storage dell'utente da analizzare (default: create_storage())
+        Il client LLM si ottiene solo quando si generano suggerimenti: quelli salvati
+        si servono anche senza OPENAI_API_KEY
+        """
+        self.storage = storage or create_storage(config.DEFAULT_USER_ID)
     
     def get_personalized_suggestions(self, num_days: int = 7) -> Dict:
         """
@@ -65,69 +95,127 @@ class WellnessAgent:
         
         return "\n".join(context_parts)
     
-    def _generate_ai_suggestions(self, context: str) -> Dict:
-        """Chiama OpenAI per generare suggerimenti personalizzati"""
-        
-        system_prompt = """Sei un wellness coach esperto e empatico. 
-        
-Il tuo compito:
-1. Analizzare i diari recenti dell'utente
-2. Identificare pattern emotivi (stress, felicità, energie, problemi ricorrenti)
-3. Fornire 3-4 suggerimenti CONCRETI e PERSONALIZZATI per migliorare il benessere
-
-Regole:
-- Sii empatico e non giudicante
-- Suggerimenti pratici e attuabili
-- Basati sui pattern specifici dell'utente, non generici
-- Breve e diretto (max 2-3 frasi per suggerimento)
-- Usa emoji appropriati ma con moderazione
-
-Formato risposta JSON:
-{
-    "summary": "Breve osservazione su come sta l'utente (2 frasi max)",
-    "patterns": ["pattern1", "pattern2"],
-    "suggestions": [
-        {
-            "title": "Titolo suggerimento",
-            "description": "Descrizione pratica"
-        }
-    ]
-}
+    async def aget_personalized_suggestions(self, num_days: int = 7) -> Dict:
+        """Versione asincrona di get_personalized_suggestions()"""
+        recent_entries = await asyncio.to_thread(self.storage.get_recent_entries, num_days)
 
-IMPORTANTE: NON usare emoji nei suggerimenti, solo testo pulito."""
+        if not recent_entries:
+            return self._get_default_suggestions()
 
-        user_prompt = f"""{context}
+        request = self._suggestions_request(self._build_context(recent_entries))
+        try:
+            response = await acomplete("_generate_ai_suggestions", cache=True, **request)
+            return self._parse_suggestions(response)
 
-Basandoti SOLO su questi diari, genera suggerimenti personalizzati.
+        except Exception as e:
+            response_cache.invalidate(cache_key(request))
+            print(f"Errore generazione suggerimenti AI: {e}")
+            return self._get_default_suggestions()
 
-IMPORTANTE: Rispondi SOLO con un oggetto JSON valido, senza altro testo."""
+    # ========== CACHE PERSISTENTE (stale-while-revalidate) ==========
 
-        try:
-            response = self.client.chat.completions.create(
-                model=config.MODEL_NAME,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=800,
-                temperature=0.7
-            )
+    async def aget_cached_suggestions(self, num_days: int = config.SUGGESTIONS_CACHE_DAYS) -> Dict:
+        """
+        Suggerimenti salvati con i dati dell'utente, validi finché l'impronta degli ultimi
+        num_days entries non cambia ("cache": "fresh"). Se è cambiata si rispondono subito
+        quelli salvati ("stale") e si rigenerano in background; senza suggerimenti salvati
+        si generano ora ("miss"). I suggerimenti di default non vengono mai salvati
+        """
+        if not config.SUGGESTIONS_CACHE_ENABLED:
+            return await self.aget_personalized_suggestions(num_days)
+
+        fingerprint = await asyncio.to_thread(self.storage.entries_fingerprint, num_days)
+        cached = await asyncio.to_thread(self.storage.load_suggestions)
+
+        if cached is not None:
+            state = "fresh" if cached.get("fingerprint") == fingerprint else "stale"
+            if state == "stale":
+                self._schedule_refresh(num_days)
+            return {**cached["data"], "cache": state, "generated_at": cached.get("generated_at")}
+
+        cached = await self._arefresh_suggestions(num_days)
+        if cached is None:
+            return {**self._get_default_suggestions(), "cache": "miss", "generated_at": None}
+        return {**cached["data"], "cache": "miss", "generated_at": cached["generated_at"]}
+
+    def _refresh_key(self) -> str:
+        """Identifica i dati dell'utente (file SQLite o directory JSON)"""
+        return getattr(self.storage, "db_path", None) or self.storage.data_dir
+
+    def _schedule_refresh(self, num_days: int):
+        """Avvia la rigenerazione in background, se non ce n'è già una per lo stesso utente"""
+        key = self._refresh_key()
+        if key in _refresh_tasks:
+            return
+        task = asyncio.get_running_loop().create_task(self._arefresh_suggestions(num_days))
+        _refresh_tasks[key] = task
+        task.add_done_callback(lambda _: _refresh_tasks.pop(key, None))
+
+    async def _arefresh_suggestions(self, num_days: int) -> Optional[Dict]:
+        """
+        Rigenera e salva i suggerimenti
+        Returns: il record salvato ({fingerprint, date, generated_at, data}) o None se
+                 non ci sono entries o la generazione è fallita
+        """
+        # Impronta letta prima degli entries: un entry salvato durante la generazione
+        # la rende subito vecchia e la richiesta successiva rigenera di nuovo
+        fingerprint = await asyncio.to_thread(self.storage.entries_fingerprint, num_days)
+        recent_entries = await asyncio.to_thread(self.storage.get_recent_entries, num_days)
+        if not recent_entries:
+            return None
 
-            response_text = response.choices[0].message.content.strip()
+        request = self._suggestions_request(self._build_context(recent_entries))
+        try:
+            response = await acomplete("_generate_ai_suggestions", cache=True, **request)
+            suggestions = self._parse_suggestions(response)
 
-            # Rimuovi markdown se presente
-            response_text = response_text.replace("```json", "").replace("```", "").strip()
+        except Exception as e:
+            response_cache.invalidate(cache_key(request))
+            print(f"Errore generazione suggerimenti AI: {e}")
+            return None
 
-            # Parse JSON
-            import json
-            suggestions = json.loads(response_text)
+        cached = {
+            "fingerprint": fingerprint,
+            "date": date.today().isoformat(),
+            "generated_at": datetime.now().isoformat(),
+            "data": suggestions
+        }
+        await asyncio.to_thread(self.storage.save_suggestions, cached)
+        return cached
 
-            return suggestions
+    def _generate_ai_suggestions(self, context: str) -> Dict:
+        """Chiama OpenAI per generare suggerimenti personalizzati"""
+        request = self._suggestions_request(context)
+        try:
+            response = complete("_generate_ai_suggestions", get_client(), cache=True, **request)
+            return self._parse_suggestions(response)
 
         except Exception as e:
+            # Una risposta non valida non deve restare in cache
+            response_cache.invalidate(cache_key(request))
             print(f"Errore generazione suggerimenti AI: {e}")
             return self._get_default_suggestions()
 
+    def _suggestions_request(self, context: str) -> Dict:
+        """Parametri della richiesta per i suggerimenti personalizzati"""
+        return {
+            "model": config.MODEL_NAME,
+            "messages": prompts.suggestions_messages(context),
+            "max_tokens": 800,
+            "temperature": 0.7
+        }
+
+    @staticmethod
+    def _parse_suggestions(response) -> Dict:
+        """Estrae il JSON dei suggerimenti dalla risposta del modello"""
+        response_text = response.choices[0].message.content.strip()
+
+        # Rimuovi markdown se presente
+        response_text = response_text.replace("```json", "").replace("```", "").strip()
+
+        # Parse JSON
+        return json.loads(response_text)
+
     def _get_default_suggestions(self) -> Dict:
         """Suggerimenti di default se non ci sono log o errori"""
         return {
@@ -155,16 +243,13 @@ IMPORTANTE: Rispondi SOLO con un oggetto JSON valido, senza altro testo."""
 
     def get_quick_tip(self) -> str:
         """Genera un quick tip giornaliero"""
-        tips = [
-            "💧 Ricordati di bere acqua! L'idratazione influenza anche l'umore.",
-            "🌤️ Prova a passare 10 minuti alla luce naturale oggi.",
-            "📱 Fai una pausa dagli schermi per 20 minuti.",
-            "🎵 Ascolta una canzone che ti fa stare bene.",
-            "🙏 Ringrazia qualcuno oggi, anche per piccole cose.",
-            "✍️ Scrivi una cosa che hai fatto bene oggi.",
-            "🧘 3 respiri profondi adesso. Inspira... espira...",
-            "💪 Fai stretching per 5 minuti, il tuo corpo ti ringrazierà.",
-        ]
-
-        import random
-        return random.choice(tips)
\ No newline at end of file
+        return get_quick_tip()
+
+
+def _reset_after_fork():
+    # I task appartengono all'event loop del processo padre, che nel figlio non gira
+    _refresh_tasks.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)